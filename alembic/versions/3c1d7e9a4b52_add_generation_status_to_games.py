@@ -0,0 +1,28 @@
+"""Add generation_status to games
+
+Revision ID: 3c1d7e9a4b52
+Revises: bf38f3b102e2
+Create Date: 2026-10-18 09:12:41.532871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c1d7e9a4b52'
+down_revision: Union[str, None] = 'bf38f3b102e2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Games created before background generation already have their puzzles
+    op.add_column('games', sa.Column('generation_status', sa.String(), nullable=True, server_default='completed'))
+    op.alter_column('games', 'generation_status', server_default=None)
+
+
+def downgrade() -> None:
+    op.drop_column('games', 'generation_status')
@@ -0,0 +1,133 @@
+"""Add normalized and accepted answers to puzzles
+
+Revision ID: 4b7d1e3a9c20
+Revises: e2a9c4f7b861
+Create Date: 2026-10-18 14:21:09.447120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import re
+import unicodedata
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b7d1e3a9c20'
+down_revision: Union[str, None] = 'e2a9c4f7b861'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Answer normalization as it stood when this revision was written, frozen so that replaying
+# history gives the same stored forms whatever app/services/answer_matching.py becomes
+SEPARATOR = "|"
+
+ARTICLES = {"a", "an", "the"}
+
+_UNITS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14,
+    "fifteen": 15, "sixteen": 16, "seventeen": 17, "eighteen": 18, "nineteen": 19,
+}
+_TENS = {
+    "twenty": 20, "thirty": 30, "forty": 40, "fifty": 50, "sixty": 60, "seventy": 70, "eighty": 80, "ninety": 90,
+}
+_SCALES = {"hundred": 100, "thousand": 1000, "million": 1000000}
+
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def _strip_accents(text: str):
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def _number_words_to_digits(tokens: list):
+    # "twenty one" -> "21", "one hundred and five" -> "105"; other words pass through
+    output = []
+    total = current = 0
+    in_number = False
+
+    def flush():
+        nonlocal total, current, in_number
+        if in_number:
+            output.append(str(total + current))
+        total = current = 0
+        in_number = False
+
+    for index, token in enumerate(tokens):
+        if token in _UNITS:
+            current += _UNITS[token]
+            in_number = True
+        elif token in _TENS:
+            current += _TENS[token]
+            in_number = True
+        elif token in _SCALES and in_number:
+            scale = _SCALES[token]
+            if scale == 100:
+                current = max(current, 1) * scale
+            else:
+                total += max(current, 1) * scale
+                current = 0
+        elif token == "and" and in_number and index + 1 < len(tokens) and (
+                tokens[index + 1] in _UNITS or tokens[index + 1] in _TENS):
+            continue
+        else:
+            flush()
+            output.append(token)
+    flush()
+    return output
+
+
+def _normalize_answer(text: str):
+    if not text:
+        return ""
+    text = _strip_accents(text).casefold()
+    tokens = _NON_WORD.sub(" ", text).split()
+    tokens = _number_words_to_digits(tokens)
+    # Articles are dropped unless they are the whole answer (e.g. the letter "A")
+    without_articles = [token for token in tokens if token not in ARTICLES]
+    return " ".join(without_articles or tokens)
+
+
+def _accepted_forms(answer: str, alternatives: list = None):
+    forms = []
+    for candidate in [answer] + list(alternatives or []):
+        form = _normalize_answer(candidate)
+        if form and form not in forms:
+            forms.append(form)
+    return forms
+
+
+def _encode_forms(forms: list):
+    return SEPARATOR + SEPARATOR.join(forms) + SEPARATOR if forms else ""
+
+
+def upgrade() -> None:
+    op.add_column('puzzles', sa.Column('normalized_answer', sa.String(), nullable=True))
+    op.add_column('puzzles', sa.Column('accepted_answers', sa.String(), nullable=True))
+
+    # Normalization lives in Python, so existing answers are backfilled row by row
+    puzzles = sa.table(
+        'puzzles',
+        sa.column('id', sa.Integer()),
+        sa.column('answer', sa.String()),
+        sa.column('normalized_answer', sa.String()),
+        sa.column('accepted_answers', sa.String()),
+    )
+    connection = op.get_bind()
+    rows = connection.execute(sa.select(puzzles.c.id, puzzles.c.answer)).fetchall()
+    for puzzle_id, answer in rows:
+        forms = _accepted_forms(answer or "")
+        connection.execute(
+            puzzles.update()
+            .where(puzzles.c.id == puzzle_id)
+            .values(normalized_answer=forms[0] if forms else "", accepted_answers=_encode_forms(forms))
+        )
+
+
+def downgrade() -> None:
+    op.drop_column('puzzles', 'accepted_answers')
+    op.drop_column('puzzles', 'normalized_answer')
@@ -0,0 +1,42 @@
+"""Add crew_stage_outputs table
+
+Revision ID: 5e8a2c7d1f93
+Revises: b61e8c4d2f07
+Create Date: 2026-10-18 18:41:12.508316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e8a2c7d1f93'
+down_revision: Union[str, None] = 'b61e8c4d2f07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'crew_stage_outputs',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('stage', sa.String(), nullable=False),
+        sa.Column('cache_key', sa.String(), nullable=False),
+        sa.Column('prompt_version', sa.String(), nullable=False),
+        sa.Column('output', sa.Text(), nullable=False),
+        sa.Column('hits', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('last_used_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('cache_key')
+    )
+    op.create_index(op.f('ix_crew_stage_outputs_id'), 'crew_stage_outputs', ['id'], unique=False)
+    op.create_index(op.f('ix_crew_stage_outputs_last_used_at'), 'crew_stage_outputs', ['last_used_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_crew_stage_outputs_last_used_at'), table_name='crew_stage_outputs')
+    op.drop_index(op.f('ix_crew_stage_outputs_id'), table_name='crew_stage_outputs')
+    op.drop_table('crew_stage_outputs')
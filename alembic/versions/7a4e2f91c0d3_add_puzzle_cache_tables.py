@@ -0,0 +1,55 @@
+"""Add puzzle cache tables
+
+Revision ID: 7a4e2f91c0d3
+Revises: 3c1d7e9a4b52
+Create Date: 2026-10-18 10:03:17.244190
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7a4e2f91c0d3'
+down_revision: Union[str, None] = '3c1d7e9a4b52'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'cached_puzzles',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('theme', sa.String(), nullable=True),
+        sa.Column('age_group', sa.String(), nullable=True),
+        sa.Column('difficulty_bucket', sa.Integer(), nullable=True),
+        sa.Column('question', sa.String(), nullable=True),
+        sa.Column('answer', sa.String(), nullable=True),
+        sa.Column('hint', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_cached_puzzles_id'), 'cached_puzzles', ['id'], unique=False)
+    op.create_index('ix_cached_puzzles_key', 'cached_puzzles', ['theme', 'age_group', 'difficulty_bucket'], unique=False)
+    op.create_table(
+        'cached_puzzle_deliveries',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('cached_puzzle_id', sa.Integer(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['cached_puzzle_id'], ['cached_puzzles.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('cached_puzzle_id', 'user_id', name='uq_cached_puzzle_deliveries_puzzle_user')
+    )
+    op.create_index(op.f('ix_cached_puzzle_deliveries_id'), 'cached_puzzle_deliveries', ['id'], unique=False)
+    op.create_index(op.f('ix_cached_puzzle_deliveries_user_id'), 'cached_puzzle_deliveries', ['user_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_cached_puzzle_deliveries_user_id'), table_name='cached_puzzle_deliveries')
+    op.drop_index(op.f('ix_cached_puzzle_deliveries_id'), table_name='cached_puzzle_deliveries')
+    op.drop_table('cached_puzzle_deliveries')
+    op.drop_index('ix_cached_puzzles_key', table_name='cached_puzzles')
+    op.drop_index(op.f('ix_cached_puzzles_id'), table_name='cached_puzzles')
+    op.drop_table('cached_puzzles')
@@ -0,0 +1,152 @@
+"""Renormalize puzzle answers after the number word fix
+
+Revision ID: 7c3f9b2e4a18
+Revises: 5e8a2c7d1f93
+Create Date: 2026-10-19 09:12:40.318254
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import re
+import unicodedata
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c3f9b2e4a18'
+down_revision: Union[str, None] = '5e8a2c7d1f93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Answer normalization as it stood when this revision was written, frozen so that replaying
+# history gives the same stored forms whatever app/services/answer_matching.py becomes
+SEPARATOR = "|"
+
+ARTICLES = {"a", "an", "the"}
+
+_UNITS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14,
+    "fifteen": 15, "sixteen": 16, "seventeen": 17, "eighteen": 18, "nineteen": 19,
+}
+_TENS = {
+    "twenty": 20, "thirty": 30, "forty": 40, "fifty": 50, "sixty": 60, "seventy": 70, "eighty": 80, "ninety": 90,
+}
+_SCALES = {"hundred": 100, "thousand": 1000, "million": 1000000}
+
+_NON_WORD = re.compile(r"[\W_]+")
+# "2,000" and "2 000" are one number; groups must be exactly three digits so "1 2 3" is untouched
+_THOUSANDS_SEPARATOR = re.compile(r"(?<![\d,.])(\d{1,3})((?:[,\u00a0\u202f ]\d{3})+)(?![\d,.]?\d)")
+
+
+def _strip_accents(text: str):
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def _number_words_to_digits(tokens: list):
+    # "twenty one" -> "21", "one hundred and five" -> "105", "two thousand" -> "2000". Words only
+    # combine through a tens word or a scale word, so "one two three" stays "1 2 3" and
+    # "nineteen eighty four" becomes "19 84"; other words pass through
+    output = []
+    total = current = 0
+    last = None  # kind of the previous number word: "unit", "tens", "hundred" or "scale"
+    last_scale = 0
+
+    def flush():
+        nonlocal total, current, last, last_scale
+        if last is not None:
+            output.append(str(total + current))
+        total = current = 0
+        last = None
+        last_scale = 0
+
+    for index, token in enumerate(tokens):
+        if token in _UNITS:
+            value = _UNITS[token]
+            if last in ("hundred", "scale") or (last == "tens" and 1 <= value <= 9):
+                current += value
+            else:
+                flush()
+                current = value
+            last = "unit"
+        elif token in _TENS:
+            if last in ("hundred", "scale"):
+                current += _TENS[token]
+            else:
+                flush()
+                current = _TENS[token]
+            last = "tens"
+        elif token == "hundred" and last in ("unit", "tens") and current < 100:
+            current *= 100
+            last = "hundred"
+        elif (token in _SCALES and token != "hundred" and last in ("unit", "tens", "hundred")
+                and (not last_scale or _SCALES[token] < last_scale)):
+            total += current * _SCALES[token]
+            current = 0
+            last = "scale"
+            last_scale = _SCALES[token]
+        elif token == "and" and last in ("hundred", "scale") and index + 1 < len(tokens) and (
+                tokens[index + 1] in _UNITS or tokens[index + 1] in _TENS):
+            continue
+        else:
+            flush()
+            output.append(token)
+    flush()
+    return output
+
+
+def _normalize_answer(text: str):
+    if not text:
+        return ""
+    text = _strip_accents(text).casefold()
+    text = _THOUSANDS_SEPARATOR.sub(lambda m: m.group(1) + re.sub(r"\D", "", m.group(2)), text)
+    tokens = _NON_WORD.sub(" ", text).split()
+    tokens = _number_words_to_digits(tokens)
+    # Articles are dropped unless they are the whole answer (e.g. the letter "A")
+    without_articles = [token for token in tokens if token not in ARTICLES]
+    return " ".join(without_articles or tokens)
+
+
+def _accepted_forms(answer: str, alternatives: list = None):
+    forms = []
+    for candidate in [answer] + list(alternatives or []):
+        form = _normalize_answer(candidate)
+        if form and form not in forms:
+            forms.append(form)
+    return forms
+
+
+def _encode_forms(forms: list):
+    return SEPARATOR + SEPARATOR.join(forms) + SEPARATOR if forms else ""
+
+
+def _decode_forms(encoded: str):
+    return [form for form in (encoded or "").split(SEPARATOR) if form]
+
+
+def upgrade() -> None:
+    # Answers are renormalized from the raw answer; the stored alternative forms are kept and
+    # renormalized too, since the original alternatives are not stored anywhere else
+    puzzles = sa.table(
+        'puzzles',
+        sa.column('id', sa.Integer()),
+        sa.column('answer', sa.String()),
+        sa.column('normalized_answer', sa.String()),
+        sa.column('accepted_answers', sa.String()),
+    )
+    connection = op.get_bind()
+    rows = connection.execute(sa.select(puzzles.c.id, puzzles.c.answer, puzzles.c.accepted_answers)).fetchall()
+    for puzzle_id, answer, accepted_answers in rows:
+        forms = _accepted_forms(answer or "", _decode_forms(accepted_answers)[1:])
+        connection.execute(
+            puzzles.update()
+            .where(puzzles.c.id == puzzle_id)
+            .values(normalized_answer=forms[0] if forms else "", accepted_answers=_encode_forms(forms))
+        )
+
+
+def downgrade() -> None:
+    pass
@@ -0,0 +1,26 @@
+"""Add generation_error to games
+
+Revision ID: 8e1b4d6a2c57
+Revises: 7c3f9b2e4a18
+Create Date: 2026-10-19 09:48:02.715903
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e1b4d6a2c57'
+down_revision: Union[str, None] = '7c3f9b2e4a18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('games', sa.Column('generation_error', sa.Text(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('games', 'generation_error')
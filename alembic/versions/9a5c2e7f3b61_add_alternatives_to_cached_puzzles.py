@@ -0,0 +1,26 @@
+"""Add alternatives to cached_puzzles
+
+Revision ID: 9a5c2e7f3b61
+Revises: 8e1b4d6a2c57
+Create Date: 2026-10-19 10:31:27.604418
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a5c2e7f3b61'
+down_revision: Union[str, None] = '8e1b4d6a2c57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('cached_puzzles', sa.Column('alternatives', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('cached_puzzles', 'alternatives')
@@ -0,0 +1,43 @@
+"""Add adaptive difficulty statistics to games, users and puzzles
+
+Revision ID: 9d3f6b2e5a14
+Revises: 4b7d1e3a9c20
+Create Date: 2026-10-18 15:02:48.203561
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d3f6b2e5a14'
+down_revision: Union[str, None] = '4b7d1e3a9c20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('games', sa.Column('skill_rating', sa.Float(), nullable=True))
+    op.add_column('games', sa.Column('ewma_attempts', sa.Float(), nullable=True))
+    op.add_column('games', sa.Column('ewma_time_spent', sa.Float(), nullable=True))
+    op.add_column('games', sa.Column('rated_puzzles', sa.Integer(), nullable=True, server_default='0'))
+    op.add_column('users', sa.Column('skill_rating', sa.Float(), nullable=True))
+    op.add_column('users', sa.Column('rated_puzzles', sa.Integer(), nullable=True, server_default='0'))
+    op.add_column('puzzles', sa.Column('solved_on_attempt', sa.Integer(), nullable=True))
+    op.alter_column('games', 'rated_puzzles', server_default=None)
+    op.alter_column('users', 'rated_puzzles', server_default=None)
+    # Best available record for puzzles solved before the attempt was tracked;
+    # run scripts/recalibrate_difficulty.py afterwards to seed the skill ratings
+    op.execute("UPDATE puzzles SET solved_on_attempt = attempts WHERE solved")
+
+
+def downgrade() -> None:
+    op.drop_column('puzzles', 'solved_on_attempt')
+    op.drop_column('users', 'rated_puzzles')
+    op.drop_column('users', 'skill_rating')
+    op.drop_column('games', 'rated_puzzles')
+    op.drop_column('games', 'ewma_time_spent')
+    op.drop_column('games', 'ewma_attempts')
+    op.drop_column('games', 'skill_rating')
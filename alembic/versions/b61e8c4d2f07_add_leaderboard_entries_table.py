@@ -0,0 +1,48 @@
+"""Add leaderboard_entries table
+
+Revision ID: b61e8c4d2f07
+Revises: 9d3f6b2e5a14
+Create Date: 2026-10-18 15:48:30.615274
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b61e8c4d2f07'
+down_revision: Union[str, None] = '9d3f6b2e5a14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'leaderboard_entries',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('scope', sa.String(), nullable=False),
+        sa.Column('scope_value', sa.String(), nullable=False),
+        sa.Column('period', sa.String(), nullable=False),
+        sa.Column('period_start', sa.Date(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('score', sa.Integer(), nullable=False),
+        sa.Column('puzzles_solved', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('scope', 'scope_value', 'period', 'period_start', 'user_id', name='uq_leaderboard_entries_key')
+    )
+    op.create_index(op.f('ix_leaderboard_entries_id'), 'leaderboard_entries', ['id'], unique=False)
+    op.create_index(
+        'ix_leaderboard_entries_rank',
+        'leaderboard_entries',
+        ['scope', 'scope_value', 'period', 'period_start', sa.text('score DESC'), 'user_id'],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_leaderboard_entries_rank', table_name='leaderboard_entries')
+    op.drop_index(op.f('ix_leaderboard_entries_id'), table_name='leaderboard_entries')
+    op.drop_table('leaderboard_entries')
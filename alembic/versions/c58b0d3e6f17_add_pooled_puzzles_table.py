@@ -0,0 +1,42 @@
+"""Add pooled_puzzles table
+
+Revision ID: c58b0d3e6f17
+Revises: 7a4e2f91c0d3
+Create Date: 2026-10-18 11:26:52.901334
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c58b0d3e6f17'
+down_revision: Union[str, None] = '7a4e2f91c0d3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'pooled_puzzles',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('theme', sa.String(), nullable=True),
+        sa.Column('age_group', sa.String(), nullable=True),
+        sa.Column('difficulty_band', sa.Integer(), nullable=True),
+        sa.Column('difficulty', sa.Float(), nullable=True),
+        sa.Column('question', sa.String(), nullable=True),
+        sa.Column('answer', sa.String(), nullable=True),
+        sa.Column('hint', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_pooled_puzzles_id'), 'pooled_puzzles', ['id'], unique=False)
+    op.create_index('ix_pooled_puzzles_band', 'pooled_puzzles', ['theme', 'age_group', 'difficulty_band'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_pooled_puzzles_band', table_name='pooled_puzzles')
+    op.drop_index(op.f('ix_pooled_puzzles_id'), table_name='pooled_puzzles')
+    op.drop_table('pooled_puzzles')
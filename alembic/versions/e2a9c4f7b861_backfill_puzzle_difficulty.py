@@ -0,0 +1,28 @@
+"""Backfill puzzle difficulty and default it in the database
+
+Revision ID: e2a9c4f7b861
+Revises: c58b0d3e6f17
+Create Date: 2026-10-18 13:04:17.318206
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a9c4f7b861'
+down_revision: Union[str, None] = 'c58b0d3e6f17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Replaces the backfill GameService used to do (and commit) on every read
+    op.execute("UPDATE puzzles SET difficulty = 1.0 WHERE difficulty IS NULL")
+    op.alter_column('puzzles', 'difficulty', existing_type=sa.Float(), nullable=False, server_default='1.0')
+
+
+def downgrade() -> None:
+    op.alter_column('puzzles', 'difficulty', existing_type=sa.Float(), nullable=True, server_default=None)
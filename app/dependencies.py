@@ -0,0 +1,28 @@
+# app/dependencies.py
+
+from fastapi import Depends, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.utils.database import get_async_db
+from app.services.game_service import GameService
+from app.services.leaderboard_service import LeaderboardService
+
+# Shared services are created once in the application lifespan (see app/main.py)
+
+def get_llm_service(request: Request):
+    return request.app.state.llm_service
+
+def get_multiagent_service(request: Request):
+    return request.app.state.multiagent_service
+
+def get_rag_service(request: Request):
+    return request.app.state.rag_service
+
+def get_puzzle_pool(request: Request):
+    return request.app.state.puzzle_pool
+
+def get_game_service(db: AsyncSession = Depends(get_async_db), llm_service=Depends(get_llm_service),
+                     puzzle_pool=Depends(get_puzzle_pool)):
+    return GameService(db, llm_service, puzzle_pool)
+
+def get_leaderboard_service(db: AsyncSession = Depends(get_async_db)):
+    return LeaderboardService(db)
@@ -1,34 +1,118 @@
 import os
-from fastapi import FastAPI
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from dotenv import load_dotenv
-from .routes import game, user
-from .utils.database import engine, Base
-from .utils.logger import setup_logger
+from .routes import game, user, metrics, leaderboard
+from .utils.database import engine, async_engine, Base
+from .utils.logger import correlation_id, new_correlation_id, setup_logger
+from .utils.telemetry import instrument_engine, registry, request_trace, setup_tracing
+from .services.llm_service import LLMService, create_http_client
+from .services.multiagent_service import MultiagentService, create_crew_llm
+from .services.rag_service import RAGService, THEMES_FILE
+from .services.generation_service import resume_pending_generations, shutdown_generation_workers, start_generation_workers
+from .services.puzzle_pool import create_puzzle_pool
 
 # Load environment variables
 load_dotenv()
 
-# Create FastAPI app
-app = FastAPI(title="AI-Enhanced Escape Room Game")
-
 # Set up logging
 logger = setup_logger()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("Application starting up...")
+    # Long-lived clients shared by every request: one HTTP connection pool for OpenAI
+    # chat and embedding calls, one set of CrewAI agents and one FAISS index.
+    http_client = create_http_client()
+    app.state.llm_service = LLMService(http_client=http_client)
+    app.state.multiagent_service = MultiagentService(llm=create_crew_llm())
+    app.state.rag_service = RAGService(http_client=http_client)
+    # Load (or build once) the persisted FAISS index so game creation never re-embeds the corpus
+    try:
+        app.state.rag_service.load_index(THEMES_FILE)
+    except Exception as e:
+        logger.warning(f"Could not load RAG index at startup: {str(e)}")
+    start_generation_workers()
+    app.state.puzzle_pool = create_puzzle_pool(app.state.llm_service)
+    if app.state.puzzle_pool:
+        app.state.puzzle_pool.start()
+    try:
+        await resume_pending_generations(
+            app.state.llm_service, app.state.multiagent_service, app.state.rag_service, app.state.puzzle_pool
+        )
+    except Exception as e:
+        logger.error(f"Could not re-queue pending game generations: {str(e)}")
+
+    yield
+
+    logger.info("Application shutting down...")
+    await shutdown_generation_workers()
+    if app.state.puzzle_pool:
+        app.state.puzzle_pool.stop()
+    http_client.close()
+    await async_engine.dispose()
+
+# Create FastAPI app
+app = FastAPI(title="AI-Enhanced Escape Room Game", lifespan=lifespan)
+
 # Create database tables
 Base.metadata.create_all(bind=engine)
 
+# Time every query as the "db" stage, for the API (async) and the background workers (sync)
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+if setup_tracing(app):
+    logger.info("OpenTelemetry tracing enabled")
+
+@app.middleware("http")
+async def record_request_timings(request: Request, call_next):
+    # Per-stage timings of this request go out in the Server-Timing header, LLM usage in X-LLM-*
+    with request_trace() as trace:
+        started = time.perf_counter()
+        response = await call_next(request)
+    timing = trace.server_timing()
+    if timing:
+        response.headers["Server-Timing"] = timing
+    if trace.llm_calls:
+        response.headers["X-LLM-Tokens"] = str(trace.prompt_tokens + trace.completion_tokens)
+        response.headers["X-LLM-Cost"] = f"{trace.cost:.6f}"
+    response.body_iterator = _observe_after_body(request, response.status_code, response.body_iterator, trace, timing, started)
+    return response
+
+async def _observe_after_body(request: Request, status: int, body, trace, sent_timing: str, started: float):
+    # The route keeps running while a streamed body (SSE, NDJSON export) is sent, so the latency
+    # is taken at the last chunk, and stages that finished after the headers went out are logged
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        elapsed = time.perf_counter() - started
+        route = request.scope.get("route")
+        path = route.path if route else "unmatched"
+        registry.observe_request(request.method, path, status, elapsed)
+        if trace.server_timing() != sent_timing:
+            logger.info(f"Timings for {request.method} {path} after its headers were sent: {trace.summary()}")
+
+@app.middleware("http")
+async def assign_correlation_id(request: Request, call_next):
+    # Registered last, so it runs first: every log line of the request carries this id.
+    # A caller-supplied X-Request-ID is kept so ids match across services.
+    request_id = request.headers.get("X-Request-ID", "")[:128] or new_correlation_id()
+    token = correlation_id.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        correlation_id.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 # Include routers
 app.include_router(game.router)
 app.include_router(user.router)
-
-@app.on_event("startup")
-async def startup_event():
-    logger.info("Application starting up...")
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    logger.info("Application shutting down...")
+app.include_router(metrics.router)
+app.include_router(leaderboard.router)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Float, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, Date, DateTime, Float, Boolean, Index, JSON, Text, UniqueConstraint
 from sqlalchemy.orm import relationship
 from app.utils.database import Base
 import datetime
@@ -11,6 +11,9 @@ class User(Base):
     username = Column(String, unique=True, index=True)
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
+    # Running Elo-style skill across all of the player's games (see services/difficulty.py)
+    skill_rating = Column(Float)
+    rated_puzzles = Column(Integer, default=0)
     games = relationship("Game", back_populates="user")
 
     model_config = ConfigDict(from_attributes=True)
@@ -26,6 +29,13 @@ class Game(Base):
     score = Column(Integer, default=0)
     start_time = Column(DateTime, default=datetime.datetime.utcnow)
     end_time = Column(DateTime)
+    generation_status = Column(String, default="pending")
+    generation_error = Column(Text)
+    # Running statistics updated on every first solve, so picking the next difficulty is O(1)
+    skill_rating = Column(Float)
+    ewma_attempts = Column(Float)
+    ewma_time_spent = Column(Float)
+    rated_puzzles = Column(Integer, default=0)
     user = relationship("User", back_populates="games")
     puzzles = relationship("Puzzle", back_populates="game")
 
@@ -38,11 +48,101 @@ class Puzzle(Base):
     game_id = Column(Integer, ForeignKey("games.id"))
     question = Column(String)
     answer = Column(String)
+    # Precomputed by answer_matching: the canonical form, and every accepted form as "|a|b|"
+    normalized_answer = Column(String)
+    accepted_answers = Column(String)
     hints = Column(String)
-    difficulty = Column(Float, default=1.0)
+    difficulty = Column(Float, default=1.0, server_default="1.0", nullable=False)
     attempts = Column(Integer, default=0)
     time_spent = Column(Float, default=0.0)
     solved = Column(Boolean, default=False)
+    solved_on_attempt = Column(Integer)
     game = relationship("Game", back_populates="puzzles")
 
-    model_config = ConfigDict(from_attributes=True)
\ No newline at end of file
+    model_config = ConfigDict(from_attributes=True)
+
+class CachedPuzzle(Base):
+    __tablename__ = "cached_puzzles"
+
+    id = Column(Integer, primary_key=True, index=True)
+    theme = Column(String)
+    age_group = Column(String)
+    difficulty_bucket = Column(Integer)
+    question = Column(String)
+    answer = Column(String)
+    hint = Column(String)
+    alternatives = Column(JSON)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_cached_puzzles_key", "theme", "age_group", "difficulty_bucket"),
+    )
+
+class CachedPuzzleDelivery(Base):
+    __tablename__ = "cached_puzzle_deliveries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    cached_puzzle_id = Column(Integer, ForeignKey("cached_puzzles.id", ondelete="CASCADE"))
+    user_id = Column(Integer, index=True)
+
+    __table_args__ = (
+        UniqueConstraint("cached_puzzle_id", "user_id", name="uq_cached_puzzle_deliveries_puzzle_user"),
+    )
+
+class PooledPuzzle(Base):
+    __tablename__ = "pooled_puzzles"
+
+    id = Column(Integer, primary_key=True, index=True)
+    theme = Column(String)
+    age_group = Column(String)
+    difficulty_band = Column(Integer)
+    difficulty = Column(Float)
+    question = Column(String)
+    answer = Column(String)
+    hint = Column(String)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_pooled_puzzles_band", "theme", "age_group", "difficulty_band"),
+    )
+
+class LeaderboardEntry(Base):
+    # Incrementally maintained by LeaderboardService.record on every first solve
+    __tablename__ = "leaderboard_entries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    scope = Column(String, nullable=False)  # global, theme or age_group
+    scope_value = Column(String, nullable=False, default="")
+    period = Column(String, nullable=False)  # all, day, week or month
+    period_start = Column(Date, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    score = Column(Integer, nullable=False, default=0)
+    puzzles_solved = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("scope", "scope_value", "period", "period_start", "user_id", name="uq_leaderboard_entries_key"),
+    )
+
+# Serves each leaderboard page as an index range scan in (score DESC, user_id) order
+Index(
+    "ix_leaderboard_entries_rank",
+    LeaderboardEntry.scope,
+    LeaderboardEntry.scope_value,
+    LeaderboardEntry.period,
+    LeaderboardEntry.period_start,
+    LeaderboardEntry.score.desc(),
+    LeaderboardEntry.user_id,
+)
+
+class CrewStageOutput(Base):
+    # One cached CrewAI task result, keyed by the stage's inputs and prompt version (see crew_cache.py)
+    __tablename__ = "crew_stage_outputs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    stage = Column(String, nullable=False)
+    cache_key = Column(String, nullable=False, unique=True)
+    prompt_version = Column(String, nullable=False)
+    output = Column(Text, nullable=False)
+    hits = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
@@ -1,11 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.utils.database import get_db
+from fastapi.responses import StreamingResponse
+from app.dependencies import get_game_service, get_llm_service, get_multiagent_service, get_puzzle_pool, get_rag_service
+from app.utils.database import AsyncSessionLocal
 from app.utils.logger import setup_logger
-from app.services.game_service import GameService
-from app.services.rag_service import RAGService
-from app.services.multiagent_service import MultiagentService
+from app.services.game_service import GameService, TransactionConflict
+from app.services.generation_service import submit_game_generation
 from pydantic import BaseModel
+from typing import List
+import json
 
 # Set up logging
 logger = setup_logger()
@@ -23,120 +25,114 @@ class AnswerSubmit(BaseModel):
     puzzle_id: int
     answer: str
 
+class AnswerBatch(BaseModel):
+    attempts: List[AnswerSubmit]
+
 class PuzzlePerformance(BaseModel):
     time_spent: float
     attempts: int
     solved: bool
 
 @router.post("/games/{game_id}/puzzles")
-def generate_puzzle(game_id: int, db: Session = Depends(get_db)):
-    game_service = GameService(db)
+async def generate_puzzle(game_id: int, game_service: GameService = Depends(get_game_service)):
     try:
-        puzzle = game_service.generate_dynamic_puzzle(game_id)
+        puzzle = await game_service.generate_dynamic_puzzle(game_id)
         return puzzle
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _sse(event: str, data: dict):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/games/{game_id}/puzzles/stream")
+async def stream_puzzle(game_id: int, llm_service=Depends(get_llm_service), puzzle_pool=Depends(get_puzzle_pool)):
+    async def event_stream():
+        # The stream outlives the request's dependencies, so it owns its session
+        db = AsyncSessionLocal()
+        game_service = GameService(db, llm_service, puzzle_pool)
+        try:
+            async for event, value in game_service.stream_dynamic_puzzle(game_id):
+                if event == "token":
+                    yield _sse("token", {"text": value})
+                else:
+                    yield _sse("puzzle", {
+                        "id": value.id,
+                        "question": value.question,
+                        "answer": value.answer,
+                        "hint": value.hints,
+                        "difficulty": value.difficulty
+                    })
+        except Exception as e:
+            yield _sse("error", {"detail": str(e)})
+        finally:
+            await db.close()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/puzzles/{puzzle_id}/performance")
-def update_puzzle_performance(puzzle_id: int, performance: PuzzlePerformance, db: Session = Depends(get_db)):
-    game_service = GameService(db)
+async def update_puzzle_performance(puzzle_id: int, performance: PuzzlePerformance, game_service: GameService = Depends(get_game_service)):
     try:
-        updated_puzzle = game_service.update_puzzle_performance(
+        updated_puzzle = await game_service.update_puzzle_performance(
             puzzle_id, performance.time_spent, performance.attempts, performance.solved
         )
         return updated_puzzle
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
-@router.post("/games")
-def create_game(game: GameCreate, db: Session = Depends(get_db)):
-    game_service = GameService(db)
-    rag_service = RAGService()
-    multiagent_service = MultiagentService()
-
+@router.post("/games", status_code=202)
+async def create_game(game: GameCreate, game_service: GameService = Depends(get_game_service),
+                multiagent_service=Depends(get_multiagent_service), rag_service=Depends(get_rag_service)):
     try:
-        # Create the game
-        new_game = game_service.create_game(game.user_id, game.theme, game.difficulty, game.age_group)
-
-        # Generate game content using the multiagent service
-        try:
-            game_content = multiagent_service.generate_game_content(game.theme, game.age_group, game.difficulty)
-            game_content_str = str(game_content)  # Convert CrewOutput to string
-        except Exception as e:
-            logger.error(f"Error generating game content: {str(e)}")
-            game_content_str = f"Default content for {game.theme}"
-
-        # Use RAG to enhance the game content
-        try:
-            rag_service.load_data("data/sample_themes.json")
-            enhanced_content = rag_service.query(game_content_str)
-        except Exception as e:
-            logger.warning(f"RAG service failed: {str(e)}. Proceeding with original game content.")
-            enhanced_content = [game_content_str]
-
-        # Generate puzzles based on the enhanced content
-        puzzles = []
-        for content in enhanced_content:
-            try:
-                puzzle = game_service.generate_dynamic_puzzle(new_game.id)
-                puzzles.append(puzzle)
-            except Exception as e:
-                logger.error(f"Error generating puzzle: {str(e)}")
+        # Create the game; content and puzzles are generated in the background
+        new_game = await game_service.create_game(game.user_id, game.theme, game.difficulty, game.age_group)
+        submit_game_generation(
+            new_game.id, game_service.llm_service, multiagent_service, rag_service, game_service.puzzle_pool
+        )
 
         return {
             "game_id": new_game.id,
             "theme": new_game.theme,
             "difficulty": new_game.difficulty,
             "age_group": new_game.age_group,
-            "puzzles": [
-                {
-                    "id": p.id,
-                    "question": p.question,
-                    "hints": p.hints,
-                    "difficulty": p.difficulty,
-                    "answer": p.answer if game.user_id == 1 else "Hidden"  # Only show answer for admin (user_id 1)
-                } for p in puzzles
-            ]
+            "generation_status": new_game.generation_status,
+            "puzzles": []
         }
     except Exception as e:
         logger.error(f"Error creating game: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/games/{game_id}/puzzles")
-def generate_puzzle(game_id: int, db: Session = Depends(get_db)):
-    game_service = GameService(db)
+@router.post("/puzzles/check-answer")
+async def check_answer(answer_submit: AnswerSubmit, game_service: GameService = Depends(get_game_service)):
     try:
-        puzzle = game_service.generate_puzzle(game_id)
-        return puzzle
+        is_correct, feedback, points = await game_service.check_answer(answer_submit.puzzle_id, answer_submit.answer)
+        return {"is_correct": is_correct, "feedback": feedback, "points": points}
+    except TransactionConflict as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/puzzles/check-answer")
-def check_answer(answer_submit: AnswerSubmit, db: Session = Depends(get_db)):
-    game_service = GameService(db)
+@router.post("/puzzles/check-answers")
+async def check_answers(batch: AnswerBatch, game_service: GameService = Depends(get_game_service)):
     try:
-        is_correct, feedback = game_service.check_answer(answer_submit.puzzle_id, answer_submit.answer)
-        return {"is_correct": is_correct, "feedback": feedback}
+        results = await game_service.check_answers([(attempt.puzzle_id, attempt.answer) for attempt in batch.attempts])
+        return {"results": results}
+    except TransactionConflict as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/games/{game_id}")
-def get_game_state(game_id: int, db: Session = Depends(get_db)):
-    game_service = GameService(db)
+async def get_game_state(game_id: int, game_service: GameService = Depends(get_game_service)):
     try:
-        game = game_service.get_game(game_id)
-        if not game:
+        state = await game_service.get_game_state(game_id)
+        if not state:
             raise HTTPException(status_code=404, detail="Game not found")
-        
-        puzzles = game_service.get_game_puzzles(game_id)
-        return {
-            "game_id": game.id,
-            "theme": game.theme,
-            "difficulty": game.difficulty,
-            "score": game.score,
-            "start_time": game.start_time,
-            "end_time": game.end_time,
-            "puzzles": puzzles
-        }
+        return state
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -0,0 +1,37 @@
+# app/routes/leaderboard.py
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from app.dependencies import get_leaderboard_service
+from app.services.leaderboard_service import LeaderboardService, SCOPE_AGE_GROUP, SCOPE_GLOBAL, SCOPE_THEME
+import datetime
+
+router = APIRouter()
+
+PERIOD_PATTERN = "^(all|day|week|month)$"
+
+async def _page(leaderboard_service: LeaderboardService, scope: str, scope_value: str, period: str,
+                day: datetime.date, limit: int, after: str):
+    try:
+        return await leaderboard_service.page(scope, scope_value, period, day, limit, after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/leaderboard")
+async def global_leaderboard(period: str = Query("all", pattern=PERIOD_PATTERN), day: datetime.date = None,
+                             limit: int = Query(50, ge=1, le=200), after: str = None,
+                             leaderboard_service: LeaderboardService = Depends(get_leaderboard_service)):
+    return await _page(leaderboard_service, SCOPE_GLOBAL, "", period, day, limit, after)
+
+@router.get("/leaderboard/themes/{theme}")
+async def theme_leaderboard(theme: str, period: str = Query("all", pattern=PERIOD_PATTERN), day: datetime.date = None,
+                            limit: int = Query(50, ge=1, le=200), after: str = None,
+                            leaderboard_service: LeaderboardService = Depends(get_leaderboard_service)):
+    return await _page(leaderboard_service, SCOPE_THEME, theme, period, day, limit, after)
+
+@router.get("/leaderboard/age-groups/{age_group}")
+async def age_group_leaderboard(age_group: str, period: str = Query("all", pattern=PERIOD_PATTERN), day: datetime.date = None,
+                                limit: int = Query(50, ge=1, le=200), after: str = None,
+                                leaderboard_service: LeaderboardService = Depends(get_leaderboard_service)):
+    return await _page(leaderboard_service, SCOPE_AGE_GROUP, age_group, period, day, limit, after)
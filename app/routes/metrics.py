@@ -0,0 +1,53 @@
+# app/routes/metrics.py
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from app.services.puzzle_cache import get_puzzle_cache
+from app.dependencies import get_llm_service, get_multiagent_service, get_puzzle_pool
+from app.utils.database import async_engine, engine, pool_status
+from app.utils.telemetry import registry
+
+router = APIRouter()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    # Prometheus text exposition: stage and request latency histograms, LLM tokens and cost
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/metrics/puzzle-cache")
+def puzzle_cache_metrics():
+    puzzle_cache = get_puzzle_cache()
+    if puzzle_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **puzzle_cache.stats()}
+
+@router.get("/metrics/puzzle-pool")
+def puzzle_pool_metrics(puzzle_pool=Depends(get_puzzle_pool)):
+    if puzzle_pool is None:
+        return {"enabled": False}
+    return {"enabled": True, **puzzle_pool.metrics()}
+
+@router.get("/metrics/crew-cache")
+def crew_cache_metrics(multiagent_service=Depends(get_multiagent_service)):
+    if multiagent_service.crew_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **multiagent_service.crew_cache.stats()}
+
+@router.get("/metrics/single-flight")
+def single_flight_metrics(llm_service=Depends(get_llm_service), multiagent_service=Depends(get_multiagent_service)):
+    # How many identical in-flight generations were served by another caller's upstream call
+    return {
+        "generate_puzzle": llm_service.single_flight.stats() if llm_service.single_flight else {"enabled": False},
+        "generate_game_content": (
+            multiagent_service.single_flight.stats() if multiagent_service.single_flight else {"enabled": False}
+        ),
+    }
+
+@router.get("/metrics/llm")
+def llm_metrics(llm_service=Depends(get_llm_service)):
+    return llm_service.stats()
+
+@router.get("/metrics/db-pool")
+def db_pool_metrics():
+    # "async" serves the API routes; "sync" serves background workers (puzzle pool, cache)
+    return {"async": pool_status(async_engine.sync_engine), "sync": pool_status(engine)}
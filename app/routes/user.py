@@ -1,19 +1,31 @@
 # app/routes/user.py
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.utils.database import get_db
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.utils.database import AsyncSessionLocal, get_async_db
 from app.models.models import User
+from app.services.credentials import hash_password, needs_rehash, verify_password, verify_unknown_user
 from pydantic import BaseModel, EmailStr
-from typing import List
+from typing import List, Optional
+import json
 
 router = APIRouter()
 
+# Only the columns UserResponse exposes; listing users never loads password hashes
+USER_COLUMNS = (User.id, User.username, User.email)
+EXPORT_BATCH_SIZE = 1000
+
 class UserCreate(BaseModel):
     username: str
     email: EmailStr
     password: str
 
+class UserLogin(BaseModel):
+    email: EmailStr
+    password: str
+
 class UserResponse(BaseModel):
     id: int
     username: str
@@ -23,45 +35,87 @@ class UserResponse(BaseModel):
         orm_mode = True
 
 @router.post("/users/", response_model=UserResponse)
-def create_user(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = (await db.execute(select(User.id).filter(User.email == user.email))).first()
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    new_user = User(username=user.username, email=user.email, hashed_password=user.password)  # In a real app, hash the password!
+    new_user = User(username=user.username, email=user.email, hashed_password=await hash_password(user.password))
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
+@router.post("/users/login", response_model=UserResponse)
+async def login(credentials: UserLogin, db: AsyncSession = Depends(get_async_db)):
+    db_user = (await db.execute(select(User).filter(User.email == credentials.email))).scalars().first()
+    if db_user is None:
+        await verify_unknown_user(credentials.password)
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    if not await verify_password(credentials.password, db_user.hashed_password):
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    # Upgrade hashes made with an older cost (or stored before hashing) while we have the password
+    if needs_rehash(db_user.hashed_password):
+        db_user.hashed_password = await hash_password(credentials.password)
+        await db.commit()
+    return db_user
+
 @router.get("/users/", response_model=List[UserResponse])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = db.query(User).offset(skip).limit(limit).all()
+async def read_users(response: Response, skip: int = 0, limit: int = Query(100, ge=1, le=1000),
+                     after_id: Optional[int] = None, db: AsyncSession = Depends(get_async_db)):
+    # Pass after_id (the X-Next-After-Id header of the previous page) for keyset pagination,
+    # which stays fast on deep pages; skip is kept for existing clients
+    query = select(*USER_COLUMNS).order_by(User.id).limit(limit)
+    if after_id is not None:
+        query = query.filter(User.id > after_id)
+    else:
+        query = query.offset(skip)
+    users = (await db.execute(query)).mappings().all()
+    if len(users) == limit:
+        response.headers["X-Next-After-Id"] = str(users[-1]["id"])
     return users
 
+@router.get("/users/export")
+async def export_users():
+    # Newline-delimited JSON of every user, read in keyset batches. The stream outlives the
+    # request's dependencies, so it owns its session.
+    async def rows():
+        async with AsyncSessionLocal() as db:
+            last_id = 0
+            while True:
+                batch = (await db.execute(
+                    select(*USER_COLUMNS).filter(User.id > last_id).order_by(User.id).limit(EXPORT_BATCH_SIZE)
+                )).mappings().all()
+                if not batch:
+                    break
+                yield "".join(json.dumps(dict(row)) + "\n" for row in batch)
+                last_id = batch[-1]["id"]
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
+
 @router.get("/users/{user_id}", response_model=UserResponse)
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.id == user_id).first()
+async def read_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_user = (await db.execute(select(*USER_COLUMNS).filter(User.id == user_id))).mappings().first()
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
 
 @router.put("/users/{user_id}", response_model=UserResponse)
-def update_user(user_id: int, user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.id == user_id).first()
+async def update_user(user_id: int, user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.get(User, user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     db_user.username = user.username
     db_user.email = user.email
-    db_user.hashed_password = user.password  # In a real app, hash the password!
-    db.commit()
-    db.refresh(db_user)
+    db_user.hashed_password = await hash_password(user.password)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 @router.delete("/users/{user_id}", response_model=UserResponse)
-def delete_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.id == user_id).first()
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.get(User, user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    db.delete(db_user)
-    db.commit()
+    await db.delete(db_user)
+    await db.commit()
     return db_user
\ No newline at end of file
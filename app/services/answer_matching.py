@@ -0,0 +1,181 @@
+from dataclasses import dataclass
+import os
+import re
+import unicodedata
+
+# Normalized answers are stored as "|form one|form two|" so the database can match with LIKE
+SEPARATOR = "|"
+
+ARTICLES = {"a", "an", "the"}
+
+_UNITS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14,
+    "fifteen": 15, "sixteen": 16, "seventeen": 17, "eighteen": 18, "nineteen": 19,
+}
+_TENS = {
+    "twenty": 20, "thirty": 30, "forty": 40, "fifty": 50, "sixty": 60, "seventy": 70, "eighty": 80, "ninety": 90,
+}
+_SCALES = {"hundred": 100, "thousand": 1000, "million": 1000000}
+
+_NON_WORD = re.compile(r"[\W_]+")
+# "2,000" and "2 000" are one number; groups must be exactly three digits so "1 2 3" is untouched
+_THOUSANDS_SEPARATOR = re.compile(r"(?<![\d,.])(\d{1,3})((?:[,\u00a0\u202f ]\d{3})+)(?![\d,.]?\d)")
+
+# An attempt is "close" within this many edits per character of the answer (at least one edit),
+# or when this share of its words match
+CLOSE_DISTANCE_RATIO = float(os.getenv("ANSWER_CLOSE_DISTANCE_RATIO", "0.25"))
+CLOSE_TOKEN_SIMILARITY = float(os.getenv("ANSWER_CLOSE_TOKEN_SIMILARITY", "0.5"))
+
+
+def _strip_accents(text: str):
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def _number_words_to_digits(tokens: list):
+    # "twenty one" -> "21", "one hundred and five" -> "105", "two thousand" -> "2000". Words only
+    # combine through a tens word or a scale word, so "one two three" stays "1 2 3" and
+    # "nineteen eighty four" becomes "19 84"; other words pass through
+    output = []
+    total = current = 0
+    last = None  # kind of the previous number word: "unit", "tens", "hundred" or "scale"
+    last_scale = 0
+
+    def flush():
+        nonlocal total, current, last, last_scale
+        if last is not None:
+            output.append(str(total + current))
+        total = current = 0
+        last = None
+        last_scale = 0
+
+    for index, token in enumerate(tokens):
+        if token in _UNITS:
+            value = _UNITS[token]
+            if last in ("hundred", "scale") or (last == "tens" and 1 <= value <= 9):
+                current += value
+            else:
+                flush()
+                current = value
+            last = "unit"
+        elif token in _TENS:
+            if last in ("hundred", "scale"):
+                current += _TENS[token]
+            else:
+                flush()
+                current = _TENS[token]
+            last = "tens"
+        elif token == "hundred" and last in ("unit", "tens") and current < 100:
+            current *= 100
+            last = "hundred"
+        elif (token in _SCALES and token != "hundred" and last in ("unit", "tens", "hundred")
+                and (not last_scale or _SCALES[token] < last_scale)):
+            total += current * _SCALES[token]
+            current = 0
+            last = "scale"
+            last_scale = _SCALES[token]
+        elif token == "and" and last in ("hundred", "scale") and index + 1 < len(tokens) and (
+                tokens[index + 1] in _UNITS or tokens[index + 1] in _TENS):
+            continue
+        else:
+            flush()
+            output.append(token)
+    flush()
+    return output
+
+
+def normalize_answer(text: str):
+    if not text:
+        return ""
+    text = _strip_accents(text).casefold()
+    text = _THOUSANDS_SEPARATOR.sub(lambda m: m.group(1) + re.sub(r"\D", "", m.group(2)), text)
+    tokens = _NON_WORD.sub(" ", text).split()
+    tokens = _number_words_to_digits(tokens)
+    # Articles are dropped unless they are the whole answer (e.g. the letter "A")
+    without_articles = [token for token in tokens if token not in ARTICLES]
+    return " ".join(without_articles or tokens)
+
+
+def accepted_forms(answer: str, alternatives: list = None):
+    forms = []
+    for candidate in [answer] + list(alternatives or []):
+        form = normalize_answer(candidate)
+        if form and form not in forms:
+            forms.append(form)
+    return forms
+
+
+def encode_forms(forms: list):
+    return SEPARATOR + SEPARATOR.join(forms) + SEPARATOR if forms else ""
+
+
+def decode_forms(encoded: str):
+    return [form for form in (encoded or "").split(SEPARATOR) if form]
+
+
+def bounded_distance(a: str, b: str, max_distance: int):
+    # Damerau-Levenshtein (optimal string alignment) that gives up as soon as every
+    # alignment in a row exceeds max_distance; returns max_distance + 1 in that case
+    if a == b:
+        return 0
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    if len(a) > len(b):
+        a, b = b, a
+
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        row_min = current[0]
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (previous_previous is not None and j > 1
+                    and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                value = min(value, previous_previous[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return min(previous[len(b)], max_distance + 1)
+
+
+def token_similarity(a: str, b: str):
+    # Dice coefficient over the words of two normalized answers
+    tokens_a, tokens_b = set(a.split()), set(b.split())
+    if not tokens_a or not tokens_b:
+        return 0.0
+    return 2 * len(tokens_a & tokens_b) / (len(tokens_a) + len(tokens_b))
+
+
+@dataclass
+class MatchResult:
+    is_correct: bool
+    is_close: bool
+    distance: int = None
+    similarity: float = 0.0
+
+
+def match_answer(attempt: str, forms: list, attempt_is_normalized: bool = False):
+    normalized = attempt if attempt_is_normalized else normalize_answer(attempt)
+    if not normalized or not forms:
+        return MatchResult(is_correct=False, is_close=False)
+    if normalized in forms:
+        return MatchResult(is_correct=True, is_close=True, distance=0, similarity=1.0)
+
+    best_distance = None
+    best_similarity = 0.0
+    is_close = False
+    for form in forms:
+        max_distance = max(1, int(len(form) * CLOSE_DISTANCE_RATIO))
+        distance = bounded_distance(normalized, form, max_distance)
+        similarity = token_similarity(normalized, form)
+        if distance <= max_distance or similarity >= CLOSE_TOKEN_SIMILARITY:
+            is_close = True
+        if best_distance is None or distance < best_distance:
+            best_distance = distance
+        best_similarity = max(best_similarity, similarity)
+    return MatchResult(is_correct=False, is_close=is_close, distance=best_distance, similarity=best_similarity)
@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import bcrypt
+import hmac
+import os
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# bcrypt releases the GIL while hashing, so a small thread pool gives real parallelism and keeps
+# the event loop free. The pool bounds how many hashes run at once; extra logins queue.
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1)))),
+    thread_name_prefix="password-hash",
+)
+
+# Verified against when the user does not exist, so unknown emails take as long as wrong passwords;
+# it must use the same cost as real hashes or the response time gives unknown emails away
+_DUMMY_HASH = bcrypt.hashpw(b"dummy-password", bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
+
+
+def _is_bcrypt(stored: str):
+    return bool(stored) and stored.startswith(("$2a$", "$2b$", "$2y$"))
+
+
+def hash_password_sync(password: str, rounds: int = None):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=rounds or BCRYPT_ROUNDS)).decode("utf-8")
+
+
+def verify_password_sync(password: str, stored: str):
+    if not _is_bcrypt(stored):
+        # Accounts created before hashing stored the password itself; needs_rehash upgrades them
+        return stored is not None and hmac.compare_digest(password.encode("utf-8"), stored.encode("utf-8"))
+    return bcrypt.checkpw(password.encode("utf-8"), stored.encode("utf-8"))
+
+
+def needs_rehash(stored: str, rounds: int = None):
+    if not _is_bcrypt(stored):
+        return True
+    return int(stored.split("$")[2]) != (rounds or BCRYPT_ROUNDS)
+
+
+async def hash_password(password: str):
+    return await asyncio.get_running_loop().run_in_executor(_executor, hash_password_sync, password)
+
+
+async def verify_password(password: str, stored: str):
+    return await asyncio.get_running_loop().run_in_executor(_executor, verify_password_sync, password, stored)
+
+
+async def verify_unknown_user(password: str):
+    # Spends the same work as a real check; the result is always a failed login
+    await asyncio.get_running_loop().run_in_executor(_executor, bcrypt.checkpw, password.encode("utf-8"), _DUMMY_HASH)
+    return False
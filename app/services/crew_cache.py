@@ -0,0 +1,141 @@
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from app.models.models import CrewStageOutput
+from app.utils.database import SessionLocal
+from app.utils.logger import setup_logger
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+logger = setup_logger()
+
+
+def stage_key(stage: str, prompt_version: str, inputs: dict):
+    # inputs hold the stage's own parameters and the outputs of the stages it builds on
+    payload = json.dumps({"stage": stage, "version": prompt_version, "inputs": inputs}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CrewStageCache:
+    # Persists each CrewAI task output in crew_stage_outputs. Entries expire after ttl seconds;
+    # beyond max_entries the least recently used go first, and entries made with an older
+    # prompt version of a stage are dropped as soon as eviction runs.
+    def __init__(self, ttl: float, max_entries: int, evict_every: int = 100, session_factory=SessionLocal):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.session_factory = session_factory
+        # stage -> current prompt version, set by MultiagentService for scheduled evictions
+        self.prompt_versions = {}
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evicted = 0
+        self.errors = 0
+        self._stats_lock = threading.Lock()
+
+    def _count(self, counter: str, amount: int = 1):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + amount)
+            return getattr(self, counter)
+
+    def get(self, stage: str, cache_key: str):
+        db = self.session_factory()
+        try:
+            cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.ttl)
+            output = db.execute(
+                update(CrewStageOutput)
+                .where(CrewStageOutput.cache_key == cache_key, CrewStageOutput.created_at >= cutoff)
+                .values(hits=CrewStageOutput.hits + 1, last_used_at=datetime.datetime.utcnow())
+                .returning(CrewStageOutput.output)
+            ).scalar()
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error reading crew cache for stage {stage}: {str(e)}")
+            self._count("errors")
+            output = None
+        finally:
+            db.close()
+        self._count("hits" if output is not None else "misses")
+        return output
+
+    def put(self, stage: str, cache_key: str, prompt_version: str, output: str):
+        db = self.session_factory()
+        try:
+            # An expired row under the same key is replaced
+            db.execute(delete(CrewStageOutput).where(CrewStageOutput.cache_key == cache_key))
+            db.add(CrewStageOutput(stage=stage, cache_key=cache_key, prompt_version=prompt_version, output=output))
+            db.commit()
+        except IntegrityError:
+            # Another worker cached the same stage at the same time; either output will do
+            db.rollback()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error writing crew cache for stage {stage}: {str(e)}")
+            self._count("errors")
+            return
+        finally:
+            db.close()
+        if self._count("stores") % self.evict_every == 0:
+            self.evict()
+
+    def evict(self, prompt_versions: dict = None):
+        # prompt_versions maps stage -> current version; rows of other versions can never hit again
+        db = self.session_factory()
+        try:
+            removed = 0
+            cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.ttl)
+            removed += db.execute(delete(CrewStageOutput).where(CrewStageOutput.created_at < cutoff)).rowcount
+            for stage, version in (prompt_versions or self.prompt_versions).items():
+                removed += db.execute(delete(CrewStageOutput).where(
+                    CrewStageOutput.stage == stage, CrewStageOutput.prompt_version != version
+                )).rowcount
+            keep = select(CrewStageOutput.id).order_by(CrewStageOutput.last_used_at.desc()).limit(self.max_entries)
+            removed += db.execute(delete(CrewStageOutput).where(CrewStageOutput.id.notin_(keep))).rowcount
+            db.commit()
+            if removed:
+                logger.info(f"Evicted {removed} crew cache entries")
+                self._count("evicted", removed)
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error evicting crew cache entries: {str(e)}")
+            self._count("errors")
+        finally:
+            db.close()
+
+    def size(self):
+        db = self.session_factory()
+        try:
+            return db.query(CrewStageOutput).count()
+        finally:
+            db.close()
+
+    def stats(self):
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evicted": self.evicted,
+                "errors": self.errors,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+        try:
+            stats["size"] = self.size()
+        except Exception as e:
+            logger.error(f"Error reading crew cache size: {str(e)}")
+        return stats
+
+
+def create_crew_cache():
+    if os.getenv("CREW_CACHE_ENABLED", "true").lower() != "true":
+        return None
+    return CrewStageCache(
+        ttl=float(os.getenv("CREW_CACHE_TTL", str(30 * 86400))),
+        max_entries=int(os.getenv("CREW_CACHE_MAX_ENTRIES", "10000")),
+        evict_every=int(os.getenv("CREW_CACHE_EVICT_EVERY", "100")),
+    )
@@ -0,0 +1,79 @@
+import math
+import os
+
+# Skill and puzzle difficulty share one scale (0.1 - 2.0). The chance that a player of skill s
+# solves a puzzle of difficulty d well is logistic(SLOPE * (s - d)), an Elo/Rasch-style model.
+MIN_DIFFICULTY = 0.1
+MAX_DIFFICULTY = 2.0
+TARGET_SUCCESS = float(os.getenv("DIFFICULTY_TARGET_SUCCESS", "0.7"))
+SLOPE = float(os.getenv("DIFFICULTY_SLOPE", "3.0"))
+LEARNING_RATE = float(os.getenv("DIFFICULTY_LEARNING_RATE", "0.2"))
+EWMA_ALPHA = float(os.getenv("DIFFICULTY_EWMA_ALPHA", "0.3"))
+
+# Attempts and time are normalized to 0-1, capped at 5 attempts and 5 minutes
+MAX_ATTEMPTS = 5
+MAX_TIME = 300.0
+
+
+def clamp_difficulty(value: float):
+    return max(MIN_DIFFICULTY, min(MAX_DIFFICULTY, value))
+
+
+def logistic(x: float):
+    return 1.0 / (1.0 + math.exp(-x))
+
+
+def _target_offset():
+    # How far below the player's skill a puzzle must be to be solved well TARGET_SUCCESS of the time
+    return math.log(TARGET_SUCCESS / (1 - TARGET_SUCCESS)) / SLOPE
+
+
+def initial_skill(difficulty: float):
+    # The skill for which the requested difficulty is exactly the next puzzle's difficulty
+    return difficulty + _target_offset()
+
+
+def next_difficulty(skill: float):
+    return clamp_difficulty(skill - _target_offset())
+
+
+def performance_score(attempts: int, time_spent: float):
+    # 1.0 for a first-attempt instant solve, falling to 0.0 at 5+ attempts and 5+ minutes
+    attempt_factor = (min(max(attempts or 1, 1), MAX_ATTEMPTS) - 1) / (MAX_ATTEMPTS - 1)
+    time_factor = min(max(time_spent or 0.0, 0.0), MAX_TIME) / MAX_TIME
+    return 1.0 - (attempt_factor + time_factor) / 2
+
+
+def update_skill(skill: float, difficulty: float, score: float):
+    expected = logistic(SLOPE * (skill - difficulty))
+    return skill + LEARNING_RATE * (score - expected)
+
+
+def update_ewma(current: float, value: float):
+    if current is None:
+        return value
+    return EWMA_ALPHA * value + (1 - EWMA_ALPHA) * current
+
+
+def game_difficulty(game):
+    # O(1): reads the running skill kept on the game row instead of scanning its puzzles
+    if game.skill_rating is None:
+        return clamp_difficulty(float(game.difficulty or 1.0))
+    return next_difficulty(game.skill_rating)
+
+
+def apply_solve(game, user, difficulty: float, attempts: int, time_spent: float):
+    # Folds one solved puzzle into the running statistics of its game and player
+    score = performance_score(attempts, time_spent)
+    if game.skill_rating is None:
+        game.skill_rating = initial_skill(float(game.difficulty or 1.0))
+    game.skill_rating = update_skill(game.skill_rating, difficulty, score)
+    game.ewma_attempts = update_ewma(game.ewma_attempts, float(attempts))
+    game.ewma_time_spent = update_ewma(game.ewma_time_spent, float(time_spent or 0.0))
+    game.rated_puzzles = (game.rated_puzzles or 0) + 1
+    if user is not None:
+        if user.skill_rating is None:
+            user.skill_rating = initial_skill(float(game.difficulty or 1.0))
+        user.skill_rating = update_skill(user.skill_rating, difficulty, score)
+        user.rated_puzzles = (user.rated_puzzles or 0) + 1
+    return score
@@ -0,0 +1,79 @@
+from app.services.puzzle_pool import normalize_label
+from app.utils.logger import setup_logger
+import bisect
+import json
+import os
+import random
+import threading
+
+logger = setup_logger()
+
+FALLBACK_PUZZLES_FILE = os.getenv("FALLBACK_PUZZLES_FILE", "data/fallback_puzzles.json")
+GENERAL_THEME = "general"
+
+
+class FallbackPuzzleBank:
+    # Hand-written puzzles served when the LLM is unavailable. Indexed once by theme, sorted by
+    # difficulty; themes without puzzles of their own get the "general" ones, whose {theme}
+    # placeholder is filled with the requested theme.
+    def __init__(self, puzzles: list, difficulty_window: float = 0.25, seed: int = None):
+        self.difficulty_window = difficulty_window
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.themes = {}
+        for puzzle in puzzles:
+            self.themes.setdefault(normalize_label(puzzle["theme"]), []).append(puzzle)
+        for theme_puzzles in self.themes.values():
+            theme_puzzles.sort(key=lambda p: p["difficulty"])
+        self._difficulties = {theme: [p["difficulty"] for p in ps] for theme, ps in self.themes.items()}
+
+    @classmethod
+    def from_file(cls, path: str = FALLBACK_PUZZLES_FILE):
+        try:
+            with open(path, "r") as f:
+                puzzles = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading fallback puzzles from {path}: {str(e)}")
+            puzzles = []
+        return cls(puzzles)
+
+    def _candidates(self, theme_key: str, difficulty: float):
+        puzzles = self.themes[theme_key]
+        difficulties = self._difficulties[theme_key]
+        low = bisect.bisect_left(difficulties, difficulty - self.difficulty_window)
+        high = bisect.bisect_right(difficulties, difficulty + self.difficulty_window)
+        if low < high:
+            return puzzles[low:high]
+        # Nothing inside the window: take the puzzle(s) at the nearest difficulty
+        index = bisect.bisect_left(difficulties, difficulty)
+        neighbours = [i for i in (index - 1, index) if 0 <= i < len(puzzles)]
+        nearest = min(neighbours, key=lambda i: abs(difficulties[i] - difficulty))
+        return [p for p in puzzles if p["difficulty"] == difficulties[nearest]]
+
+    def get(self, theme: str, difficulty: float):
+        theme_key = normalize_label(theme)
+        if theme_key not in self.themes:
+            theme_key = GENERAL_THEME
+        if theme_key not in self.themes:
+            return {"question": f"Default question for {theme}", "answer": "Default answer", "hint": "Default hint"}
+        candidates = self._candidates(theme_key, difficulty)
+        with self._lock:
+            puzzle = self._rng.choice(candidates)
+        return {
+            "question": puzzle["question"].replace("{theme}", theme),
+            "answer": puzzle["answer"],
+            "hint": puzzle["hint"].replace("{theme}", theme),
+            "alternatives": list(puzzle.get("alternatives", [])),
+        }
+
+
+_bank = None
+_bank_lock = threading.Lock()
+
+def get_fallback_bank():
+    global _bank
+    with _bank_lock:
+        if _bank is None:
+            _bank = FallbackPuzzleBank.from_file()
+            logger.info(f"Loaded {sum(len(ps) for ps in _bank.themes.values())} fallback puzzles")
+        return _bank
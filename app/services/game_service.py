@@ -1,178 +1,436 @@
-from sqlalchemy.orm import Session
-from app.models.models import Game, Puzzle
+from sqlalchemy import Float, and_, case, cast, false, select, update
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+from app.models.models import Game, Puzzle, User
 from app.utils.logger import setup_logger
 from app.services.llm_service import LLMService
+from app.services.answer_matching import accepted_forms, decode_forms, encode_forms, match_answer, normalize_answer
+from app.services.difficulty import apply_solve, game_difficulty, initial_skill
+from app.services.leaderboard_service import LeaderboardService, puzzle_points
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import contextvars
+import os
 import random
 
 logger = setup_logger()
 
+# Deadlocks and serialization failures roll the whole answer transaction back; it is retried
+# this many times before the caller is told to try again later
+ANSWER_TRANSACTION_RETRIES = int(os.getenv("ANSWER_TRANSACTION_RETRIES", "3"))
+_RETRYABLE_SQLSTATES = ("40P01", "40001")
+
+
+class TransactionConflict(Exception):
+    pass
+
+
+def is_retryable_conflict(error: Exception):
+    if not isinstance(error, DBAPIError):
+        return False
+    orig = error.orig
+    sqlstate = getattr(orig, "pgcode", None) or getattr(orig, "sqlstate", None)
+    return sqlstate in _RETRYABLE_SQLSTATES or "database is locked" in str(orig)
+
+# Bounds the number of concurrent LLM calls made while generating puzzles, across all games
+_puzzle_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("PUZZLE_GENERATION_CONCURRENCY", "8")),
+    thread_name_prefix="puzzle-generation",
+)
+
+async def run_llm_call(func, *args):
+    # LLM clients block; run them on the bounded pool instead of the event loop. The caller's
+    # context goes along so stage timings and token usage land on the right request.
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_puzzle_executor, context.run, func, *args)
+
 class GameService:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession, llm_service: LLMService = None, puzzle_pool=None):
         self.db = db
-        self.llm_service = LLMService()
+        self.llm_service = llm_service or LLMService()
+        self.puzzle_pool = puzzle_pool
 
-    def create_game(self, user_id: int, theme: str, difficulty: int, age_group: str):
+    async def create_game(self, user_id: int, theme: str, difficulty: int, age_group: str):
         try:
-            game = Game(user_id=user_id, theme=theme, difficulty=difficulty, age_group=age_group)
+            # A returning player starts at their skill so far; a new one at the requested difficulty
+            user = await self.db.get(User, user_id)
+            skill = user.skill_rating if user and user.skill_rating is not None else initial_skill(difficulty)
+            game = Game(user_id=user_id, theme=theme, difficulty=difficulty, age_group=age_group, skill_rating=skill)
             self.db.add(game)
-            self.db.commit()
-            self.db.refresh(game)
+            await self.db.commit()
+            await self.db.refresh(game)
             return game
         except Exception as e:
             logger.error(f"Error creating game: {str(e)}")
-            self.db.rollback()
+            await self.db.rollback()
+            raise
+
+    async def set_generation_status(self, game_id: int, status: str, error: str = None):
+        try:
+            await self.db.execute(
+                update(Game).where(Game.id == game_id).values(generation_status=status, generation_error=error)
+            )
+            await self.db.commit()
+        except Exception as e:
+            logger.error(f"Error updating generation status: {str(e)}")
+            await self.db.rollback()
             raise
 
-    def get_game(self, game_id: int):
-        game = self.db.query(Game).filter(Game.id == game_id).first()
-        if game:
-            # Ensure all puzzles for this game have a difficulty set
-            for puzzle in game.puzzles:
-                if puzzle.difficulty is None:
-                    puzzle.difficulty = 1.0
-            self.db.commit()
-        return game
-
-    def generate_dynamic_puzzle(self, game_id: int):
+    async def claim_generation(self, game_id: int, from_statuses: list, to_status: str):
+        # Conditional update, so only one worker process picks up a given generation job
+        try:
+            result = await self.db.execute(
+                update(Game)
+                .where(Game.id == game_id, Game.generation_status.in_(from_statuses))
+                .values(generation_status=to_status, generation_error=None)
+            )
+            await self.db.commit()
+            return result.rowcount == 1
+        except Exception as e:
+            logger.error(f"Error claiming generation for game {game_id}: {str(e)}")
+            await self.db.rollback()
+            raise
+
+    async def get_game(self, game_id: int):
+        return await self.db.get(Game, game_id)
+
+    async def get_game_state(self, game_id: int):
+        # Read-only: the game and its puzzles come back from one joined SELECT and nothing is committed
+        result = await self.db.execute(
+            select(Game).options(joinedload(Game.puzzles)).filter(Game.id == game_id)
+        )
+        game = result.unique().scalars().first()
+        if not game:
+            return None
+        return {
+            "game_id": game.id,
+            "theme": game.theme,
+            "difficulty": game.difficulty,
+            "generation_status": game.generation_status,
+            "generation_error": game.generation_error,
+            "score": game.score,
+            "start_time": game.start_time,
+            "end_time": game.end_time,
+            "puzzles": [self._puzzle_state(puzzle) for puzzle in sorted(game.puzzles, key=lambda p: p.id)]
+        }
+
+    def _puzzle_state(self, puzzle: Puzzle):
+        return {
+            "id": puzzle.id,
+            "question": puzzle.question,
+            "hints": puzzle.hints,
+            "difficulty": puzzle.difficulty,
+            "attempts": puzzle.attempts,
+            "time_spent": puzzle.time_spent,
+            "solved": puzzle.solved,
+            "answer": puzzle.answer if puzzle.solved else None  # Only include answer if puzzle is solved
+        }
+
+    def generate_puzzle_content(self, theme: str, difficulty: float, age_group: str, user_id: int = None,
+                                sequence: int = 0):
+        # Generate puzzle content using LLM
+        try:
+            return self.llm_service.generate_puzzle(theme, difficulty, age_group, user_id, sequence=sequence)
+        except Exception as e:
+            logger.error(f"Error generating puzzle with LLM: {str(e)}")
+            # Fallback to a curated puzzle if LLM fails
+            return self.llm_service.fallback_puzzle(theme, difficulty)
+
+    def build_puzzle(self, game_id: int, puzzle_content: dict, difficulty: float):
+        # The accepted answers are normalized once here so checking an attempt is a lookup
+        forms = accepted_forms(puzzle_content["answer"], puzzle_content.get("alternatives"))
+        return Puzzle(
+            game_id=game_id,
+            question=puzzle_content["question"],
+            answer=puzzle_content["answer"],
+            hints=puzzle_content["hint"],
+            difficulty=difficulty,
+            normalized_answer=forms[0] if forms else "",
+            accepted_answers=encode_forms(forms)
+        )
+
+    async def take_pooled_puzzles(self, theme: str, age_group: str, difficulty: float, count: int):
+        # Ready-made puzzles are claimed in this session's transaction and removed on commit
+        if not self.puzzle_pool:
+            return []
+        try:
+            return await self.puzzle_pool.take(self.db, theme, age_group, difficulty, count)
+        except Exception as e:
+            logger.error(f"Error taking puzzles from pool: {str(e)}")
+            await self.db.rollback()
+            return []
+
+    async def generate_dynamic_puzzle(self, game_id: int):
         try:
-            game = self.get_game(game_id)
+            game = await self.get_game(game_id)
             if not game:
                 raise ValueError(f"Game with id {game_id} not found")
 
-            # Calculate average difficulty and performance of solved puzzles
-            solved_puzzles = [p for p in game.puzzles if p.solved]
-            if solved_puzzles:
-                avg_difficulty = sum(p.difficulty for p in solved_puzzles) / len(solved_puzzles)
-                avg_attempts = sum(p.attempts for p in solved_puzzles) / len(solved_puzzles)
-                avg_time = sum(p.time_spent for p in solved_puzzles) / len(solved_puzzles)
+            new_difficulty = game_difficulty(game)
+            pooled = await self.take_pooled_puzzles(game.theme, game.age_group, new_difficulty, 1)
+            if pooled:
+                puzzle_content = pooled[0]
             else:
-                avg_difficulty = game.difficulty
-                avg_attempts = 0
-                avg_time = 0
-
-            # Adjust difficulty based on performance
-            new_difficulty = avg_difficulty
-            if avg_attempts > 3:  # If average attempts are high, decrease difficulty
-                new_difficulty -= 0.1
-            elif avg_attempts < 2:  # If average attempts are low, increase difficulty
-                new_difficulty += 0.1
-
-            if avg_time > 300:  # If average time is more than 5 minutes, decrease difficulty
-                new_difficulty -= 0.1
-            elif avg_time < 60:  # If average time is less than 1 minute, increase difficulty
-                new_difficulty += 0.1
-
-            # Ensure difficulty stays within bounds
-            new_difficulty = max(0.1, min(2.0, new_difficulty))
-
-            # Generate puzzle content using LLM
-            try:
-                puzzle_content = self.llm_service.generate_puzzle(game.theme, new_difficulty, game.age_group)
-            except Exception as e:
-                logger.error(f"Error generating puzzle with LLM: {str(e)}")
-                # Fallback to a default puzzle if LLM fails
-                puzzle_content = {
-                    "question": f"Default question for {game.theme}",
-                    "answer": "Default answer",
-                    "hint": "Default hint"
-                }
-
-            puzzle = Puzzle(
-                game_id=game_id, 
-                question=puzzle_content["question"],
-                answer=puzzle_content["answer"],
-                hints=puzzle_content["hint"],
-                difficulty=new_difficulty
-            )
+                puzzle_content = await run_llm_call(
+                    self.generate_puzzle_content, game.theme, new_difficulty, game.age_group, game.user_id
+                )
+
+            puzzle = self.build_puzzle(game_id, puzzle_content, new_difficulty)
             self.db.add(puzzle)
-            self.db.commit()
-            self.db.refresh(puzzle)
+            await self.db.commit()
+            await self.db.refresh(puzzle)
             return puzzle
         except Exception as e:
             logger.error(f"Error generating dynamic puzzle: {str(e)}")
-            self.db.rollback()
+            await self.db.rollback()
             raise
 
-    def check_answer(self, puzzle_id: int, user_answer: str):
+    async def stream_dynamic_puzzle(self, game_id: int):
+        # Yields ("token", text) while the question is generated and finally ("puzzle", Puzzle)
+        # once the row has been committed.
         try:
-            puzzle = self.get_puzzle(puzzle_id)
-            if not puzzle:
-                raise ValueError("Puzzle not found")
+            game = await self.get_game(game_id)
+            if not game:
+                raise ValueError(f"Game with id {game_id} not found")
 
-            is_correct = user_answer.lower() == puzzle.answer.lower()
-            feedback = "Correct!" if is_correct else "Incorrect. Try again!"
-
-            puzzle.attempts += 1
-            if is_correct:
-                puzzle.solved = True
-                # Adjust difficulty based on attempts and time spent
-                time_factor = min(puzzle.time_spent / 60, 5) / 5  # Normalize time spent to 0-1 range, cap at 5 minutes
-                attempt_factor = min(puzzle.attempts, 5) / 5  # Normalize attempts to 0-1 range, cap at 5 attempts
-                difficulty_adjustment = 0.1 * (1 - (time_factor + attempt_factor) / 2)
-                puzzle.difficulty = max(0.1, min(2.0, puzzle.difficulty + difficulty_adjustment))
-            
-            self.db.commit()
-
-            if not is_correct:
-                if self.is_answer_close(user_answer, puzzle.answer):
-                    feedback += " You're close!"
-                else:
-                    feedback += " You're not quite there yet."
-
-            return is_correct, feedback
+            new_difficulty = game_difficulty(game)
+            pooled = await self.take_pooled_puzzles(game.theme, game.age_group, new_difficulty, 1)
+            if pooled:
+                puzzle_content = pooled[0]
+                yield "token", puzzle_content["question"]
+            else:
+                puzzle_content = None
+                # The provider's stream blocks between chunks, so each step is pulled on the LLM pool
+                stream = self.llm_service.stream_puzzle(game.theme, new_difficulty, game.age_group, game.user_id)
+                while True:
+                    item = await run_llm_call(next, stream, None)
+                    if item is None:
+                        break
+                    event, value = item
+                    if event == "token":
+                        yield event, value
+                    else:
+                        puzzle_content = value
+
+            puzzle = self.build_puzzle(game_id, puzzle_content, new_difficulty)
+            self.db.add(puzzle)
+            await self.db.commit()
+            await self.db.refresh(puzzle)
+            yield "puzzle", puzzle
+        except Exception as e:
+            logger.error(f"Error streaming dynamic puzzle: {str(e)}")
+            await self.db.rollback()
+            raise
+
+    async def generate_puzzles(self, game_id: int, count: int):
+        # Fan the LLM calls out over the shared pool; the difficulty is computed once
+        # and every puzzle is persisted in a single transaction.
+        try:
+            game = await self.get_game(game_id)
+            if not game:
+                raise ValueError(f"Game with id {game_id} not found")
+            if count <= 0:
+                return []
+
+            new_difficulty = game_difficulty(game)
+            theme, age_group, user_id = game.theme, game.age_group, game.user_id
+            pooled = await self.take_pooled_puzzles(theme, age_group, new_difficulty, count)
+            generated = await asyncio.gather(*(
+                run_llm_call(self.generate_puzzle_content, theme, new_difficulty, age_group, user_id, sequence)
+                for sequence in range(count - len(pooled))
+            ))
+
+            puzzle_contents = pooled + list(generated)
+
+            puzzles = [
+                self.build_puzzle(game_id, puzzle_content, new_difficulty)
+                for puzzle_content in puzzle_contents
+            ]
+            self.db.add_all(puzzles)
+            await self.db.commit()
+            return puzzles
         except Exception as e:
-            logger.error(f"Error checking answer: {str(e)}")
+            logger.error(f"Error generating puzzles: {str(e)}")
+            await self.db.rollback()
             raise
 
-    def get_puzzle(self, puzzle_id: int):
-        puzzle = self.db.query(Puzzle).filter(Puzzle.id == puzzle_id).first()
-        if puzzle and puzzle.difficulty is None:
-            puzzle.difficulty = 1.0
-            self.db.commit()
-        return puzzle
+    async def _with_retries(self, action: str, func, *args):
+        # Runs func in a transaction, starting over when the database aborts it as a deadlock victim
+        for attempt in range(ANSWER_TRANSACTION_RETRIES + 1):
+            try:
+                result = await func(*args)
+                await self.db.commit()
+                return result
+            except Exception as e:
+                await self.db.rollback()
+                if not is_retryable_conflict(e):
+                    logger.error(f"Error {action}: {str(e)}")
+                    raise
+                if attempt == ANSWER_TRANSACTION_RETRIES:
+                    logger.error(f"Error {action}: gave up after {attempt + 1} conflicting transactions")
+                    raise TransactionConflict(f"Conflicting concurrent update while {action}") from e
+                logger.warning(f"Retrying after a conflicting transaction while {action}: {str(e)}")
+                await asyncio.sleep(random.uniform(0.01, 0.05) * 2 ** attempt)
+
+    async def check_answer(self, puzzle_id: int, user_answer: str):
+        result = await self._with_retries("checking answer", self._record_attempt, puzzle_id, user_answer)
+        if result is None:
+            raise ValueError("Puzzle not found")
+        return result
+
+    async def check_answers(self, attempts: list):
+        # Several (puzzle_id, answer) attempts applied in order inside one transaction
+        return await self._with_retries("checking answers", self._check_answers, attempts)
+
+    async def _lock_for_batch(self, puzzle_ids: list):
+        # A single check locks its puzzle, then the game and the player on a solve. A batch takes
+        # every lock it may need up front in that same order, by id within each table, so
+        # overlapping batches queue behind each other instead of deadlocking.
+        game_ids = (await self.db.execute(
+            select(Puzzle.game_id).where(Puzzle.id.in_(puzzle_ids)).order_by(Puzzle.id).with_for_update()
+        )).scalars().all()
+        game_ids = sorted({game_id for game_id in game_ids if game_id is not None})
+        if not game_ids:
+            return
+        user_ids = (await self.db.execute(
+            select(Game.user_id).where(Game.id.in_(game_ids)).order_by(Game.id).with_for_update()
+        )).scalars().all()
+        user_ids = sorted({user_id for user_id in user_ids if user_id is not None})
+        if user_ids:
+            await self.db.execute(
+                select(User.id).where(User.id.in_(user_ids)).order_by(User.id).with_for_update()
+            )
 
-    def update_puzzle_performance(self, puzzle_id: int, time_spent: float, attempts: int, solved: bool):
+    async def _check_answers(self, attempts: list):
+        if len(attempts) > 1:
+            await self._lock_for_batch(sorted({puzzle_id for puzzle_id, _ in attempts}))
+        results = []
+        for puzzle_id, user_answer in attempts:
+            result = await self._record_attempt(puzzle_id, user_answer)
+            if result is None:
+                results.append({"puzzle_id": puzzle_id, "is_correct": False, "feedback": None, "error": "Puzzle not found"})
+            else:
+                is_correct, feedback, points = result
+                results.append({"puzzle_id": puzzle_id, "is_correct": is_correct, "feedback": feedback, "points": points})
+        return results
+
+    async def _record_attempt(self, puzzle_id: int, user_answer: str):
+        # One locked UPDATE ... RETURNING: the attempt counter is incremented by the database, so
+        # concurrent submissions for the same puzzle never overwrite each other. Difficulty
+        # is only adjusted by the attempt that first solves the puzzle.
+        attempt = normalize_answer(user_answer)
+        if attempt:
+            is_correct = Puzzle.accepted_answers.contains(encode_forms([attempt]), autoescape=True)
+        else:
+            is_correct = false()
+        first_solve = and_(is_correct, Puzzle.solved.is_not(True))
+        # Normalize time spent and attempts to the 0-1 range, capped at 5 minutes and 5 attempts
+        time_factor = _clamp(Puzzle.time_spent / 60.0, 0.0, 5.0) / 5.0
+        attempt_factor = _clamp(cast(Puzzle.attempts + 1, Float), 0.0, 5.0) / 5.0
+        adjusted_difficulty = _clamp(Puzzle.difficulty + 0.1 * (1 - (time_factor + attempt_factor) / 2), 0.1, 2.0)
+
+        # RETURNING shows the row after a first solve has already adjusted its difficulty, so the
+        # difficulty the puzzle was served at is read first, under the row lock the UPDATE takes anyway
+        served_difficulty = (await self.db.execute(
+            select(Puzzle.difficulty).where(Puzzle.id == puzzle_id).with_for_update()
+        )).scalar()
+
+        result = await self.db.execute(
+            update(Puzzle)
+            .where(Puzzle.id == puzzle_id)
+            .values(
+                attempts=Puzzle.attempts + 1,
+                solved=case((is_correct, True), else_=Puzzle.solved),
+                difficulty=case((first_solve, adjusted_difficulty), else_=Puzzle.difficulty),
+                solved_on_attempt=case((first_solve, Puzzle.attempts + 1), else_=Puzzle.solved_on_attempt),
+            )
+            .returning(
+                is_correct.label("is_correct"),
+                Puzzle.accepted_answers,
+                Puzzle.game_id,
+                Puzzle.attempts,
+                Puzzle.time_spent,
+                Puzzle.solved_on_attempt,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        row = result.first()
+        if row is None:
+            return None
+
+        if row.is_correct:
+            # RETURNING shows the row after the update; only the solving attempt sees its own number
+            points = 0
+            if row.solved_on_attempt == row.attempts:
+                points = await self._record_solve(row, served_difficulty)
+            return True, "Correct!", points
+        feedback = "Incorrect. Try again!"
+        match = match_answer(attempt, decode_forms(row.accepted_answers), attempt_is_normalized=True)
+        if match.is_close:
+            feedback += " You're close!"
+        else:
+            feedback += " You're not quite there yet."
+        return False, feedback, 0
+
+    async def _record_solve(self, row, served_difficulty: float):
+        # Game and player rows are locked so concurrent solves in one room fold in one at a time
+        game = (await self.db.execute(
+            select(Game).filter(Game.id == row.game_id).with_for_update()
+        )).scalars().first()
+        if not game:
+            return 0
+        user = None
+        if game.user_id is not None:
+            user = (await self.db.execute(
+                select(User).filter(User.id == game.user_id).with_for_update()
+            )).scalars().first()
+        apply_solve(game, user, served_difficulty, row.attempts, row.time_spent)
+
+        points = puzzle_points(served_difficulty, row.attempts, row.time_spent)
+        game.score = (game.score or 0) + points
+        if game.user_id is not None:
+            await LeaderboardService(self.db).record(game.user_id, game.theme, game.age_group, points)
+        return points
+
+    async def get_puzzle(self, puzzle_id: int):
+        return await self.db.get(Puzzle, puzzle_id)
+
+    async def update_puzzle_performance(self, puzzle_id: int, time_spent: float, attempts: int, solved: bool):
+        # Reports can arrive late or out of order, so each field only ever moves forward
         try:
-            puzzle = self.get_puzzle(puzzle_id)
+            result = await self.db.execute(
+                update(Puzzle)
+                .where(Puzzle.id == puzzle_id)
+                .values(
+                    time_spent=case((Puzzle.time_spent < time_spent, time_spent), else_=Puzzle.time_spent),
+                    attempts=case((Puzzle.attempts < attempts, attempts), else_=Puzzle.attempts),
+                    solved=case((Puzzle.solved.is_(True), True), else_=solved),
+                )
+                .returning(Puzzle)
+                .execution_options(synchronize_session=False, populate_existing=True)
+            )
+            puzzle = result.scalars().first()
             if not puzzle:
                 raise ValueError("Puzzle not found")
-
-            puzzle.time_spent = time_spent
-            puzzle.attempts = attempts
-            puzzle.solved = solved
-            self.db.commit()
-            self.db.refresh(puzzle)
+            await self.db.commit()
             return puzzle
         except Exception as e:
             logger.error(f"Error updating puzzle performance: {str(e)}")
-            self.db.rollback()
+            await self.db.rollback()
             raise
 
-    def get_game_puzzles(self, game_id: int):
+    async def get_game_puzzles(self, game_id: int):
         try:
-            game = self.get_game(game_id)
-            if not game:
+            state = await self.get_game_state(game_id)
+            if not state:
                 raise ValueError(f"Game with id {game_id} not found")
-
-            puzzles = self.db.query(Puzzle).filter(Puzzle.game_id == game_id).all()
-            return [
-                {
-                    "id": puzzle.id,
-                    "question": puzzle.question,
-                    "hints": puzzle.hints,
-                    "difficulty": puzzle.difficulty or 1.0,  # Default to 1.0 if difficulty is None
-                    "attempts": puzzle.attempts,
-                    "time_spent": puzzle.time_spent,
-                    "solved": puzzle.solved,
-                    "answer": puzzle.answer if puzzle.solved else None  # Only include answer if puzzle is solved
-                }
-                for puzzle in puzzles
-            ]
+            return state["puzzles"]
         except Exception as e:
             logger.error(f"Error getting game puzzles: {str(e)}")
             raise
 
-    def is_answer_close(self, user_answer: str, correct_answer: str):
-        # Implement a more sophisticated comparison logic here
-        # This is just a simple example
-        return len(set(user_answer.lower()) & set(correct_answer.lower())) > len(correct_answer) / 2
\ No newline at end of file
+
+def _clamp(expression, low: float, high: float):
+    # Portable LEAST/GREATEST: SQLite has neither
+    return case((expression < low, low), (expression > high, high), else_=expression)
@@ -0,0 +1,152 @@
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import and_, func, or_, select
+from app.models.models import Game, Puzzle
+from app.utils.database import AsyncSessionLocal
+from app.utils.logger import setup_logger
+from app.utils.telemetry import request_trace, stage
+from app.services.game_service import GameService
+from app.services.rag_service import THEMES_FILE
+import asyncio
+import contextvars
+import datetime
+import os
+
+logger = setup_logger()
+
+STATUS_PENDING = "pending"
+STATUS_IN_PROGRESS = "in_progress"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+
+GAME_GENERATION_WORKERS = int(os.getenv("GAME_GENERATION_WORKERS", "4"))
+# An in_progress job older than this is assumed to belong to a process that died and is re-queued
+GAME_GENERATION_STALE_AFTER = float(os.getenv("GAME_GENERATION_STALE_AFTER", "900"))
+
+# Dedicated threads for the blocking CrewAI and RAG steps so they never compete with request handlers,
+# and a semaphore so at most GAME_GENERATION_WORKERS jobs run at a time as tasks on the application's
+# event loop. Both are created per application start (and again after a shutdown), never at import.
+_executor = None
+_slots = None
+_tasks = set()
+
+def start_generation_workers():
+    global _executor, _slots
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=GAME_GENERATION_WORKERS,
+            thread_name_prefix="game-generation",
+        )
+        _slots = asyncio.Semaphore(GAME_GENERATION_WORKERS)
+    return _executor, _slots
+
+def submit_game_generation(game_id: int, llm_service, multiagent_service, rag_service, puzzle_pool=None,
+                           resume: bool = False):
+    _, slots = start_generation_workers()
+    task = asyncio.get_running_loop().create_task(
+        _run_with_slot(slots, game_id, llm_service, multiagent_service, rag_service, puzzle_pool, resume)
+    )
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+async def _run_with_slot(slots: asyncio.Semaphore, *args):
+    async with slots:
+        await run_game_generation(*args)
+
+async def shutdown_generation_workers(wait: bool = False):
+    # wait=True lets queued and running jobs finish instead of cancelling them
+    global _executor, _slots
+    tasks = list(_tasks)
+    if not wait:
+        for task in tasks:
+            task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    executor, _executor, _slots = _executor, None, None
+    if executor is not None:
+        executor.shutdown(wait=wait, cancel_futures=not wait)
+
+async def resume_pending_generations(llm_service, multiagent_service, rag_service, puzzle_pool=None):
+    # Jobs only live in memory, so after a restart the games still pending, or stuck in progress
+    # for longer than any job takes, are queued again. The claim in _generate_game keeps several
+    # worker processes from running the same job.
+    stale_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=GAME_GENERATION_STALE_AFTER)
+    async with AsyncSessionLocal() as db:
+        game_ids = (await db.execute(
+            select(Game.id).where(or_(
+                Game.generation_status == STATUS_PENDING,
+                and_(Game.generation_status == STATUS_IN_PROGRESS, Game.start_time < stale_before),
+            ))
+        )).scalars().all()
+    for game_id in game_ids:
+        submit_game_generation(game_id, llm_service, multiagent_service, rag_service, puzzle_pool, resume=True)
+    if game_ids:
+        logger.info(f"Re-queued content generation for {len(game_ids)} games")
+    return len(game_ids)
+
+async def _run_blocking(func, *args):
+    context = contextvars.copy_context()
+    executor, _ = start_generation_workers()
+    return await asyncio.get_running_loop().run_in_executor(executor, context.run, func, *args)
+
+async def run_game_generation(game_id: int, llm_service, multiagent_service, rag_service, puzzle_pool=None,
+                              resume: bool = False):
+    # The job outlives the POST /games request that queued it, so it gets its own trace
+    with request_trace() as trace, stage("game_generation"):
+        await _generate_game(game_id, llm_service, multiagent_service, rag_service, puzzle_pool, resume)
+    logger.info(f"Generation timings for game {game_id}: {trace.summary()}")
+
+async def _generate_game(game_id: int, llm_service, multiagent_service, rag_service, puzzle_pool=None,
+                         resume: bool = False):
+    db = AsyncSessionLocal()
+    game_service = GameService(db, llm_service, puzzle_pool)
+    try:
+        game = await game_service.get_game(game_id)
+        if not game:
+            logger.error(f"Game with id {game_id} not found for content generation")
+            return
+        # A resumed job may also take over one stuck in progress
+        from_statuses = [STATUS_PENDING, STATUS_IN_PROGRESS] if resume else [STATUS_PENDING]
+        if not await game_service.claim_generation(game_id, from_statuses, STATUS_IN_PROGRESS):
+            logger.info(f"Content generation for game {game_id} was already picked up")
+            return
+        if resume and await db.scalar(select(func.count(Puzzle.id)).where(Puzzle.game_id == game_id)):
+            # The puzzles were committed but the process died before the status update
+            await game_service.set_generation_status(game_id, STATUS_COMPLETED)
+            return
+
+        # Generate game content using the multiagent service
+        try:
+            game_content_str = await _run_blocking(
+                multiagent_service.generate_game_content, game.theme, game.age_group, game.difficulty, game.user_id
+            )
+        except Exception as e:
+            logger.error(f"Error generating game content: {str(e)}")
+            game_content_str = f"Default content for {game.theme}"
+
+        # Use RAG to enhance the game content
+        try:
+            await _run_blocking(rag_service.load_index, THEMES_FILE)
+            enhanced_content = await _run_blocking(rag_service.query, game_content_str)
+            if not enhanced_content:
+                logger.warning(f"RAG returned no content for game {game_id}. Proceeding with original game content.")
+                enhanced_content = [game_content_str]
+        except Exception as e:
+            logger.warning(f"RAG service failed: {str(e)}. Proceeding with original game content.")
+            enhanced_content = [game_content_str]
+
+        # Generate one puzzle per enhanced content chunk, concurrently. A game without puzzles
+        # cannot be played, so that counts as a failed generation
+        puzzles = await game_service.generate_puzzles(game_id, len(enhanced_content))
+        if not puzzles:
+            raise ValueError("no puzzles were generated")
+
+        await game_service.set_generation_status(game_id, STATUS_COMPLETED)
+        logger.info(f"Content generation finished for game {game_id}")
+    except Exception as e:
+        logger.error(f"Error generating content for game {game_id}: {str(e)}")
+        try:
+            await game_service.set_generation_status(game_id, STATUS_FAILED, str(e))
+        except Exception as status_error:
+            logger.error(f"Could not mark game {game_id} as failed: {str(status_error)}")
+    finally:
+        await db.close()
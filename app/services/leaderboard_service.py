@@ -0,0 +1,123 @@
+from sqlalchemy import and_, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.models import LeaderboardEntry, User
+from app.services.puzzle_pool import normalize_label
+import datetime
+
+SCOPE_GLOBAL = "global"
+SCOPE_THEME = "theme"
+SCOPE_AGE_GROUP = "age_group"
+
+PERIODS = ("all", "day", "week", "month")
+ALL_TIME_START = datetime.date(1970, 1, 1)
+
+# Points for a first solve: 100 per difficulty unit, less for every extra attempt, plus up
+# to 50% more for solving inside the first five minutes
+BASE_POINTS = 100
+ATTEMPT_PENALTY = 0.25
+MIN_ATTEMPT_MULTIPLIER = 0.25
+TIME_BONUS = 0.5
+TIME_BONUS_WINDOW = 300.0
+
+
+def puzzle_points(difficulty: float, attempts: int, time_spent: float):
+    attempt_multiplier = max(MIN_ATTEMPT_MULTIPLIER, 1 - ATTEMPT_PENALTY * (max(attempts or 1, 1) - 1))
+    time_multiplier = 1 + TIME_BONUS * max(0.0, 1 - (time_spent or 0.0) / TIME_BONUS_WINDOW)
+    return int(round(BASE_POINTS * (difficulty or 1.0) * attempt_multiplier * time_multiplier))
+
+
+def period_start(period: str, day: datetime.date):
+    if period == "all":
+        return ALL_TIME_START
+    if period == "day":
+        return day
+    if period == "week":
+        return day - datetime.timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Unknown leaderboard period: {period}")
+
+
+def _insert_for(dialect_name: str):
+    if dialect_name == "postgresql":
+        return postgresql.insert
+    if dialect_name == "sqlite":
+        return sqlite.insert
+    raise ValueError(f"Leaderboard upserts are not supported on {dialect_name}")
+
+
+class LeaderboardService:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    async def record(self, user_id: int, theme: str, age_group: str, points: int, solved_at: datetime.datetime = None):
+        # Every solve adds to one row per (scope, period) in a single INSERT ... ON CONFLICT,
+        # so reading a leaderboard never aggregates games or puzzles
+        day = (solved_at or datetime.datetime.utcnow()).date()
+        scopes = [(SCOPE_GLOBAL, "")]
+        if theme:
+            scopes.append((SCOPE_THEME, normalize_label(theme)))
+        if age_group:
+            scopes.append((SCOPE_AGE_GROUP, normalize_label(age_group)))
+        rows = [
+            {
+                "scope": scope,
+                "scope_value": value,
+                "period": period,
+                "period_start": period_start(period, day),
+                "user_id": user_id,
+                "score": points,
+                "puzzles_solved": 1,
+            }
+            for scope, value in scopes
+            for period in PERIODS
+        ]
+
+        insert = _insert_for(self.db.bind.dialect.name)
+        statement = insert(LeaderboardEntry).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=["scope", "scope_value", "period", "period_start", "user_id"],
+            set_={
+                "score": LeaderboardEntry.score + statement.excluded.score,
+                "puzzles_solved": LeaderboardEntry.puzzles_solved + statement.excluded.puzzles_solved,
+            },
+        )
+        await self.db.execute(statement)
+
+    async def page(self, scope: str, scope_value: str, period: str = "all", day: datetime.date = None,
+                   limit: int = 50, after: str = None):
+        # Keyset pagination on (score DESC, user_id ASC); `after` is the previous page's next_cursor
+        start = period_start(period, day or datetime.datetime.utcnow().date())
+        query = (
+            select(LeaderboardEntry.user_id, User.username, LeaderboardEntry.score, LeaderboardEntry.puzzles_solved)
+            .join(User, User.id == LeaderboardEntry.user_id)
+            .filter(
+                LeaderboardEntry.scope == scope,
+                LeaderboardEntry.scope_value == (normalize_label(scope_value) if scope_value else ""),
+                LeaderboardEntry.period == period,
+                LeaderboardEntry.period_start == start,
+            )
+        )
+        if after:
+            after_score, after_user = (int(part) for part in after.split(":"))
+            query = query.filter(or_(
+                LeaderboardEntry.score < after_score,
+                and_(LeaderboardEntry.score == after_score, LeaderboardEntry.user_id > after_user),
+            ))
+        query = query.order_by(LeaderboardEntry.score.desc(), LeaderboardEntry.user_id).limit(limit)
+        rows = (await self.db.execute(query)).all()
+
+        entries = [
+            {"user_id": row.user_id, "username": row.username, "score": row.score, "puzzles_solved": row.puzzles_solved}
+            for row in rows
+        ]
+        next_cursor = f"{rows[-1].score}:{rows[-1].user_id}" if len(rows) == limit else None
+        return {
+            "scope": scope,
+            "scope_value": scope_value or None,
+            "period": period,
+            "period_start": start.isoformat(),
+            "entries": entries,
+            "next_cursor": next_cursor,
+        }
@@ -1,33 +1,276 @@
 import openai
 from app.utils.logger import setup_logger
-from openai import OpenAI
+from app.services.fallback_puzzles import get_fallback_bank
+from app.services.puzzle_cache import get_puzzle_cache
+from app.services.providers import create_chat_provider
+from app.services.puzzle_pool import normalize_label
+from app.utils.circuit_breaker import CircuitOpenError
+from app.utils.rate_limiter import RateLimitExceeded
+from app.utils.singleflight import SingleFlight
+from app.utils.telemetry import stage
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from typing import List
+import httpx
 import os
+import threading
 
 logger = setup_logger()
 
+MAX_PUZZLE_REPAIR_ATTEMPTS = int(os.getenv("LLM_PUZZLE_REPAIR_ATTEMPTS", "2"))
+# Concurrent identical puzzle requests share one LLM call, across at most this many variants
+# per request (users are spread over them); 0 turns coalescing off
+PUZZLE_SINGLEFLIGHT_VARIANTS = int(os.getenv("LLM_SINGLEFLIGHT_VARIANTS", "3"))
+
+
+class PuzzleSchema(BaseModel):
+    question: str = Field(description="The puzzle the players have to solve")
+    answer: str = Field(description="The exact answer, as short as possible")
+    hint: str = Field(description="A hint that helps without giving the answer away")
+    alternatives: List[str] = Field(default_factory=list, description="Other spellings or synonyms that should also count as correct")
+
+    @field_validator("question", "answer", "hint")
+    @classmethod
+    def not_blank(cls, value: str):
+        value = value.strip()
+        if not value:
+            raise ValueError("must not be empty")
+        return value
+
+
+PUZZLE_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "create_puzzle",
+        "description": "Record the escape room puzzle",
+        "parameters": PuzzleSchema.model_json_schema(),
+    },
+}
+
+
+def create_http_client():
+    # One keep-alive HTTP/2 connection pool shared by every OpenAI call in the process
+    return openai.DefaultHttpxClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20")),
+            keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60")),
+        ),
+    )
+
 
 class LLMService:
-    def __init__(self):
-        self.client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    def __init__(self, puzzle_cache=None, http_client=None, provider=None):
+        self.provider = provider or create_chat_provider(http_client)
+        self.puzzle_cache = puzzle_cache if puzzle_cache is not None else get_puzzle_cache()
+        self.single_flight = (
+            SingleFlight("generate_puzzle", variants=PUZZLE_SINGLEFLIGHT_VARIANTS) if PUZZLE_SINGLEFLIGHT_VARIANTS > 0 else None
+        )
+        self.puzzle_requests = 0
+        self.puzzle_retries = 0
+        self.puzzle_failures = 0
+        self.puzzle_fallbacks = 0
+        self._stats_lock = threading.Lock()
+
+    def _count(self, requests: int = 0, retries: int = 0, failures: int = 0, fallbacks: int = 0):
+        with self._stats_lock:
+            self.puzzle_requests += requests
+            self.puzzle_retries += retries
+            self.puzzle_failures += failures
+            self.puzzle_fallbacks += fallbacks
+
+    def stats(self):
+        with self._stats_lock:
+            stats = {
+                "puzzle_requests": self.puzzle_requests,
+                "puzzle_retries": self.puzzle_retries,
+                "puzzle_failures": self.puzzle_failures,
+                "puzzle_fallbacks": self.puzzle_fallbacks,
+                "retry_rate": self.puzzle_retries / self.puzzle_requests if self.puzzle_requests else 0.0,
+            }
+        stats["single_flight"] = self.single_flight.stats() if self.single_flight else {"enabled": False}
+        breaker = getattr(self.provider, "breaker", None)
+        limiter = getattr(self.provider, "limiter", None)
+        stats["circuit_breaker"] = breaker.stats() if breaker else {"enabled": False}
+        stats["rate_limiter"] = limiter.stats() if limiter else {"enabled": False}
+        return stats
+
+    def fallback_puzzle(self, theme: str, difficulty: float):
+        self._count(fallbacks=1)
+        return get_fallback_bank().get(theme, difficulty)
+
+    def close(self):
+        self.provider.close()
+
+    def generate_puzzle(self, theme: str, difficulty: float, age_group: str, user_id: int = None,
+                        use_cache: bool = True, fallback: bool = True, sequence: int = 0):
+        # sequence tells apart the puzzles one game asks for at once, so they are not coalesced
+        with stage("llm.generate_puzzle"):
+            return self._generate_puzzle(theme, difficulty, age_group, user_id, use_cache, fallback, sequence)
+
+    def _generate_puzzle(self, theme: str, difficulty: float, age_group: str, user_id: int,
+                         use_cache: bool, fallback: bool, sequence: int):
+        cache = self.puzzle_cache if use_cache else None
+        if cache:
+            cached_puzzle = cache.get(theme, difficulty, age_group, user_id)
+            if cached_puzzle:
+                return cached_puzzle
 
-    def generate_puzzle(self, theme: str, difficulty: float, age_group: str):
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a creative puzzle designer for an escape room game."},
-                    {"role": "user", "content": f"Create a puzzle with theme '{theme}', difficulty {difficulty}/2.0, for {age_group} age group. Include a question, answer, and hint."}
-                ]
-            )
-            puzzle_content = response.choices[0].message.content
-            
-            # Simple parsing logic (you might want to improve this)
-            lines = puzzle_content.split('\n')
-            question = next((line for line in lines if line.startswith("Question:")), "").replace("Question:", "").strip()
-            answer = next((line for line in lines if line.startswith("Answer:")), "").replace("Answer:", "").strip()
-            hint = next((line for line in lines if line.startswith("Hint:")), "").replace("Hint:", "").strip()
-            
-            return {"question": question, "answer": answer, "hint": hint}
+            if self.single_flight and use_cache:
+                key = (normalize_label(theme), normalize_label(age_group), round(difficulty, 2), sequence,
+                       self.single_flight.slot(user_id))
+                puzzle, shared = self.single_flight.do(
+                    key, self._request_and_cache, theme, difficulty, age_group, user_id, cache
+                )
+                if shared and cache:
+                    # The leader cached the puzzle for itself; record it for this user too so the
+                    # cache does not serve it to them again later
+                    cache.mark_served(theme, difficulty, age_group, puzzle, user_id)
+            else:
+                puzzle = self._request_and_cache(theme, difficulty, age_group, user_id, cache)
+        except (CircuitOpenError, RateLimitExceeded) as e:
+            # Expected while the LLM is shedding load; the bank answers without waiting on it
+            logger.warning(f"Skipping LLM puzzle generation: {str(e)}")
+            if not fallback:
+                raise
+            return self.fallback_puzzle(theme, difficulty)
         except Exception as e:
             logger.error(f"Error generating puzzle with LLM: {str(e)}")
-            return {"question": f"Default question for {theme}", "answer": "Default answer", "hint": "Default hint"}
\ No newline at end of file
+            if not fallback:
+                raise
+            return self.fallback_puzzle(theme, difficulty)
+        return puzzle
+
+    def _request_and_cache(self, theme: str, difficulty: float, age_group: str, user_id: int, cache):
+        # Cached before coalesced callers are released, so they find the entry to mark as served
+        puzzle = self._request_puzzle(theme, difficulty, age_group)
+        if cache:
+            cache.put(theme, difficulty, age_group, puzzle, user_id)
+        return puzzle
+
+    def _puzzle_messages(self, theme: str, difficulty: float, age_group: str, line_format: bool = False):
+        prompt = f"Create a puzzle with theme '{theme}', difficulty {difficulty}/2.0, for {age_group} age group. Include a question, answer, and hint."
+        if line_format:
+            prompt += " Reply with exactly three lines starting with 'Question:', 'Answer:' and 'Hint:'."
+        return [
+            {"role": "system", "content": "You are a creative puzzle designer for an escape room game."},
+            {"role": "user", "content": prompt}
+        ]
+
+    def parse_puzzle_content(self, puzzle_content: str):
+        # The question may span several lines; it is cut with the same rule as the streamed tokens
+        lines = puzzle_content.split('\n')
+        question = _question_section(puzzle_content)[0].strip()
+        answer = next((line for line in lines if line.startswith("Answer:")), "").replace("Answer:", "").strip()
+        hint = next((line for line in lines if line.startswith("Hint:")), "").replace("Hint:", "").strip()
+
+        return {"question": question, "answer": answer, "hint": hint}
+
+    def _request_puzzle(self, theme: str, difficulty: float, age_group: str, count_request: bool = True):
+        # Function calling makes the model return arguments matching PuzzleSchema. The model is
+        # only asked again when those arguments fail validation, with the errors fed back to it.
+        messages = self._puzzle_messages(theme, difficulty, age_group)
+        if count_request:
+            self._count(requests=1)
+        for attempt in range(MAX_PUZZLE_REPAIR_ATTEMPTS + 1):
+            if attempt:
+                self._count(retries=1)
+            result = self.provider.complete(
+                messages,
+                tools=[PUZZLE_TOOL],
+                tool_choice={"type": "function", "function": {"name": "create_puzzle"}}
+            )
+            try:
+                if result.tool_arguments is None:
+                    raise ValueError("create_puzzle was not called")
+                return PuzzleSchema.model_validate_json(result.tool_arguments).model_dump()
+            except (ValidationError, ValueError) as e:
+                logger.warning(f"Invalid puzzle from LLM (attempt {attempt + 1}): {str(e)}")
+                if result.tool_arguments is None:
+                    messages = messages + [
+                        {"role": "assistant", "content": result.content or ""},
+                        {"role": "user", "content": "Call create_puzzle with the question, answer and hint."}
+                    ]
+                else:
+                    messages = messages + [
+                        {"role": "assistant", "tool_calls": [result.tool_call_message()]},
+                        {"role": "tool", "tool_call_id": result.tool_call_id, "content": f"Invalid puzzle: {str(e)}. Call create_puzzle again with a non-empty question, answer and hint."}
+                    ]
+        self._count(failures=1)
+        raise ValueError(f"LLM returned no valid puzzle after {MAX_PUZZLE_REPAIR_ATTEMPTS + 1} attempts")
+
+    def validate_puzzle(self, puzzle: dict):
+        try:
+            return PuzzleSchema.model_validate(puzzle).model_dump()
+        except ValidationError:
+            return None
+
+    def stream_puzzle(self, theme: str, difficulty: float, age_group: str, user_id: int = None):
+        # Yields ("token", text) for the question as the model produces it, then ("puzzle", parsed).
+        # Everything from the "Answer:" line on is held back so the answer never reaches the player early.
+        cache = self.puzzle_cache
+        if cache:
+            cached_puzzle = cache.get(theme, difficulty, age_group, user_id)
+            if cached_puzzle:
+                yield "token", cached_puzzle["question"]
+                yield "puzzle", cached_puzzle
+                return
+
+        content = ""
+        emitted = 0
+        try:
+            for delta in self.provider.stream(self._puzzle_messages(theme, difficulty, age_group, line_format=True)):
+                content += delta
+                visible = _visible_question(content)
+                if len(visible) > emitted:
+                    yield "token", visible[emitted:]
+                    emitted = len(visible)
+        except (CircuitOpenError, RateLimitExceeded) as e:
+            # Raised before the first token, when the LLM is not called at all
+            logger.warning(f"Skipping LLM puzzle stream: {str(e)}")
+            puzzle = self.fallback_puzzle(theme, difficulty)
+            yield "token", puzzle["question"]
+            yield "puzzle", puzzle
+            return
+
+        self._count(requests=1)
+        puzzle = self.validate_puzzle(self.parse_puzzle_content(content))
+        if puzzle is None:
+            # The streamed text did not follow the format; repair with a structured request.
+            # The final puzzle event, not the streamed tokens, carries the question to show.
+            logger.warning("Streamed puzzle failed validation, requesting structured output")
+            self._count(retries=1)
+            try:
+                puzzle = self._request_puzzle(theme, difficulty, age_group, count_request=False)
+            except Exception as e:
+                logger.error(f"Error repairing streamed puzzle: {str(e)}")
+                yield "puzzle", self.fallback_puzzle(theme, difficulty)
+                return
+        elif len(puzzle["question"]) > emitted:
+            yield "token", puzzle["question"][emitted:]
+        if cache:
+            cache.put(theme, difficulty, age_group, puzzle, user_id)
+        yield "puzzle", puzzle
+
+_QUESTION_PREFIX = "Question:"
+_QUESTION_TERMINATORS = ("\nAnswer:", "\nHint:")
+
+def _question_section(content: str):
+    # Returns the text after "Question:" up to the answer or hint line, and whether that line was seen
+    start = content.find(_QUESTION_PREFIX)
+    if start == -1:
+        return "", False
+    question = content[start + len(_QUESTION_PREFIX):].lstrip()
+    ends = [question.find(marker) for marker in _QUESTION_TERMINATORS if marker in question]
+    if ends:
+        return question[:min(ends)].rstrip(), True
+    return question, False
+
+def _visible_question(content: str):
+    question, complete = _question_section(content)
+    if complete:
+        return question
+    # The tail could be the start of a terminator that has not fully arrived yet
+    holdback = max(len(marker) for marker in _QUESTION_TERMINATORS)
+    return question[:max(0, len(question) - holdback)]
@@ -1,51 +1,160 @@
-from crewai import Agent, Task, Crew
+from crewai import Agent, Task, Crew, LLM
 from app.utils.logger import setup_logger
+from app.services.providers import EXPECTED_COMPLETION_TOKENS, create_fake_behaviour, get_llm_guard
+from app.utils.telemetry import record_llm_usage, stage
+from app.services.crew_cache import create_crew_cache, stage_key
+from app.services.puzzle_pool import normalize_label
+from app.utils.singleflight import SingleFlight
+import hashlib
+import os
 
 logger = setup_logger()
 
+
+class FakeCrewLLM(LLM):
+    # Stands in for litellm inside CrewAI: answers every step immediately with a
+    # deterministic final answer after the configured latency
+    def __init__(self, behaviour):
+        super().__init__(model="fake")
+        self.behaviour = behaviour
+
+    def call(self, messages, callbacks=[]):
+        self.behaviour.wait("crew step")
+        prompt = messages[-1]["content"] if messages else ""
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+        return f"Thought: I now know the final answer\nFinal Answer: Generated content {digest} for: {prompt[-200:]}"
+
+    def supports_function_calling(self):
+        return False
+
+    def supports_stop_words(self):
+        return False
+
+    def get_context_window_size(self):
+        return 8192
+
+
+def create_crew_llm():
+    # None lets CrewAI pick its default (OpenAI through litellm)
+    if os.getenv("LLM_PROVIDER", "openai") == "fake":
+        return FakeCrewLLM(create_fake_behaviour("FAKE_LLM"))
+    return None
+
+
+# The crew's tasks, run in order. Each is cached on its own, keyed by the game parameters it
+# uses plus the outputs of the stages before it, so a storyline for a theme is reused across
+# age groups and difficulties and only the later stages run again.
+# (stage, agent, task description, expected output, game parameters in the key)
+STAGES = (
+    ("storyline", "storyteller",
+     "Create a storyline for an escape room with the theme: {theme}",
+     "A detailed storyline for the escape room", ("theme",)),
+    ("puzzle_ideas", "puzzle_master",
+     "Design puzzles fitting the theme and appropriate for age group: {age_group}",
+     "A list of puzzle ideas with descriptions", ("theme", "age_group")),
+    ("difficulty_adjustment", "difficulty_scaler",
+     "Adjust puzzle difficulty to level {difficulty} for age group {age_group}",
+     "Difficulty-adjusted puzzle descriptions", ("theme", "age_group", "difficulty")),
+)
+
+# Earlier outputs are passed the way a sequential crew passes task context
+CONTEXT_TEMPLATE = "\n\nThis is the context you're working with:\n{context}"
+
+# Bump to invalidate every cached stage without touching the prompts
+PROMPT_VERSION = os.getenv("CREW_PROMPT_VERSION", "1")
+
+# Games started at once with the same parameters share one crew run. Stage outputs are cached
+# and reused anyway, so by default everyone shares; 0 turns coalescing off.
+SINGLEFLIGHT_VARIANTS = int(os.getenv("CREW_SINGLEFLIGHT_VARIANTS", "1"))
+
+
 class MultiagentService:
-    def __init__(self):
+    def __init__(self, llm=None, crew_cache=None, llm_guard=None):
+        agent_options = {"llm": llm} if llm is not None else {}
         self.storyteller = Agent(
             role='Storyteller',
             goal='Create engaging storylines and themes for escape rooms',
-            backstory='You are a creative writer with a knack for crafting immersive narratives.'
+            backstory='You are a creative writer with a knack for crafting immersive narratives.',
+            **agent_options
         )
         self.puzzle_master = Agent(
             role='Puzzle Master',
             goal='Design challenging and age-appropriate puzzles',
-            backstory='You are an expert in creating puzzles that are both fun and educational.'
+            backstory='You are an expert in creating puzzles that are both fun and educational.',
+            **agent_options
         )
         self.difficulty_scaler = Agent(
             role='Difficulty Scaler',
             goal='Adjust puzzle complexity based on player age and skill level',
-            backstory='You have a deep understanding of cognitive development and problem-solving skills across different age groups.'
+            backstory='You have a deep understanding of cognitive development and problem-solving skills across different age groups.',
+            **agent_options
+        )
+        self.crew_cache = crew_cache if crew_cache is not None else create_crew_cache()
+        self.llm_guard = llm_guard or get_llm_guard()
+        self.prompt_versions = {name: self.prompt_version(name) for name, *_ in STAGES}
+        if self.crew_cache:
+            self.crew_cache.prompt_versions = self.prompt_versions
+        self.single_flight = (
+            SingleFlight("generate_game_content", variants=SINGLEFLIGHT_VARIANTS) if SINGLEFLIGHT_VARIANTS > 0 else None
         )
 
-    def generate_game_content(self, theme: str, age_group: str, difficulty: int):
+    def prompt_version(self, stage_name: str):
+        # Changes whenever the agent, task wording or model behind a stage changes, so edited
+        # prompts never serve outputs cached under the old ones
+        _, agent_name, description, expected_output, _ = next(s for s in STAGES if s[0] == stage_name)
+        agent = getattr(self, agent_name)
+        source = "\0".join([
+            PROMPT_VERSION, agent.role, agent.goal, agent.backstory, description, expected_output,
+            CONTEXT_TEMPLATE, str(getattr(agent.llm, "model", "")),
+        ])
+        return hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+
+    def _run_stage(self, agent, description: str, expected_output: str):
+        crew = Crew(agents=[agent], tasks=[Task(description=description, agent=agent, expected_output=expected_output)])
+        # CrewAI calls the LLM itself, so the kickoff as a whole goes through the shared guard.
+        # It may take several LLM calls; the settled usage covers all of them.
+        estimate = (len(agent.backstory) + len(agent.goal) + len(description) + len(expected_output)) // 4
+        estimate += EXPECTED_COMPLETION_TOKENS
+        self.llm_guard.admit(estimate)
+        try:
+            with stage("crew.kickoff"):
+                result = crew.kickoff()
+        except Exception as e:
+            self.llm_guard.finish(e)
+            raise
+        self.llm_guard.finish()
+        usage = result.token_usage
+        self.llm_guard.settle(estimate, usage.total_tokens)
+        record_llm_usage(getattr(agent.llm, "model", "crew"), usage.prompt_tokens, usage.completion_tokens)
+        return str(result)  # Convert CrewOutput to string
+
+    def generate_game_content(self, theme: str, age_group: str, difficulty: int, user_id: int = None):
+        if not self.single_flight:
+            return self._generate_game_content(theme, age_group, difficulty)
+        key = (normalize_label(theme), normalize_label(age_group), difficulty, self.single_flight.slot(user_id))
+        content, _ = self.single_flight.do(key, self._generate_game_content, theme, age_group, difficulty)
+        return content
+
+    def _generate_game_content(self, theme: str, age_group: str, difficulty: int):
         try:
-            crew = Crew(
-                agents=[self.storyteller, self.puzzle_master, self.difficulty_scaler],
-                tasks=[
-                    Task(
-                        description=f"Create a storyline for an escape room with the theme: {theme}",
-                        agent=self.storyteller,
-                        expected_output="A detailed storyline for the escape room"
-                    ),
-                    Task(
-                        description=f"Design puzzles fitting the theme and appropriate for age group: {age_group}",
-                        agent=self.puzzle_master,
-                        expected_output="A list of puzzle ideas with descriptions"
-                    ),
-                    Task(
-                        description=f"Adjust puzzle difficulty to level {difficulty} for age group {age_group}",
-                        agent=self.difficulty_scaler,
-                        expected_output="Difficulty-adjusted puzzle descriptions"
-                    )
-                ]
-            )
-
-            result = crew.kickoff()
-            return str(result)  # Convert CrewOutput to string
+            parameters = {"theme": theme, "age_group": age_group, "difficulty": difficulty}
+            key_parameters = {"theme": normalize_label(theme), "age_group": normalize_label(age_group), "difficulty": difficulty}
+            outputs = []
+            for stage_name, agent_name, description, expected_output, used in STAGES:
+                cache_key = stage_key(stage_name, self.prompt_versions[stage_name], {
+                    "parameters": {name: key_parameters[name] for name in used},
+                    "context": [hashlib.sha256(output.encode("utf-8")).hexdigest() for output in outputs],
+                })
+                output = self.crew_cache.get(stage_name, cache_key) if self.crew_cache else None
+                if output is None:
+                    prompt = description.format(**parameters)
+                    if outputs:
+                        prompt += CONTEXT_TEMPLATE.format(context="\n\n----------\n\n".join(outputs))
+                    output = self._run_stage(getattr(self, agent_name), prompt, expected_output)
+                    if self.crew_cache:
+                        self.crew_cache.put(stage_name, cache_key, self.prompt_versions[stage_name], output)
+                outputs.append(output)
+            return outputs[-1]
         except Exception as e:
             logger.error(f"Error generating game content: {str(e)}")
-            raise
\ No newline at end of file
+            raise
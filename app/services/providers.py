@@ -0,0 +1,349 @@
+from dataclasses import dataclass, field
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+from openai import APIConnectionError, APITimeoutError, InternalServerError, OpenAI, RateLimitError
+from app.utils.circuit_breaker import get_circuit_breaker
+from app.utils.logger import setup_logger
+from app.utils.rate_limiter import RateLimitExceeded, create_llm_rate_limiter
+from app.utils.telemetry import record_llm_usage
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+
+logger = setup_logger()
+
+
+@dataclass
+class ChatResult:
+    content: str = None
+    tool_call_id: str = None
+    tool_name: str = None
+    tool_arguments: str = None
+    usage: dict = field(default_factory=dict)
+
+    def tool_call_message(self):
+        return {
+            "id": self.tool_call_id,
+            "type": "function",
+            "function": {"name": self.tool_name, "arguments": self.tool_arguments},
+        }
+
+
+class OpenAIChatProvider:
+    name = "openai"
+
+    def __init__(self, http_client=None, model: str = "gpt-3.5-turbo"):
+        # Short timeout and a single retry: the circuit breaker, not the client, decides when to back off
+        self.client = OpenAI(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            http_client=http_client,
+            timeout=float(os.getenv("OPENAI_TIMEOUT", "20")),
+            max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "1")),
+        )
+        self.model = model
+
+    def complete(self, messages: list, tools: list = None, tool_choice: dict = None):
+        params = {"model": self.model, "messages": messages}
+        if tools:
+            params["tools"] = tools
+            params["tool_choice"] = tool_choice
+        response = self.client.chat.completions.create(**params)
+        message = response.choices[0].message
+        tool_call = message.tool_calls[0] if message.tool_calls else None
+        usage = response.usage.model_dump() if response.usage else {}
+        record_llm_usage(self.model, usage.get("prompt_tokens"), usage.get("completion_tokens"))
+        return ChatResult(
+            content=message.content,
+            tool_call_id=tool_call.id if tool_call else None,
+            tool_name=tool_call.function.name if tool_call else None,
+            tool_arguments=tool_call.function.arguments if tool_call else None,
+            usage=usage,
+        )
+
+    def stream(self, messages: list):
+        stream = self.client.chat.completions.create(
+            model=self.model, messages=messages, stream=True, stream_options={"include_usage": True}
+        )
+        for chunk in stream:
+            # The final chunk has no choices and carries the usage for the whole stream
+            if chunk.usage:
+                record_llm_usage(self.model, chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+
+    def close(self):
+        self.client.close()
+
+
+class FakeProviderError(Exception):
+    pass
+
+
+class LatencyModel:
+    # Parsed from specs such as "fixed:0.2", "uniform:0.1,0.8", "normal:0.5,0.1" or
+    # "lognormal:-1.2,0.6" (parameters of the underlying normal). Values are seconds.
+    def __init__(self, spec: str = "fixed:0"):
+        kind, _, params = spec.partition(":")
+        self.kind = kind.strip()
+        self.params = [float(p) for p in params.split(",") if p.strip()]
+        if self.kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self, rng: random.Random):
+        if self.kind == "fixed":
+            value = self.params[0] if self.params else 0.0
+        elif self.kind == "uniform":
+            value = rng.uniform(self.params[0], self.params[1])
+        elif self.kind == "normal":
+            value = rng.gauss(self.params[0], self.params[1])
+        else:
+            value = rng.lognormvariate(self.params[0], self.params[1])
+        return max(0.0, value)
+
+
+class FakeBehaviour:
+    # Shared latency and failure injection for the local stand-in backends
+    def __init__(self, latency: LatencyModel, failure_rate: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def wait(self, what: str):
+        with self._lock:
+            delay = self.latency.sample(self._rng)
+            fail = self._rng.random() < self.failure_rate
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise FakeProviderError(f"Injected {what} failure")
+
+
+def _estimate_tokens(text: str):
+    return max(1, len(text) // 4)
+
+
+class FakeChatProvider:
+    name = "fake"
+    model = "fake"
+
+    def __init__(self, behaviour: FakeBehaviour, stream_chunk_size: int = 8, stream_chunk_delay: float = 0.0):
+        self.behaviour = behaviour
+        self.stream_chunk_size = stream_chunk_size
+        self.stream_chunk_delay = stream_chunk_delay
+
+    def _puzzle_for(self, messages: list):
+        # Same prompt, same puzzle: the content is derived from a hash of the conversation's first prompt
+        prompt = next((m.get("content") or "" for m in messages if m.get("role") == "user"), "")
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        theme = re.search(r"theme '([^']*)'", prompt)
+        theme = theme.group(1) if theme else "mystery"
+        number = int(digest[:6], 16) % 1000
+        return {
+            "question": f"The {theme} vault shows the code {digest[:8]}. What number is hidden in it if you take {number} and add 1?",
+            "answer": str(number + 1),
+            "hint": f"Start from {number}.",
+        }
+
+    def complete(self, messages: list, tools: list = None, tool_choice: dict = None):
+        self.behaviour.wait("chat completion")
+        puzzle = self._puzzle_for(messages)
+        prompt_tokens = sum(_estimate_tokens(m.get("content") or "") for m in messages)
+        if tools:
+            arguments = json.dumps(puzzle)
+            record_llm_usage(self.model, prompt_tokens, _estimate_tokens(arguments))
+            return ChatResult(
+                tool_call_id=f"call_{hashlib.md5(arguments.encode('utf-8')).hexdigest()[:12]}",
+                tool_name=tools[0]["function"]["name"],
+                tool_arguments=arguments,
+                usage={"prompt_tokens": prompt_tokens, "completion_tokens": _estimate_tokens(arguments)},
+            )
+        content = f"Question: {puzzle['question']}\nAnswer: {puzzle['answer']}\nHint: {puzzle['hint']}"
+        record_llm_usage(self.model, prompt_tokens, _estimate_tokens(content))
+        return ChatResult(
+            content=content,
+            usage={"prompt_tokens": prompt_tokens, "completion_tokens": _estimate_tokens(content)},
+        )
+
+    def stream(self, messages: list):
+        content = self.complete(messages).content
+        for start in range(0, len(content), self.stream_chunk_size):
+            if self.stream_chunk_delay:
+                time.sleep(self.stream_chunk_delay)
+            yield content[start:start + self.stream_chunk_size]
+
+    def close(self):
+        pass
+
+
+# Errors that mean the upstream itself is unhealthy; anything else (bad request, invalid
+# output) says nothing about availability and does not count against the circuit breaker
+UPSTREAM_ERRORS = (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError, FakeProviderError)
+EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "400"))
+
+
+class LLMGuard:
+    # Admission for every LLM call: the circuit breaker first, then the shared rate limiter.
+    # Token usage is estimated up front and settled once the real usage is known.
+    def __init__(self, limiter=None, breaker=None):
+        self.limiter = limiter
+        self.breaker = breaker
+
+    def admit(self, estimate: int):
+        if self.breaker:
+            self.breaker.before_call()
+        if self.limiter:
+            try:
+                self.limiter.acquire(estimate)
+            except RateLimitExceeded:
+                if self.breaker:
+                    self.breaker.cancel()
+                raise
+
+    def finish(self, error: Exception = None):
+        if not self.breaker:
+            return
+        if isinstance(error, UPSTREAM_ERRORS):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def settle(self, estimate: int, used_tokens: int):
+        if self.limiter and used_tokens:
+            self.limiter.settle(estimate, used_tokens)
+
+
+_llm_guard = None
+_llm_guard_lock = threading.Lock()
+
+def get_llm_guard():
+    # One guard per process, shared by the chat provider and the CrewAI agents
+    global _llm_guard
+    with _llm_guard_lock:
+        if _llm_guard is None:
+            _llm_guard = LLMGuard(limiter=create_llm_rate_limiter(), breaker=get_circuit_breaker("llm"))
+        return _llm_guard
+
+
+class GuardedChatProvider:
+    def __init__(self, inner, guard: LLMGuard):
+        self.inner = inner
+        self.guard = guard
+        self.name = inner.name
+        self.model = inner.model
+
+    @property
+    def limiter(self):
+        return self.guard.limiter
+
+    @property
+    def breaker(self):
+        return self.guard.breaker
+
+    def _estimate(self, messages: list, tools: list = None):
+        chars = sum(len(m.get("content") or "") for m in messages)
+        if tools:
+            chars += len(json.dumps(tools))
+        return chars // 4 + EXPECTED_COMPLETION_TOKENS
+
+    def complete(self, messages: list, tools: list = None, tool_choice: dict = None):
+        estimate = self._estimate(messages, tools)
+        self.guard.admit(estimate)
+        try:
+            result = self.inner.complete(messages, tools=tools, tool_choice=tool_choice)
+        except Exception as e:
+            self.guard.finish(e)
+            raise
+        self.guard.finish()
+        self.guard.settle(estimate, (result.usage.get("prompt_tokens") or 0) + (result.usage.get("completion_tokens") or 0))
+        return result
+
+    def stream(self, messages: list):
+        estimate = self._estimate(messages)
+        self.guard.admit(estimate)
+        chars = 0
+        try:
+            for delta in self.inner.stream(messages):
+                chars += len(delta)
+                yield delta
+        except Exception as e:
+            self.guard.finish(e)
+            raise
+        except GeneratorExit:
+            # The consumer stopped early; the upstream answered, so the call still counts as a success
+            self.guard.finish()
+            raise
+        self.guard.finish()
+        self.guard.settle(estimate, estimate - EXPECTED_COMPLETION_TOKENS + chars // 4)
+
+    def close(self):
+        self.inner.close()
+
+
+class HashingEmbeddings(Embeddings):
+    # Signed feature hashing of lowercased word tokens into a fixed-size, L2-normalised vector
+    def __init__(self, dimensions: int = 256, behaviour: FakeBehaviour = None):
+        self.dimensions = dimensions
+        self.behaviour = behaviour
+        self.model = f"hashing-{dimensions}"
+
+    def _embed(self, text: str):
+        vector = [0.0] * self.dimensions
+        for token in re.findall(r"\w+", text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector))
+        return [v / norm for v in vector] if norm else vector
+
+    def embed_documents(self, texts: list):
+        if self.behaviour:
+            self.behaviour.wait("embedding")
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str):
+        return self.embed_documents([text])[0]
+
+
+def create_fake_behaviour(prefix: str):
+    return FakeBehaviour(
+        latency=LatencyModel(os.getenv(f"{prefix}_LATENCY", "fixed:0")),
+        failure_rate=float(os.getenv(f"{prefix}_FAILURE_RATE", "0")),
+        seed=int(os.getenv(f"{prefix}_SEED", "0")),
+    )
+
+
+def _create_chat_provider(http_client=None):
+    provider = os.getenv("LLM_PROVIDER", "openai")
+    if provider == "openai":
+        return OpenAIChatProvider(http_client=http_client)
+    if provider == "fake":
+        logger.info("Using the local fake LLM provider")
+        return FakeChatProvider(
+            create_fake_behaviour("FAKE_LLM"),
+            stream_chunk_delay=float(os.getenv("FAKE_LLM_STREAM_CHUNK_DELAY", "0")),
+        )
+    raise ValueError(f"Unknown LLM provider: {provider}")
+
+
+def create_chat_provider(http_client=None):
+    return GuardedChatProvider(_create_chat_provider(http_client), get_llm_guard())
+
+
+def create_embeddings(http_client=None):
+    provider = os.getenv("EMBEDDING_PROVIDER", "openai")
+    if provider == "openai":
+        return OpenAIEmbeddings(http_client=http_client)
+    if provider == "hashing":
+        logger.info("Using the local hashing embedder")
+        return HashingEmbeddings(
+            dimensions=int(os.getenv("HASHING_EMBEDDING_DIMENSIONS", "256")),
+            behaviour=create_fake_behaviour("FAKE_EMBEDDING"),
+        )
+    raise ValueError(f"Unknown embedding provider: {provider}")
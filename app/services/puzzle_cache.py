@@ -0,0 +1,328 @@
+from collections import OrderedDict
+from sqlalchemy.exc import IntegrityError
+from app.models.models import CachedPuzzle, CachedPuzzleDelivery
+from app.utils.database import SessionLocal
+from app.utils.logger import setup_logger
+import datetime
+import itertools
+import os
+import random
+import threading
+import time
+
+logger = setup_logger()
+
+REUSE_ANY = "any"
+REUSE_UNIQUE_PER_USER = "unique_per_user"
+
+
+def difficulty_bucket(difficulty: float, step: float):
+    return int(round(difficulty / step))
+
+
+# LRU over cache keys; each key holds up to max_variants puzzles that expire after ttl seconds
+class InMemoryPuzzleCacheBackend:
+    def __init__(self, maxsize: int, ttl: float, max_variants: int):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_variants = max_variants
+        self._entries = OrderedDict()
+        # user_id -> ids of variants served to them, and the reverse, so both go with the variant
+        self._served = {}
+        self._served_by = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _live_variants(self, key, now: float):
+        variants = []
+        for variant in self._entries.get(key, []):
+            if now - variant["created_at"] < self.ttl:
+                variants.append(variant)
+            else:
+                self._forget(variant)
+        if variants:
+            self._entries[key] = variants
+            self._entries.move_to_end(key)
+        else:
+            self._entries.pop(key, None)
+        return variants
+
+    def _mark(self, variant, user_id):
+        self._served.setdefault(user_id, set()).add(variant["id"])
+        self._served_by.setdefault(variant["id"], set()).add(user_id)
+
+    def _forget(self, variant):
+        for user_id in self._served_by.pop(variant["id"], ()):
+            served = self._served.get(user_id)
+            if served is not None:
+                served.discard(variant["id"])
+                if not served:
+                    del self._served[user_id]
+
+    def count(self, key):
+        with self._lock:
+            return len(self._live_variants(key, time.monotonic()))
+
+    def take(self, key, user_id, unique_per_user: bool):
+        with self._lock:
+            variants = self._live_variants(key, time.monotonic())
+            served = self._served.get(user_id, set()) if unique_per_user and user_id is not None else set()
+            candidates = [v for v in variants if v["id"] not in served]
+            if not candidates:
+                return None
+            variant = random.choice(candidates)
+            if user_id is not None:
+                self._mark(variant, user_id)
+            return dict(variant["puzzle"])
+
+    def add(self, key, puzzle: dict, user_id=None):
+        with self._lock:
+            now = time.monotonic()
+            variants = self._live_variants(key, now)
+            if len(variants) >= self.max_variants:
+                return
+            variant = {"id": next(self._ids), "puzzle": dict(puzzle), "created_at": now}
+            self._entries[key] = variants + [variant]
+            self._entries.move_to_end(key)
+            if user_id is not None:
+                self._mark(variant, user_id)
+            while len(self._entries) > self.maxsize:
+                _, evicted = self._entries.popitem(last=False)
+                for old_variant in evicted:
+                    self._forget(old_variant)
+
+    def mark_served(self, key, puzzle: dict, user_id):
+        with self._lock:
+            for variant in self._live_variants(key, time.monotonic()):
+                if variant["puzzle"]["question"] == puzzle["question"] and variant["puzzle"]["answer"] == puzzle["answer"]:
+                    self._mark(variant, user_id)
+
+    def size(self):
+        with self._lock:
+            return sum(len(variants) for variants in self._entries.values())
+
+
+# Shares cached puzzles across workers through the cached_puzzles table
+class DatabasePuzzleCacheBackend:
+    def __init__(self, ttl: float, max_variants: int, session_factory=SessionLocal):
+        self.ttl = ttl
+        self.max_variants = max_variants
+        self.session_factory = session_factory
+
+    def _variants_query(self, db, key):
+        theme, age_group, bucket = key
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.ttl)
+        return db.query(CachedPuzzle).filter(
+            CachedPuzzle.theme == theme,
+            CachedPuzzle.age_group == age_group,
+            CachedPuzzle.difficulty_bucket == bucket,
+            CachedPuzzle.created_at >= cutoff,
+        )
+
+    def count(self, key):
+        db = self.session_factory()
+        try:
+            return self._variants_query(db, key).count()
+        finally:
+            db.close()
+
+    def take(self, key, user_id, unique_per_user: bool):
+        db = self.session_factory()
+        try:
+            query = self._variants_query(db, key)
+            if unique_per_user and user_id is not None:
+                served = db.query(CachedPuzzleDelivery.cached_puzzle_id).filter(
+                    CachedPuzzleDelivery.user_id == user_id
+                )
+                query = query.filter(CachedPuzzle.id.notin_(served))
+            candidates = query.all()
+            if not candidates:
+                return None
+            variant = random.choice(candidates)
+            if user_id is not None:
+                db.add(CachedPuzzleDelivery(cached_puzzle_id=variant.id, user_id=user_id))
+                db.commit()
+            return {
+                "question": variant.question,
+                "answer": variant.answer,
+                "hint": variant.hint,
+                "alternatives": list(variant.alternatives or []),
+            }
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def add(self, key, puzzle: dict, user_id=None):
+        theme, age_group, bucket = key
+        db = self.session_factory()
+        try:
+            if self._variants_query(db, key).count() >= self.max_variants:
+                return
+            variant = CachedPuzzle(
+                theme=theme,
+                age_group=age_group,
+                difficulty_bucket=bucket,
+                question=puzzle["question"],
+                answer=puzzle["answer"],
+                hint=puzzle["hint"],
+                alternatives=list(puzzle.get("alternatives") or []),
+            )
+            db.add(variant)
+            db.flush()
+            if user_id is not None:
+                db.add(CachedPuzzleDelivery(cached_puzzle_id=variant.id, user_id=user_id))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def mark_served(self, key, puzzle: dict, user_id):
+        db = self.session_factory()
+        try:
+            variant_ids = [variant_id for (variant_id,) in self._variants_query(db, key).filter(
+                CachedPuzzle.question == puzzle["question"], CachedPuzzle.answer == puzzle["answer"]
+            ).with_entities(CachedPuzzle.id)]
+            served = {variant_id for (variant_id,) in db.query(CachedPuzzleDelivery.cached_puzzle_id).filter(
+                CachedPuzzleDelivery.user_id == user_id, CachedPuzzleDelivery.cached_puzzle_id.in_(variant_ids)
+            )}
+            for variant_id in variant_ids:
+                if variant_id not in served:
+                    db.add(CachedPuzzleDelivery(cached_puzzle_id=variant_id, user_id=user_id))
+            db.commit()
+        except IntegrityError:
+            # Recorded concurrently by another request of the same user
+            db.rollback()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def size(self):
+        db = self.session_factory()
+        try:
+            cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.ttl)
+            return db.query(CachedPuzzle).filter(CachedPuzzle.created_at >= cutoff).count()
+        finally:
+            db.close()
+
+
+class PuzzleCache:
+    def __init__(self, backend, reuse_policy: str = REUSE_UNIQUE_PER_USER,
+                 difficulty_step: float = 0.25, min_variants: int = 1):
+        if reuse_policy not in (REUSE_ANY, REUSE_UNIQUE_PER_USER):
+            raise ValueError(f"Unknown puzzle cache reuse policy: {reuse_policy}")
+        self.backend = backend
+        self.reuse_policy = reuse_policy
+        self.difficulty_step = difficulty_step
+        self.min_variants = min_variants
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.errors = 0
+        self._stats_lock = threading.Lock()
+
+    def make_key(self, theme: str, difficulty: float, age_group: str):
+        return (
+            " ".join(theme.casefold().split()),
+            " ".join(age_group.casefold().split()),
+            difficulty_bucket(difficulty, self.difficulty_step),
+        )
+
+    def _count(self, counter: str):
+        with self._stats_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, theme: str, difficulty: float, age_group: str, user_id=None):
+        key = self.make_key(theme, difficulty, age_group)
+        try:
+            # Keep generating fresh puzzles until a key has enough variants to rotate through
+            puzzle = None
+            if self.backend.count(key) >= self.min_variants:
+                puzzle = self.backend.take(key, user_id, self.reuse_policy == REUSE_UNIQUE_PER_USER)
+        except Exception as e:
+            logger.error(f"Error reading puzzle cache: {str(e)}")
+            self._count("errors")
+            puzzle = None
+        self._count("hits" if puzzle else "misses")
+        return puzzle
+
+    def put(self, theme: str, difficulty: float, age_group: str, puzzle: dict, user_id=None):
+        key = self.make_key(theme, difficulty, age_group)
+        try:
+            self.backend.add(key, puzzle, user_id)
+            self._count("stores")
+        except Exception as e:
+            logger.error(f"Error writing puzzle cache: {str(e)}")
+            self._count("errors")
+
+    def mark_served(self, theme: str, difficulty: float, age_group: str, puzzle: dict, user_id=None):
+        # For a puzzle that reached this user without a cache lookup, e.g. through a coalesced call
+        if user_id is None:
+            return
+        key = self.make_key(theme, difficulty, age_group)
+        try:
+            self.backend.mark_served(key, puzzle, user_id)
+        except Exception as e:
+            logger.error(f"Error marking cached puzzle as served: {str(e)}")
+            self._count("errors")
+
+    def stats(self):
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "backend": type(self.backend).__name__,
+                "reuse_policy": self.reuse_policy,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "errors": self.errors,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+        try:
+            stats["size"] = self.backend.size()
+        except Exception as e:
+            logger.error(f"Error reading puzzle cache size: {str(e)}")
+        return stats
+
+
+def create_puzzle_cache():
+    backend_name = os.getenv("PUZZLE_CACHE_BACKEND", "memory")
+    ttl = float(os.getenv("PUZZLE_CACHE_TTL", "86400"))
+    max_variants = int(os.getenv("PUZZLE_CACHE_MAX_VARIANTS", "20"))
+
+    if backend_name == "none":
+        return None
+    if backend_name == "memory":
+        backend = InMemoryPuzzleCacheBackend(
+            maxsize=int(os.getenv("PUZZLE_CACHE_MAXSIZE", "1024")), ttl=ttl, max_variants=max_variants
+        )
+    elif backend_name == "database":
+        backend = DatabasePuzzleCacheBackend(ttl=ttl, max_variants=max_variants)
+    else:
+        raise ValueError(f"Unknown puzzle cache backend: {backend_name}")
+
+    return PuzzleCache(
+        backend,
+        reuse_policy=os.getenv("PUZZLE_CACHE_REUSE_POLICY", REUSE_UNIQUE_PER_USER),
+        difficulty_step=float(os.getenv("PUZZLE_CACHE_DIFFICULTY_STEP", "0.25")),
+        min_variants=int(os.getenv("PUZZLE_CACHE_MIN_VARIANTS", "1")),
+    )
+
+
+_puzzle_cache = None
+_puzzle_cache_created = False
+_puzzle_cache_lock = threading.Lock()
+
+def get_puzzle_cache():
+    global _puzzle_cache, _puzzle_cache_created
+    if not _puzzle_cache_created:
+        with _puzzle_cache_lock:
+            if not _puzzle_cache_created:
+                _puzzle_cache = create_puzzle_cache()
+                _puzzle_cache_created = True
+    return _puzzle_cache
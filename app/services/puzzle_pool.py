@@ -0,0 +1,303 @@
+from collections import OrderedDict
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models.models import PooledPuzzle
+from app.utils.database import SessionLocal
+from app.utils.logger import setup_logger
+import json
+import math
+import os
+import threading
+import time
+
+logger = setup_logger()
+
+
+def normalize_label(value: str):
+    return " ".join(value.casefold().split())
+
+
+class PuzzlePool:
+    def __init__(self, llm_service, session_factory=SessionLocal, band_width: float = 0.25,
+                 default_target: int = 10, low_watermark: int = 3, refill_interval: float = 30.0,
+                 max_bands: int = 200, band_targets: dict = None, register_after: int = 3,
+                 band_idle_ttl: float = 86400.0):
+        self.llm_service = llm_service
+        self.session_factory = session_factory
+        self.band_width = band_width
+        self.default_target = default_target
+        self.low_watermark = low_watermark
+        self.refill_interval = refill_interval
+        self.max_bands = max_bands
+        self.register_after = register_after
+        self.band_idle_ttl = band_idle_ttl
+        self.takes = 0
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.generation_failures = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._worker = None
+        # (theme, age_group, band) -> target depth; seeded from configuration, extended by demand
+        self.bands = {}
+        self.band_labels = {}
+        # Configured bands are never evicted; bands added by demand are dropped once idle
+        self.pinned = set()
+        self.band_last_used = {}
+        # Takes seen for bands that are not registered yet, least recently seen first. A band is
+        # only filled in the background after register_after takes, unless its theme is configured.
+        self.demand = OrderedDict()
+        self.configured_themes = set()
+        refused = []
+        for key, target in (band_targets or {}).items():
+            # Pinned bands cannot be evicted, so past max_bands _register leaves them out
+            registered = self._register(key[0], key[1], key[2], target)
+            if registered in self.bands:
+                self.pinned.add(registered)
+            else:
+                refused.append(key)
+            self.configured_themes.add(normalize_label(key[0]))
+        if refused:
+            logger.warning(f"{len(refused)} configured puzzle pool bands exceed max_bands={max_bands} "
+                           f"and are not filled: {refused}")
+
+    def band_for(self, difficulty: float):
+        return int(math.floor(difficulty / self.band_width))
+
+    def band_difficulty(self, band: int):
+        return round((band + 0.5) * self.band_width, 3)
+
+    def _register(self, theme: str, age_group: str, band: int, target: int = None):
+        key = (normalize_label(theme), normalize_label(age_group), band)
+        with self._lock:
+            if key not in self.bands:
+                if len(self.bands) >= self.max_bands and not self._evict_least_recently_used():
+                    return key
+                self.bands[key] = target if target is not None else self.default_target
+                self.band_labels[key] = (theme, age_group)
+            self.band_last_used[key] = time.monotonic()
+        return key
+
+    def _note_demand(self, theme: str, age_group: str, band: int):
+        # Any client-supplied theme reaches take(), so a one-off theme must not trigger refills
+        key = (normalize_label(theme), normalize_label(age_group), band)
+        with self._lock:
+            if key in self.bands:
+                self.band_last_used[key] = time.monotonic()
+                return key
+            if key[0] not in self.configured_themes:
+                seen = self.demand.pop(key, 0) + 1
+                if seen < self.register_after:
+                    self.demand[key] = seen
+                    while len(self.demand) > self.max_bands * 10:
+                        self.demand.popitem(last=False)
+                    return key
+        return self._register(theme, age_group, band)
+
+    def _evict_least_recently_used(self):
+        # Called with the lock held; frees one slot by dropping the least recently used demand band
+        candidates = [key for key in self.bands if key not in self.pinned]
+        if not candidates:
+            return False
+        self._drop_band(min(candidates, key=lambda key: self.band_last_used.get(key, 0.0)))
+        return True
+
+    def _drop_band(self, key):
+        # Puzzles already pooled for the band stay in the table and are still handed out by take()
+        self.bands.pop(key, None)
+        self.band_labels.pop(key, None)
+        self.band_last_used.pop(key, None)
+
+    def evict_idle_bands(self):
+        cutoff = time.monotonic() - self.band_idle_ttl
+        with self._lock:
+            idle = [key for key in self.bands if key not in self.pinned and self.band_last_used.get(key, 0.0) < cutoff]
+            for key in idle:
+                self._drop_band(key)
+        if idle:
+            logger.info(f"Dropped {len(idle)} idle puzzle pool bands")
+        return len(idle)
+
+    async def take(self, db: AsyncSession, theme: str, age_group: str, difficulty: float, count: int = 1):
+        # Claims up to count ready-made puzzles inside the caller's transaction, so the pooled
+        # rows are only removed when the caller commits the puzzles built from them.
+        key = self._note_demand(theme, age_group, self.band_for(difficulty))
+        result = await db.execute(
+            select(PooledPuzzle)
+            .filter(
+                PooledPuzzle.theme == key[0],
+                PooledPuzzle.age_group == key[1],
+                PooledPuzzle.difficulty_band == key[2],
+            )
+            .order_by(PooledPuzzle.id)
+            .limit(count)
+            .with_for_update(skip_locked=True)
+        )
+        rows = result.scalars().all()
+        for row in rows:
+            await db.delete(row)
+
+        with self._lock:
+            self.takes += 1
+            self.hits += len(rows)
+            self.misses += count - len(rows)
+        # The worker checks watermarks on every pass; wake it now rather than at the next interval
+        self._wakeup.set()
+        return [{"question": row.question, "answer": row.answer, "hint": row.hint} for row in rows]
+
+    def depths(self):
+        db = self.session_factory()
+        try:
+            rows = (
+                db.query(
+                    PooledPuzzle.theme,
+                    PooledPuzzle.age_group,
+                    PooledPuzzle.difficulty_band,
+                    func.count(PooledPuzzle.id),
+                )
+                .group_by(PooledPuzzle.theme, PooledPuzzle.age_group, PooledPuzzle.difficulty_band)
+                .all()
+            )
+            return {(theme, age_group, band): depth for theme, age_group, band, depth in rows}
+        finally:
+            db.close()
+
+    def refill_once(self):
+        self.evict_idle_bands()
+        depths = self.depths()
+        with self._lock:
+            bands = list(self.bands.items())
+        for key, target in bands:
+            depth = depths.get(key, 0)
+            if depth >= self.low_watermark:
+                continue
+            self._fill_band(key, target - depth)
+
+    def _fill_band(self, key, missing: int):
+        labels = self.band_labels.get(key)
+        if labels is None:
+            # Evicted since refill_once listed it
+            return
+        theme, age_group = labels
+        difficulty = self.band_difficulty(key[2])
+        puzzles = []
+        for _ in range(missing):
+            if self._stopping.is_set():
+                break
+            try:
+                content = self.llm_service.generate_puzzle(theme, difficulty, age_group, use_cache=False, fallback=False)
+            except Exception as e:
+                logger.error(f"Error generating pooled puzzle for {key}: {str(e)}")
+                with self._lock:
+                    self.generation_failures += 1
+                continue
+            if not content["question"] or not content["answer"]:
+                with self._lock:
+                    self.generation_failures += 1
+                continue
+            puzzles.append(PooledPuzzle(
+                theme=key[0],
+                age_group=key[1],
+                difficulty_band=key[2],
+                difficulty=difficulty,
+                question=content["question"],
+                answer=content["answer"],
+                hint=content["hint"],
+            ))
+
+        if not puzzles:
+            return
+        db = self.session_factory()
+        try:
+            db.add_all(puzzles)
+            db.commit()
+            with self._lock:
+                self.generated += len(puzzles)
+            logger.info(f"Refilled puzzle pool band {key} with {len(puzzles)} puzzles")
+        except Exception as e:
+            logger.error(f"Error storing pooled puzzles: {str(e)}")
+            db.rollback()
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.clear()
+            try:
+                self.refill_once()
+            except Exception as e:
+                logger.error(f"Puzzle pool refill failed: {str(e)}")
+            self._wakeup.wait(self.refill_interval)
+
+    def start(self):
+        if self._worker and self._worker.is_alive():
+            return
+        self._stopping.clear()
+        self._worker = threading.Thread(target=self._run, name="puzzle-pool-refill", daemon=True)
+        self._worker.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._worker:
+            self._worker.join(timeout=5)
+
+    def metrics(self):
+        depths = self.depths()
+        with self._lock:
+            bands = [
+                {
+                    "theme": key[0],
+                    "age_group": key[1],
+                    "difficulty_band": key[2],
+                    "difficulty": self.band_difficulty(key[2]),
+                    "depth": depths.get(key, 0),
+                    "target": target,
+                    "below_low_watermark": depths.get(key, 0) < self.low_watermark,
+                    "configured": key in self.pinned,
+                }
+                for key, target in self.bands.items()
+            ]
+            return {
+                "band_width": self.band_width,
+                "low_watermark": self.low_watermark,
+                "default_target": self.default_target,
+                "register_after": self.register_after,
+                "pending_demand": len(self.demand),
+                "total_depth": sum(depths.values()),
+                "takes": self.takes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "generated": self.generated,
+                "generation_failures": self.generation_failures,
+                "worker_running": bool(self._worker and self._worker.is_alive()),
+                "bands": bands,
+            }
+
+
+def parse_band_targets(raw: str):
+    # PUZZLE_POOL_BAND_TARGETS is a JSON object such as {"Space|teen|4": 25}
+    targets = {}
+    for band_key, target in json.loads(raw or "{}").items():
+        theme, age_group, band = band_key.split("|")
+        targets[(theme, age_group, int(band))] = int(target)
+    return targets
+
+
+def create_puzzle_pool(llm_service):
+    if os.getenv("PUZZLE_POOL_ENABLED", "true").lower() not in ("1", "true", "yes"):
+        return None
+    return PuzzlePool(
+        llm_service=llm_service,
+        band_width=float(os.getenv("PUZZLE_POOL_BAND_WIDTH", "0.25")),
+        default_target=int(os.getenv("PUZZLE_POOL_TARGET", "10")),
+        low_watermark=int(os.getenv("PUZZLE_POOL_LOW_WATERMARK", "3")),
+        refill_interval=float(os.getenv("PUZZLE_POOL_REFILL_INTERVAL", "30")),
+        max_bands=int(os.getenv("PUZZLE_POOL_MAX_BANDS", "200")),
+        band_targets=parse_band_targets(os.getenv("PUZZLE_POOL_BAND_TARGETS")),
+        register_after=int(os.getenv("PUZZLE_POOL_REGISTER_AFTER", "3")),
+        band_idle_ttl=float(os.getenv("PUZZLE_POOL_BAND_IDLE_TTL", "86400")),
+    )
+
@@ -0,0 +1,143 @@
+from dataclasses import dataclass, field
+from langchain.text_splitter import CharacterTextSplitter
+from app.utils.logger import setup_logger
+import hashlib
+import json
+import numpy as np
+import os
+import sqlite3
+import threading
+
+logger = setup_logger()
+
+SOURCE_EXTENSIONS = (".json", ".jsonl", ".txt", ".md")
+
+EMBEDDING_CACHE_PATH = os.getenv("RAG_EMBEDDING_CACHE", "data/embedding_cache.sqlite3")
+# A batch is sent once it holds this many chunks or this many characters, whichever comes first
+EMBEDDING_BATCH_SIZE = int(os.getenv("RAG_EMBEDDING_BATCH_SIZE", "256"))
+EMBEDDING_BATCH_CHARS = int(os.getenv("RAG_EMBEDDING_BATCH_CHARS", "200000"))
+
+_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
+
+
+@dataclass
+class Chunk:
+    chunk_id: str
+    text: str
+    metadata: dict = field(default_factory=dict)
+
+
+def chunk_id(text: str):
+    # Content address of a chunk: identical text anywhere in the corpus is embedded and indexed once
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def source_files(path: str):
+    # A single file, or every supported file under a directory, in a stable order
+    if os.path.isfile(path):
+        return [path]
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        files.extend(os.path.join(root, name) for name in sorted(names) if name.endswith(SOURCE_EXTENSIONS))
+    return files
+
+
+def iter_records(file_path: str):
+    # JSONL is streamed line by line; a .json file holds one record or an array of them
+    if file_path.endswith(".jsonl"):
+        with open(file_path, "r", encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+    elif file_path.endswith(".json"):
+        with open(file_path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        yield from (data if isinstance(data, list) else [data])
+    else:
+        with open(file_path, "r", encoding="utf-8") as file:
+            yield file.read()
+
+
+def iter_chunks(file_path: str, source: str):
+    for record in iter_records(file_path):
+        # Records are indexed as their JSON text, as JSONLoader(jq_schema='.') did
+        text = record if isinstance(record, str) else json.dumps(record)
+        metadata = {"source": source}
+        if isinstance(record, dict) and record.get("theme"):
+            metadata["theme"] = record["theme"]
+        for piece in _splitter.split_text(text):
+            yield Chunk(chunk_id(piece), piece, metadata)
+
+
+def batches(chunks: list, max_count: int = EMBEDDING_BATCH_SIZE, max_chars: int = EMBEDDING_BATCH_CHARS):
+    batch, size = [], 0
+    for chunk in chunks:
+        if batch and (len(batch) >= max_count or size + len(chunk.text) > max_chars):
+            yield batch
+            batch, size = [], 0
+        batch.append(chunk)
+        size += len(chunk.text)
+    if batch:
+        yield batch
+
+
+class EmbeddingCache:
+    # Content-addressed embeddings on disk, keyed by (embedding model, chunk id), so a chunk is
+    # embedded once per model no matter how often indexes are rebuilt
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, chunk_id TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, chunk_id))"
+        )
+        self._connection.commit()
+        self._lock = threading.Lock()
+
+    def get_many(self, model: str, chunk_ids: list):
+        found = {}
+        with self._lock:
+            for start in range(0, len(chunk_ids), 500):
+                part = chunk_ids[start:start + 500]
+                rows = self._connection.execute(
+                    f"SELECT chunk_id, vector FROM embeddings WHERE model = ? AND chunk_id IN ({','.join('?' * len(part))})",
+                    [model, *part],
+                )
+                for cached_id, vector in rows:
+                    found[cached_id] = np.frombuffer(vector, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, model: str, vectors: dict):
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, chunk_id, vector) VALUES (?, ?, ?)",
+                [(model, cached_id, np.asarray(vector, dtype=np.float32).tobytes()) for cached_id, vector in vectors.items()],
+            )
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def embed_chunks(embeddings, model: str, chunks: list, cache: EmbeddingCache = None):
+    # Returns {chunk_id: vector}; only cache misses reach the embedding API, in size-bounded batches
+    vectors = cache.get_many(model, [chunk.chunk_id for chunk in chunks]) if cache else {}
+    missing = [chunk for chunk in chunks if chunk.chunk_id not in vectors]
+    if missing:
+        logger.info(f"Embedding {len(missing)} new chunks ({len(chunks) - len(missing)} cached)")
+    for batch in batches(missing):
+        embedded = dict(zip(
+            (chunk.chunk_id for chunk in batch),
+            embeddings.embed_documents([chunk.text for chunk in batch]),
+        ))
+        # Written per batch, so an interrupted ingestion resumes where it stopped
+        if cache:
+            cache.put_many(model, embedded)
+        vectors.update(embedded)
+    return vectors
@@ -1,46 +1,155 @@
-from langchain_community.embeddings import OpenAIEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
-from langchain_community.document_loaders import TextLoader
-from langchain_community.document_loaders import JSONLoader
-from langchain.text_splitter import CharacterTextSplitter
 from app.utils.logger import setup_logger
-from langchain_openai import OpenAIEmbeddings
+from app.utils.telemetry import stage
+from app.services.providers import create_embeddings
+from app.services.rag_ingestion import Chunk, EmbeddingCache, embed_chunks, iter_chunks, source_files
+from app.services.vector_index import create_index, index_description, set_search_parameters, supports_removal
 
+import hashlib
 import json
+import numpy as np
+import os
+import shutil
+import threading
+import time
 
 logger = setup_logger()
 
+THEMES_FILE = os.getenv("RAG_THEMES_FILE", "data/sample_themes.json")
+INDEX_DIR = os.getenv("RAG_INDEX_DIR", "data/faiss_index")
+# load_index looks for changed source files at most this often (seconds)
+RELOAD_INTERVAL = float(os.getenv("RAG_RELOAD_INTERVAL", "5"))
+MANIFEST_FILE = "manifest.json"
+
 class RAGService:
-    def __init__(self):
-        self.embeddings = OpenAIEmbeddings()
+    def __init__(self, index_dir: str = INDEX_DIR, http_client=None, embedding_cache: EmbeddingCache = None):
+        self.embeddings = create_embeddings(http_client)
+        # Indexes and cached vectors are only valid for the embedding model that made them
+        self.model = getattr(self.embeddings, 'model', type(self.embeddings).__name__)
+        self.embedding_cache = embedding_cache
         self.vector_store = None
+        self.index_dir = index_dir
+        # Per source file (relative path): its (mtime_ns, size) signature and chunk ids
+        self.manifest = {}
+        # faiss.index_factory string of the current index, e.g. "Flat" or "IVF512,SQ8"
+        self.index_description = None
+        self._source_path = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+        # Held only while the index is mutated or searched, never during embedding calls
+        self._index_lock = threading.Lock()
 
-    def load_data(self, file_path: str):
-        try:
-            # First, let's check if the file exists and has content
-            with open(file_path, 'r') as file:
-                data = json.load(file)
-            
-            if not data:
-                logger.warning(f"The file {file_path} is empty.")
-                return
+    def _cache(self):
+        if self.embedding_cache is None:
+            self.embedding_cache = EmbeddingCache()
+        return self.embedding_cache
 
-            # Use JSONLoader instead of TextLoader
-            loader = JSONLoader(file_path=file_path, jq_schema='.', text_content=False)
-            documents = loader.load()
+    def index_path(self, source_path: str):
+        key = hashlib.sha256(f"{self.model}\0{os.path.abspath(source_path)}".encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.index_dir, key)
 
-            if not documents:
-                logger.warning(f"No documents were loaded from {file_path}")
-                return
+    def ingest(self, source_path: str):
+        # Brings the index in line with a source file or directory (.json, .jsonl, .txt, .md).
+        # Unchanged files are skipped by signature; of the rest, only chunks the index does not
+        # hold yet are embedded (or taken from the embedding cache) and added, and chunks no
+        # longer in the corpus are deleted. The index is rebuilt from cached vectors when the
+        # configured index type changes with the corpus size, or when it cannot delete in place (IVF, HNSW).
+        # Returns the number of chunks added and removed, and whether the index was rebuilt.
+        with stage("rag.ingest"):
+            base = source_path if os.path.isdir(source_path) else os.path.dirname(source_path)
+            present = set(self.vector_store.index_to_docstore_id.values()) if self.vector_store else set()
+            previous = self.manifest if self.vector_store is not None else {}
 
-            text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=0)
-            texts = text_splitter.split_documents(documents)
-            
-            if not texts:
-                logger.warning("No texts were generated after splitting documents")
-                return
+            for full_scan in (False, True):
+                manifest = {}
+                new_chunks = {}
+                for file_path in source_files(source_path):
+                    source = os.path.relpath(file_path, base)
+                    stat = os.stat(file_path)
+                    signature = [stat.st_mtime_ns, stat.st_size]
+                    entry = previous.get(source)
+                    if not full_scan and entry and entry["signature"] == signature:
+                        manifest[source] = entry
+                        continue
+                    chunk_ids = []
+                    for chunk in iter_chunks(file_path, source):
+                        chunk_ids.append(chunk.chunk_id)
+                        new_chunks.setdefault(chunk.chunk_id, chunk)
+                    manifest[source] = {"signature": signature, "chunks": chunk_ids}
+
+                wanted = set()
+                for entry in manifest.values():
+                    wanted.update(entry["chunks"])
+                if wanted - present <= new_chunks.keys():
+                    break
+                # The manifest lists chunks the index lacks (e.g. a partially written index); rescan everything
+                logger.warning(f"RAG index for {source_path} is missing chunks, rescanning all sources")
 
-            self.vector_store = FAISS.from_documents(texts, self.embeddings)
+            to_add = [new_chunks[chunk_id] for chunk_id in sorted(wanted - present)]
+            to_remove = sorted(present - wanted)
+            vectors = embed_chunks(self.embeddings, self.model, to_add, self._cache()) if to_add else {}
+
+            rebuilt = False
+            if not wanted:
+                with self._index_lock:
+                    self.vector_store = None
+                self.index_description = None
+            else:
+                dimensions = self.vector_store.index.d if self.vector_store else len(next(iter(vectors.values())))
+                description = index_description(len(wanted), dimensions)
+                rebuilt = (self.vector_store is None or description != self.index_description
+                           or (bool(to_remove) and not supports_removal(description)))
+                if rebuilt:
+                    kept = [self._stored_chunk(chunk_id) for chunk_id in sorted(wanted & present)]
+                    vectors.update(embed_chunks(self.embeddings, self.model, kept, self._cache()))
+                    store = self._new_store(description, to_add + kept, vectors)
+                    with self._index_lock:
+                        self.vector_store = store
+                    self.index_description = description
+                else:
+                    with self._index_lock:
+                        if to_remove:
+                            self.vector_store.delete(to_remove)
+                        if to_add:
+                            self.vector_store.add_embeddings(
+                                [(chunk.text, vectors[chunk.chunk_id]) for chunk in to_add],
+                                metadatas=[chunk.metadata for chunk in to_add],
+                                ids=[chunk.chunk_id for chunk in to_add],
+                            )
+            self.manifest = manifest
+
+            if to_add or to_remove or rebuilt:
+                logger.info(f"RAG index for {source_path}: {len(to_add)} chunks added, {len(to_remove)} removed, "
+                            f"{len(wanted)} total ({self.index_description}{', rebuilt' if rebuilt else ''})")
+            return len(to_add), len(to_remove), rebuilt
+
+    def _stored_chunk(self, chunk_id: str):
+        document = self.vector_store.docstore.search(chunk_id)
+        return Chunk(chunk_id, document.page_content, document.metadata)
+
+    def _new_store(self, description: str, chunks: list, vectors: dict):
+        matrix = np.array([vectors[chunk.chunk_id] for chunk in chunks], dtype=np.float32)
+        store = FAISS(self.embeddings, create_index(description, matrix), InMemoryDocstore(), {})
+        store.add_embeddings(
+            [(chunk.text, vectors[chunk.chunk_id]) for chunk in chunks],
+            metadatas=[chunk.metadata for chunk in chunks],
+            ids=[chunk.chunk_id for chunk in chunks],
+        )
+        return store
+
+    def load_data(self, file_path: str):
+        # Builds a fresh in-memory index from file_path, without reading or writing the persisted one
+        try:
+            with stage("rag.load_data"):
+                self.vector_store = None
+                self.manifest = {}
+                self.index_description = None
+                self._source_path = None
+                self.ingest(file_path)
+            if self.vector_store is None:
+                logger.warning(f"No documents were loaded from {file_path}")
+                return
             logger.info(f"Data loaded successfully from {file_path}")
         except FileNotFoundError:
             logger.error(f"File not found: {file_path}")
@@ -50,13 +159,108 @@ class RAGService:
             logger.error(f"Error loading data: {str(e)}")
             raise
 
+    def _open(self, source_path: str):
+        # Loads the persisted index and manifest for source_path, or starts empty
+        target_dir = self.index_path(source_path)
+        manifest_path = os.path.join(target_dir, MANIFEST_FILE)
+        self.vector_store = None
+        self.manifest = {}
+        self.index_description = None
+        if os.path.isfile(manifest_path):
+            # The docstore is pickled by FAISS.save_local; we only ever load files we wrote ourselves
+            self.vector_store = FAISS.load_local(target_dir, self.embeddings, allow_dangerous_deserialization=True)
+            set_search_parameters(self.vector_store.index)
+            with open(manifest_path, "r") as file:
+                manifest = json.load(file)
+            self.manifest = manifest.get("files", {})
+            self.index_description = manifest.get("index")
+            logger.info(f"FAISS index loaded from {target_dir}")
+        self._source_path = source_path
+
+    def _save(self, source_path: str):
+        target_dir = self.index_path(source_path)
+        if self.vector_store is None:
+            # The corpus is empty: drop the persisted index so _open does not bring back its chunks
+            if os.path.isdir(target_dir):
+                shutil.rmtree(target_dir)
+                logger.info(f"Removed FAISS index {target_dir}, {source_path} has no documents left")
+            return None
+        os.makedirs(self.index_dir, exist_ok=True)
+        tmp_dir = f"{target_dir}.tmp-{os.getpid()}"
+        with self._index_lock:
+            self.vector_store.save_local(tmp_dir)
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as file:
+            json.dump({"index": self.index_description, "files": self.manifest}, file)
+        if os.path.isdir(target_dir):
+            shutil.rmtree(target_dir)
+        os.replace(tmp_dir, target_dir)
+
+        # Indexes keyed by the whole source file's hash predate incremental ingestion
+        for entry in os.listdir(self.index_dir):
+            path = os.path.join(self.index_dir, entry)
+            if ".tmp-" not in entry and not os.path.isfile(os.path.join(path, MANIFEST_FILE)):
+                shutil.rmtree(path, ignore_errors=True)
+        return target_dir
+
+    def build_index(self, file_path: str):
+        # Brings the persisted index for file_path up to date and saves it, even if nothing changed
+        with self._lock:
+            if self._source_path != file_path:
+                self._open(file_path)
+            self.ingest(file_path)
+            target_dir = self._save(file_path)
+            self._checked_at = time.monotonic()
+        if target_dir:
+            logger.info(f"FAISS index for {file_path} saved to {target_dir}")
+        return target_dir
+
+    def load_index(self, file_path: str):
+        # Loads the persisted index once per process and applies source changes incrementally,
+        # checking the sources at most every RELOAD_INTERVAL seconds
+        with self._lock:
+            now = time.monotonic()
+            if (self._source_path == file_path and self._checked_at is not None
+                    and now - self._checked_at < RELOAD_INTERVAL):
+                return
+            if self._source_path != file_path:
+                self._open(file_path)
+            if any(self.ingest(file_path)):
+                self._save(file_path)
+            self._checked_at = now
 
     def query(self, query_text: str, k: int = 4):
         try:
             if not self.vector_store:
                 raise ValueError("Vector store not initialized. Please load data first.")
-            docs = self.vector_store.similarity_search(query_text, k=k)
+            # Embedding and search are timed separately: one is a network call, the other is local
+            with stage("rag.query"):
+                with stage("rag.embed_query"):
+                    embedding = self.embeddings.embed_query(query_text)
+                with stage("rag.faiss_search"), self._index_lock:
+                    docs = self.vector_store.similarity_search_by_vector(embedding, k=k)
             return [doc.page_content for doc in docs]
         except Exception as e:
             logger.error(f"Error querying vector store: {str(e)}")
-            return []  # Return an empty list instead of raising an exception
\ No newline at end of file
+            return []  # Return an empty list instead of raising an exception
+
+    def query_batch(self, query_texts: list, k: int = 4):
+        # Embeds every text in one request and searches them in one vectorized FAISS call;
+        # returns one list of passages per text, in order
+        try:
+            if not self.vector_store:
+                raise ValueError("Vector store not initialized. Please load data first.")
+            if not query_texts:
+                return []
+            with stage("rag.query_batch"):
+                with stage("rag.embed_query"):
+                    matrix = np.array(self.embeddings.embed_documents(list(query_texts)), dtype=np.float32)
+                with stage("rag.faiss_search"), self._index_lock:
+                    _, indices = self.vector_store.index.search(matrix, k)
+                    ids = self.vector_store.index_to_docstore_id
+                    return [
+                        [self.vector_store.docstore.search(ids[i]).page_content for i in row if i != -1]
+                        for row in indices
+                    ]
+        except Exception as e:
+            logger.error(f"Error querying vector store: {str(e)}")
+            return [[] for _ in query_texts]
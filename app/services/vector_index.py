@@ -0,0 +1,76 @@
+import faiss
+import math
+import numpy as np
+import os
+
+# flat: exact search, best up to a few hundred thousand vectors
+# ivf / ivf_sq8 / ivf_pq: inverted lists, searched RAG_NPROBE lists at a time; SQ8 stores 1 byte
+#   per dimension, PQ RAG_PQ_M bytes per vector
+# hnsw / hnsw_sq8: graph search with RAG_EF_SEARCH candidates; no training, no deletion
+# Only flat indexes delete in place; removing chunks from any other layout rebuilds it
+# RAG_INDEX_FACTORY takes any faiss.index_factory string instead (e.g. "IVF1024,PQ32x8")
+INDEX_TYPE = os.getenv("RAG_INDEX_TYPE", "flat")
+INDEX_FACTORY = os.getenv("RAG_INDEX_FACTORY")
+# Defaults from benchmarks/rag_index.py at 50k x 256: flat is exact at ~5ms per query, small
+# next to the embedding call; IVF needs nprobe 32+ for recall@4 above 0.95
+NPROBE = int(os.getenv("RAG_NPROBE", "32"))
+EF_SEARCH = int(os.getenv("RAG_EF_SEARCH", "128"))
+HNSW_M = int(os.getenv("RAG_HNSW_M", "32"))
+PQ_M = int(os.getenv("RAG_PQ_M", "0"))
+# IVF and PQ need k-means training; below this many vectors the exact index is used instead
+MIN_TRAINING_VECTORS = int(os.getenv("RAG_MIN_TRAINING_VECTORS", "10000"))
+
+
+def ivf_lists(count: int):
+    # About 4 * sqrt(n) lists, rounded to a power of two so the layout only changes as the corpus doubles
+    return 2 ** max(0, round(math.log2(4 * math.sqrt(max(count, 1)))))
+
+
+def pq_subquantizers(dimensions: int):
+    if PQ_M:
+        return PQ_M
+    # Largest divisor of the dimension giving at least 8 dimensions per sub-quantizer
+    return next(m for m in range(max(1, dimensions // 8), 0, -1) if dimensions % m == 0)
+
+
+def index_description(count: int, dimensions: int, index_type: str = None):
+    if INDEX_FACTORY and index_type is None:
+        return INDEX_FACTORY
+    index_type = index_type or INDEX_TYPE
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "hnsw":
+        return f"HNSW{HNSW_M}"
+    if index_type == "hnsw_sq8":
+        return f"HNSW{HNSW_M},SQ8"
+    if index_type not in ("ivf", "ivf_sq8", "ivf_pq"):
+        raise ValueError(f"Unknown RAG index type: {index_type}")
+    if count < MIN_TRAINING_VECTORS:
+        return "Flat"
+    encoding = {"ivf": "Flat", "ivf_sq8": "SQ8", "ivf_pq": f"PQ{pq_subquantizers(dimensions)}"}[index_type]
+    return f"IVF{ivf_lists(count)},{encoding}"
+
+
+def supports_removal(description: str):
+    # langchain's FAISS.delete renumbers its id map to 0..n-1, which only matches indexes that shift
+    # the remaining vectors down on removal (Flat). IVF keeps the stored ids and HNSW cannot delete,
+    # so those are rebuilt from the embedding cache instead.
+    return description == "Flat"
+
+
+def set_search_parameters(index, nprobe: int = None, ef_search: int = None):
+    # Applies nprobe to IVF indexes and efSearch to HNSW ones; other indexes ignore them
+    parameters = faiss.ParameterSpace()
+    if faiss.try_extract_index_ivf(index) is not None:
+        parameters.set_index_parameter(index, "nprobe", nprobe or NPROBE)
+    if "HNSW" in type(index).__name__:
+        parameters.set_index_parameter(index, "efSearch", ef_search or EF_SEARCH)
+
+
+def create_index(description: str, vectors: np.ndarray):
+    # An empty index for `description`, trained on `vectors` when it needs training
+    index = faiss.index_factory(vectors.shape[1], description, faiss.METRIC_L2)
+    if not index.is_trained:
+        index.train(vectors)
+    set_search_parameters(index)
+    return index
@@ -1,15 +1,116 @@
+import atexit
+import contextvars
+import datetime
 import logging
+import logging.handlers
+import orjson
+import os
+import queue
+import random
 import sys
+import threading
+import uuid
+import zlib
 
-def setup_logger():
-    logger = logging.getLogger("escapeRoom")
-    logger.setLevel(logging.INFO)
+LOGGER_NAME = "escapeRoom"
+
+# Set per request by the correlation id middleware; tasks and executor calls started from the
+# request inherit it, so background generation logs under the id of the POST that queued it
+correlation_id = contextvars.ContextVar("correlation_id", default=None)
+
+_configured = False
+_configure_lock = threading.Lock()
+_listener = None
+
+# Attributes every LogRecord has; anything else was passed with extra= and goes into the JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "correlation_id"}
+
+
+def new_correlation_id():
+    return uuid.uuid4().hex
+
+
+class CorrelationFilter(logging.Filter):
+    # Runs in the logging thread, before the record is queued, while the contextvar is visible
+    def filter(self, record):
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    # Keeps INFO and below at `rate`. The decision is made per correlation id, so a sampled
+    # request keeps all of its lines; warnings and errors are never dropped.
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1.0 or record.levelno > logging.INFO:
+            return True
+        request_id = getattr(record, "correlation_id", None)
+        if request_id:
+            return zlib.crc32(request_id.encode("utf-8")) / 0xFFFFFFFF < self.rate
+        return random.random() < self.rate
 
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setLevel(logging.INFO)
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
 
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "timestamp": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+            "thread": record.threadName,
+        }
+        if getattr(record, "correlation_id", None):
+            entry["correlation_id"] = record.correlation_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        return orjson.dumps(entry, default=str).decode("utf-8")
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - [%(correlation_id)s] %(message)s')
+
+    def format(self, record):
+        if getattr(record, "correlation_id", None) is None:
+            record.correlation_id = "-"
+        return super().format(record)
+
+
+def _configure(logger):
+    global _listener
+    level = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+    logger.setLevel(level)
+    # Records only go to our handler; without this the root logger (configured by some
+    # libraries) prints them a second time
+    logger.propagate = False
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(TextFormatter() if os.getenv("LOG_FORMAT", "json") == "text" else JSONFormatter())
+
+    # Callers only put records on an in-memory queue; one listener thread formats and writes them
+    handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    handler.addFilter(CorrelationFilter())
+    handler.addFilter(SamplingFilter(float(os.getenv("LOG_INFO_SAMPLE_RATE", "1.0"))))
     logger.addHandler(handler)
 
-    return logger
\ No newline at end of file
+    _listener = logging.handlers.QueueListener(handler.queue, output)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def setup_logger():
+    # Safe to call from every module: the logger is configured once per process
+    global _configured
+    logger = logging.getLogger(LOGGER_NAME)
+    if not _configured:
+        with _configure_lock:
+            if not _configured:
+                _configure(logger)
+                _configured = True
+    return logger
@@ -0,0 +1,108 @@
+from filelock import FileLock
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+class TokenBucketLimiter:
+    # Requests-per-minute and tokens-per-minute buckets kept in a small state file, so every
+    # worker process on the host draws from the same budget. A caller that cannot be admitted
+    # within max_wait seconds gets RateLimitExceeded at once instead of queueing for upstream.
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, state_path: str, max_wait: float):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.state_path = state_path
+        self.max_wait = max_wait
+        self._file_lock = FileLock(f"{state_path}.lock")
+        self.admitted = 0
+        self.waited = 0.0
+        self.rejected = 0
+        self._stats_lock = threading.Lock()
+
+    def _read(self, now: float):
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            state = {"requests": self.requests_per_minute, "tokens": self.tokens_per_minute, "updated": now}
+        elapsed = max(0.0, now - state["updated"])
+        state["requests"] = min(self.requests_per_minute, state["requests"] + elapsed * self.requests_per_minute / 60)
+        state["tokens"] = min(self.tokens_per_minute, state["tokens"] + elapsed * self.tokens_per_minute / 60)
+        state["updated"] = now
+        return state
+
+    def _write(self, state: dict):
+        tmp_path = f"{self.state_path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _wait_time(self, state: dict, tokens: int):
+        wait = 0.0
+        if self.requests_per_minute and state["requests"] < 1:
+            wait = max(wait, (1 - state["requests"]) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute and state["tokens"] < tokens:
+            wait = max(wait, (tokens - state["tokens"]) * 60 / self.tokens_per_minute)
+        return wait
+
+    def acquire(self, tokens: int):
+        # tokens is an estimate; settle() corrects the bucket once the real usage is known
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        started = time.monotonic()
+        while True:
+            with self._file_lock:
+                state = self._read(time.time())
+                wait = self._wait_time(state, tokens)
+                if wait == 0.0:
+                    state["requests"] -= 1
+                    state["tokens"] -= tokens
+                self._write(state)
+            if wait == 0.0:
+                with self._stats_lock:
+                    self.admitted += 1
+                    self.waited += time.monotonic() - started
+                return
+            if time.monotonic() - started + wait > self.max_wait:
+                with self._stats_lock:
+                    self.rejected += 1
+                raise RateLimitExceeded(f"LLM rate limit reached, next slot in {wait:.1f}s")
+            time.sleep(wait)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        if not self.tokens_per_minute or not actual_tokens:
+            return
+        with self._file_lock:
+            state = self._read(time.time())
+            # May go negative: the overrun is paid back before the next request is admitted
+            state["tokens"] = min(self.tokens_per_minute, state["tokens"] + estimated_tokens - actual_tokens)
+            self._write(state)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "requests_per_minute": self.requests_per_minute,
+                "tokens_per_minute": self.tokens_per_minute,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "average_wait": self.waited / self.admitted if self.admitted else 0.0,
+            }
+
+
+def create_llm_rate_limiter():
+    requests_per_minute = float(os.getenv("LLM_RATE_LIMIT_RPM", "3500"))
+    tokens_per_minute = float(os.getenv("LLM_RATE_LIMIT_TPM", "160000"))
+    if not requests_per_minute and not tokens_per_minute:
+        return None
+    return TokenBucketLimiter(
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+        state_path=os.getenv("LLM_RATE_LIMIT_STATE", os.path.join(tempfile.gettempdir(), "escape-room-llm-rate.json")),
+        max_wait=float(os.getenv("LLM_RATE_LIMIT_MAX_WAIT", "2")),
+    )
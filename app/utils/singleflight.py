@@ -0,0 +1,76 @@
+import copy
+import threading
+import zlib
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # Concurrent calls with the same key share one execution: the first caller runs the function
+    # and the others block until it finishes, then get a copy of its result (or its exception).
+    # Nothing is remembered once the call completes; caching is a separate concern.
+    #
+    # variants > 1 spreads users over that many slots (see slot()), so a crowd asking for the
+    # same thing at once costs at most `variants` upstream calls but does not all get one answer.
+    def __init__(self, name: str, variants: int = 1):
+        self.name = name
+        self.variants = max(1, variants)
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self.errors = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def slot(self, user_id=None):
+        if self.variants == 1 or user_id is None:
+            return 0
+        return zlib.crc32(str(user_id).encode("utf-8")) % self.variants
+
+    def do(self, key, func, *args, **kwargs):
+        # Returns (result, shared); shared is True when another caller's execution was reused
+        with self._lock:
+            self.calls += 1
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result), True
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "variants": self.variants,
+                "calls": self.calls,
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "errors": self.errors,
+                "in_flight": len(self._in_flight),
+                "coalesced_ratio": self.coalesced / self.calls if self.calls else 0.0,
+            }
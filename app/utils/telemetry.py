@@ -0,0 +1,239 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import contextvars
+import json
+import os
+import threading
+import time
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # tracing is optional; stage timings and /metrics work without it
+    otel_trace = None
+
+# Seconds; shared by stage and request histograms
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# USD per 1K (prompt, completion) tokens. LLM_PRICES takes a JSON object of the same shape
+# to add models or override these.
+DEFAULT_PRICES = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4o": (0.0025, 0.01),
+    "fake": (0.0, 0.0),
+}
+PRICES = {**DEFAULT_PRICES, **{model: tuple(price) for model, price in json.loads(os.getenv("LLM_PRICES", "{}")).items()}}
+
+_tracer = otel_trace.get_tracer("escapeRoom") if otel_trace else None
+
+
+def llm_cost(model: str, prompt_tokens: int, completion_tokens: int):
+    prompt_price, completion_price = PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{key}="{str(value)}"' for key, value in labels.items()) + "}"
+
+
+class MetricsRegistry:
+    # Process-wide counters rendered in the Prometheus text format by GET /metrics
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._requests = {}
+        self._llm = {}
+
+    def observe_stage(self, stage: str, seconds: float):
+        with self._lock:
+            self._stages.setdefault(stage, _Histogram()).observe(seconds)
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        with self._lock:
+            self._requests.setdefault((method, route, str(status)), _Histogram()).observe(seconds)
+
+    def record_llm(self, model: str, prompt_tokens: int, completion_tokens: int, cost: float):
+        with self._lock:
+            totals = self._llm.setdefault(model, [0, 0, 0, 0.0])
+            totals[0] += 1
+            totals[1] += prompt_tokens
+            totals[2] += completion_tokens
+            totals[3] += cost
+
+    def _histogram_lines(self, name: str, histogram: _Histogram, labels: dict):
+        lines = []
+        for bound, count in zip(BUCKETS, histogram.counts):
+            lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {count}")
+        lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {histogram.count}")
+        lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum}")
+        lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+        return lines
+
+    def render(self):
+        with self._lock:
+            lines = [
+                "# HELP escape_stage_duration_seconds Time spent in each instrumented stage",
+                "# TYPE escape_stage_duration_seconds histogram",
+            ]
+            for stage, histogram in sorted(self._stages.items()):
+                lines += self._histogram_lines("escape_stage_duration_seconds", histogram, {"stage": stage})
+            lines += [
+                "# HELP escape_http_request_duration_seconds HTTP request latency by route",
+                "# TYPE escape_http_request_duration_seconds histogram",
+            ]
+            for (method, route, status), histogram in sorted(self._requests.items()):
+                lines += self._histogram_lines(
+                    "escape_http_request_duration_seconds", histogram, {"method": method, "route": route, "status": status}
+                )
+            for metric, index, kind, help_text in (
+                ("escape_llm_calls_total", 0, "counter", "LLM calls"),
+                ("escape_llm_prompt_tokens_total", 1, "counter", "Prompt tokens sent to LLMs"),
+                ("escape_llm_completion_tokens_total", 2, "counter", "Completion tokens received from LLMs"),
+                ("escape_llm_cost_usd_total", 3, "counter", "Estimated LLM spend in USD"),
+            ):
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+                for model, totals in sorted(self._llm.items()):
+                    lines.append(f"{metric}{_labels(model=model)} {totals[index]}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+@dataclass
+class RequestTrace:
+    # Per request (or background job): time per stage and LLM usage
+    stages: dict = field(default_factory=dict)
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add_stage(self, stage: str, seconds: float):
+        with self._lock:
+            count, total = self.stages.get(stage, (0, 0.0))
+            self.stages[stage] = (count + 1, total + seconds)
+
+    def add_llm(self, prompt_tokens: int, completion_tokens: int, cost: float):
+        with self._lock:
+            self.llm_calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost += cost
+
+    def server_timing(self):
+        # Server-Timing header value, e.g. 'db;dur=3.1;desc="12 calls", llm.generate_puzzle;dur=812.0'
+        with self._lock:
+            return ", ".join(
+                f'{stage};dur={total * 1000:.1f};desc="{count} calls"'
+                for stage, (count, total) in sorted(self.stages.items())
+            )
+
+    def summary(self):
+        with self._lock:
+            stages = ", ".join(f"{stage} {total:.3f}s/{count}" for stage, (count, total) in sorted(self.stages.items()))
+            return (f"{stages or 'no stages'}; {self.llm_calls} LLM calls, "
+                    f"{self.prompt_tokens}+{self.completion_tokens} tokens, ${self.cost:.5f}")
+
+
+# The trace of the request being served. Worker threads see it only when the work is submitted
+# with the caller's context (contextvars.copy_context().run), as GameService does.
+_current_trace = contextvars.ContextVar("request_trace", default=None)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def request_trace():
+    trace = RequestTrace()
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    # Times a block into the stage histogram and the current request's trace, and opens an
+    # OpenTelemetry span when a tracer provider is configured (a no-op otherwise)
+    span = _tracer.start_as_current_span(name, attributes=attributes) if _tracer else None
+    if span:
+        span.__enter__()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        registry.observe_stage(name, elapsed)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_stage(name, elapsed)
+        if span:
+            span.__exit__(None, None, None)
+
+
+def record_llm_usage(model: str, prompt_tokens: int = 0, completion_tokens: int = 0):
+    prompt_tokens = int(prompt_tokens or 0)
+    completion_tokens = int(completion_tokens or 0)
+    cost = llm_cost(model, prompt_tokens, completion_tokens)
+    registry.record_llm(model, prompt_tokens, completion_tokens, cost)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_llm(prompt_tokens, completion_tokens, cost)
+    if otel_trace:
+        otel_trace.get_current_span().add_event(
+            "llm.usage", {"model": model, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+        )
+
+
+def instrument_engine(engine):
+    # Times every statement as the "db" stage; engine is a sync Engine or AsyncEngine.sync_engine
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        registry.observe_stage("db", elapsed)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_stage("db", elapsed)
+
+
+def setup_tracing(app):
+    # OTEL_TRACES_ENABLED=true exports spans over OTLP (OTEL_EXPORTER_OTLP_ENDPOINT, default
+    # localhost:4317) and instruments FastAPI; stage() then nests under the request span
+    if os.getenv("OTEL_TRACES_ENABLED", "false").lower() != "true":
+        return False
+    from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+    from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    provider = TracerProvider(resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", "escape-room-ai")}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    otel_trace.set_tracer_provider(provider)
+    FastAPIInstrumentor.instrument_app(app)
+    return True
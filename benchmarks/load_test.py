@@ -0,0 +1,269 @@
+# escape-ai/benchmarks/load_test.py
+#
+# Drives the game API with simulated player sessions and reports throughput,
+# latency percentiles and DB queries per request for each endpoint.
+#
+#   python benchmarks/load_test.py --sessions 200 --concurrency 20
+#   python benchmarks/load_test.py --database-url postgresql://localhost/escape_bench --baseline benchmarks/results/<previous>.json
+#
+# By default the app runs in-process against a fresh SQLite database with the
+# fake LLM provider and the hashing embedder, so no network access is needed.
+
+import argparse
+import asyncio
+import contextvars
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+# Add the parent directory of 'app' to the Python path
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmarks", "results")
+
+# Player session profiles: (weight, puzzles to request, max attempts per puzzle, state polls, chance of a correct attempt)
+SESSION_PROFILES = {
+    "casual": (0.5, 1, 2, 2, 0.5),
+    "engaged": (0.35, 3, 3, 4, 0.6),
+    "spectator": (0.15, 0, 0, 10, 0.0),
+}
+
+_query_counter = contextvars.ContextVar("benchmark_query_counter", default=None)
+
+
+def configure_environment(args, work_dir):
+    database_url = args.database_url or f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("LLM_PROVIDER", "fake")
+    os.environ.setdefault("EMBEDDING_PROVIDER", "hashing")
+    os.environ.setdefault("FAKE_LLM_LATENCY", args.llm_latency)
+    os.environ.setdefault("RAG_INDEX_DIR", os.path.join(work_dir, "faiss_index"))
+    os.environ.setdefault("OTEL_SDK_DISABLED", "true")
+    os.environ.setdefault("CREWAI_TELEMETRY_OPT_OUT", "true")
+    # The benchmark measures the service, not the upstream budget
+    os.environ.setdefault("LLM_RATE_LIMIT_RPM", "0")
+    os.environ.setdefault("LLM_RATE_LIMIT_TPM", "0")
+    return database_url
+
+
+def install_query_counter(engine):
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        counter = _query_counter.get()
+        if counter is not None:
+            counter[0] += 1
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, endpoint: str, latency: float, status: int, queries: int):
+        self.samples.setdefault(endpoint, []).append((latency, status, queries))
+
+    def summary(self, wall_time: float):
+        endpoints = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = sorted(sample[0] for sample in samples)
+            queries = [sample[2] for sample in samples]
+            errors = sum(1 for sample in samples if sample[1] >= 500)
+            endpoints[endpoint] = {
+                "requests": len(samples),
+                "errors": errors,
+                "throughput_rps": len(samples) / wall_time if wall_time else 0.0,
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p95_ms": percentile(latencies, 95) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+                "mean_queries": sum(queries) / len(queries),
+                "max_queries": max(queries),
+            }
+        total = sum(endpoint["requests"] for endpoint in endpoints.values())
+        return {
+            "wall_time_s": wall_time,
+            "total_requests": total,
+            "throughput_rps": total / wall_time if wall_time else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+def percentile(sorted_values: list, pct: float):
+    if not sorted_values:
+        return 0.0
+    rank = (len(sorted_values) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+async def timed_request(client, recorder: Recorder, endpoint: str, method: str, url: str, **kwargs):
+    counter = [0]
+    token = _query_counter.set(counter)
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+    finally:
+        _query_counter.reset(token)
+    recorder.add(endpoint, time.perf_counter() - start, response.status_code, counter[0])
+    return response
+
+
+async def player_session(client, recorder: Recorder, rng: random.Random, session_id: int, args):
+    profile = rng.choices(list(SESSION_PROFILES), weights=[p[0] for p in SESSION_PROFILES.values()])[0]
+    _, puzzle_count, max_attempts, polls, correct_chance = SESSION_PROFILES[profile]
+
+    response = await timed_request(client, recorder, "POST /users/", "POST", "/users/", json={
+        "username": f"player{session_id}-{rng.getrandbits(32)}",
+        "email": f"player{session_id}-{rng.getrandbits(32)}@example.com",
+        "password": "benchmark-password",
+    })
+    if response.status_code != 200:
+        return
+    user_id = response.json()["id"]
+
+    response = await timed_request(client, recorder, "POST /games", "POST", "/games", json={
+        "user_id": user_id,
+        "theme": rng.choice(args.themes),
+        "difficulty": rng.randint(1, 2),
+        "age_group": rng.choice(["kids", "teen", "adult"]),
+    })
+    if response.status_code >= 300:
+        return
+    game_id = response.json()["game_id"]
+
+    for _ in range(polls):
+        response = await timed_request(client, recorder, "GET /games/{id}", "GET", f"/games/{game_id}")
+        if response.status_code == 200 and response.json().get("generation_status") in ("completed", "failed"):
+            if profile != "spectator":
+                break
+        await asyncio.sleep(args.think_time * rng.random())
+
+    for _ in range(puzzle_count):
+        response = await timed_request(client, recorder, "POST /games/{id}/puzzles", "POST", f"/games/{game_id}/puzzles")
+        if response.status_code != 200:
+            continue
+        puzzle = response.json()
+        for attempt in range(max_attempts):
+            correct = rng.random() < correct_chance
+            answer = puzzle.get("answer", "") if correct else f"wrong answer {attempt}"
+            response = await timed_request(client, recorder, "POST /puzzles/check-answer", "POST", "/puzzles/check-answer", json={
+                "puzzle_id": puzzle["id"],
+                "answer": answer,
+            })
+            if response.status_code == 200 and response.json().get("is_correct"):
+                break
+            await asyncio.sleep(args.think_time * rng.random())
+
+    await timed_request(client, recorder, "GET /games/{id}", "GET", f"/games/{game_id}")
+
+
+async def run(args):
+    import httpx
+
+    work_dir = tempfile.mkdtemp(prefix="escape-bench-")
+    database_url = configure_environment(args, work_dir)
+
+    from app.main import app
+    from app.services.generation_service import shutdown_generation_workers
+    from app.utils.database import async_engine, engine
+
+    install_query_counter(engine)
+    install_query_counter(async_engine.sync_engine)
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def bounded_session(session_id: int):
+        async with semaphore:
+            await player_session(client, recorder, random.Random(rng.getrandbits(64)), session_id, args)
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            start = time.perf_counter()
+            await asyncio.gather(*(bounded_session(i) for i in range(args.sessions)))
+            wall_time = time.perf_counter() - start
+        # Let background game generation finish so it does not race the app shutting down
+        await shutdown_generation_workers(wait=True)
+
+    return {
+        "timestamp": datetime.datetime.utcnow().isoformat(),
+        "git_revision": git_revision(),
+        "config": {
+            "sessions": args.sessions,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "think_time": args.think_time,
+            "database": database_url.split(":", 1)[0],
+            "llm_provider": os.environ["LLM_PROVIDER"],
+            "embedding_provider": os.environ["EMBEDDING_PROVIDER"],
+            "llm_latency": os.environ.get("FAKE_LLM_LATENCY"),
+        },
+        **recorder.summary(wall_time),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def print_report(result: dict, baseline: dict = None):
+    print(f"{result['total_requests']} requests in {result['wall_time_s']:.2f}s ({result['throughput_rps']:.1f} req/s)")
+    header = f"{'endpoint':<28}{'reqs':>7}{'err':>5}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}"
+    if baseline:
+        header += f"{'p95 vs base':>13}"
+    print(header)
+    for endpoint, stats in result["endpoints"].items():
+        line = (f"{endpoint:<28}{stats['requests']:>7}{stats['errors']:>5}{stats['throughput_rps']:>9.1f}"
+                f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['mean_queries']:>9.1f}")
+        previous = (baseline or {}).get("endpoints", {}).get(endpoint)
+        if previous and previous["p95_ms"]:
+            line += f"{(stats['p95_ms'] / previous['p95_ms'] - 1) * 100:>+12.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the escape room API")
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--think-time", type=float, default=0.05, help="maximum pause between player actions, in seconds")
+    parser.add_argument("--llm-latency", default="lognormal:-2.3,0.5", help="FAKE_LLM_LATENCY used when it is not already set")
+    parser.add_argument("--themes", nargs="+", default=["Space", "Forest", "Pirates", "Haunted House"])
+    parser.add_argument("--database-url", help="defaults to a fresh SQLite database in a temporary directory")
+    parser.add_argument("--output", help="defaults to benchmarks/results/<timestamp>-<revision>.json")
+    parser.add_argument("--baseline", help="previous result file to compare p95 latencies against")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{result['git_revision'] or 'unknown'}.json")
+    with open(output, "w") as file:
+        json.dump(result, file, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    print_report(result, baseline)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+# escape-ai/benchmarks/password_hashing.py
+#
+# Measures bcrypt throughput and event-loop responsiveness for each combination of
+# hash cost and worker pool size, to pick BCRYPT_ROUNDS and PASSWORD_HASH_WORKERS.
+#
+#   python benchmarks/password_hashing.py --rounds 10 11 12 --workers 1 2 4 8 --requests 64
+#
+# "loop lag" is the worst delay seen by a 10ms ticker running on the event loop while
+# the hashes are in flight; it should stay near zero whatever the pool size.
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the parent directory of 'app' to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.credentials import hash_password_sync, verify_password_sync
+
+TICK = 0.01
+
+
+async def measure_loop_lag(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started - TICK)
+
+
+async def run_case(rounds: int, workers: int, requests: int):
+    loop = asyncio.get_running_loop()
+    stored = hash_password_sync("correct horse battery staple", rounds=rounds)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    stop = asyncio.Event()
+    lags = []
+    ticker = asyncio.create_task(measure_loop_lag(stop, lags))
+
+    async def timed(func, *args):
+        started = time.perf_counter()
+        await loop.run_in_executor(executor, func, *args)
+        return time.perf_counter() - started
+
+    results = {}
+    for name, func, args in (
+        ("hash", hash_password_sync, ("correct horse battery staple", rounds)),
+        ("verify", verify_password_sync, ("correct horse battery staple", stored)),
+    ):
+        started = time.perf_counter()
+        latencies = sorted(await asyncio.gather(*(timed(func, *args) for _ in range(requests))))
+        elapsed = time.perf_counter() - started
+        results[name] = {
+            "per_second": round(requests / elapsed, 2),
+            "p50_ms": round(statistics.median(latencies) * 1000, 1),
+            "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+        }
+
+    stop.set()
+    await ticker
+    executor.shutdown()
+    return {
+        "rounds": rounds,
+        "workers": workers,
+        "requests": requests,
+        **results,
+        "max_loop_lag_ms": round(max(lags, default=0.0) * 1000, 1),
+    }
+
+
+async def main(args):
+    cases = []
+    for rounds in args.rounds:
+        for workers in args.workers:
+            case = await run_case(rounds, workers, args.requests)
+            cases.append(case)
+            print(
+                f"rounds={rounds:<3} workers={workers:<3} "
+                f"hash {case['hash']['per_second']:>8}/s p95 {case['hash']['p95_ms']:>8}ms  "
+                f"verify {case['verify']['per_second']:>8}/s p95 {case['verify']['p95_ms']:>8}ms  "
+                f"loop lag {case['max_loop_lag_ms']}ms"
+            )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"cpu_count": os.cpu_count(), "cases": cases}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark password hashing cost and pool size")
+    parser.add_argument("--rounds", type=int, nargs="+", default=[10, 12])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=32, help="concurrent hashes/verifications per case")
+    parser.add_argument("--output", help="write the results as JSON to this path")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,113 @@
+# escape-ai/benchmarks/rag_index.py
+#
+# Recall vs latency vs memory of the RAG index types on a synthetic, clustered corpus,
+# to choose RAG_INDEX_TYPE, RAG_NPROBE and RAG_EF_SEARCH for a given corpus size.
+#
+#   python benchmarks/rag_index.py --vectors 100000 --dimensions 256 --queries 500
+#   python benchmarks/rag_index.py --vectors 20000 --dimensions 1536 --output /tmp/rag_index.json
+#
+# Recall@k is measured against exact (flat) search. "single" is the median latency of one
+# query at a time, as RAGService.query runs; "batch" is throughput of one query_batch-style call.
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+# Add the parent directory of 'app' to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import faiss
+import numpy as np
+from app.services.vector_index import create_index, index_description, set_search_parameters
+
+# (index type, search parameter name, values to try)
+CASES = [
+    ("flat", None, [None]),
+    ("ivf", "nprobe", [1, 4, 16, 64]),
+    ("ivf_sq8", "nprobe", [4, 16, 64]),
+    ("ivf_pq", "nprobe", [4, 16, 64]),
+    ("hnsw", "efSearch", [16, 64, 256]),
+    ("hnsw_sq8", "efSearch", [64, 256]),
+]
+
+
+def synthetic_corpus(count: int, dimensions: int, clusters: int, seed: int):
+    # Unit vectors scattered around random centres, like embeddings of related themes
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dimensions)).astype(np.float32)
+    labels = rng.integers(0, clusters, count)
+    vectors = centres[labels] + 0.6 * rng.standard_normal((count, dimensions)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def recall(found: np.ndarray, truth: np.ndarray):
+    return float(np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)]))
+
+
+def run(args):
+    corpus = synthetic_corpus(args.vectors, args.dimensions, args.clusters, args.seed)
+    queries = synthetic_corpus(args.queries, args.dimensions, args.clusters, args.seed + 1)
+    exact = faiss.IndexFlatL2(args.dimensions)
+    exact.add(corpus)
+    _, truth = exact.search(queries, args.k)
+
+    results = []
+    for index_type, parameter, values in CASES:
+        description = index_description(args.vectors, args.dimensions, index_type)
+        started = time.perf_counter()
+        index = create_index(description, corpus)
+        index.add(corpus)
+        build_seconds = time.perf_counter() - started
+        size_mb = faiss.serialize_index(index).nbytes / 1e6
+
+        for value in values:
+            if parameter == "nprobe":
+                set_search_parameters(index, nprobe=value)
+            elif parameter == "efSearch":
+                set_search_parameters(index, ef_search=value)
+
+            single = []
+            for query in queries[:args.single_queries]:
+                started = time.perf_counter()
+                index.search(query[None, :], args.k)
+                single.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            _, found = index.search(queries, args.k)
+            batch_seconds = time.perf_counter() - started
+
+            result = {
+                "index": description,
+                "parameter": f"{parameter}={value}" if parameter else "",
+                "recall": round(recall(found, truth), 4),
+                "single_ms": round(statistics.median(single) * 1000, 3),
+                "batch_qps": round(len(queries) / batch_seconds, 1),
+                "build_s": round(build_seconds, 2),
+                "size_mb": round(size_mb, 1),
+            }
+            results.append(result)
+            print(f"{result['index']:<16} {result['parameter']:<14} recall@{args.k} {result['recall']:<7} "
+                  f"single {result['single_ms']:>8}ms  batch {result['batch_qps']:>10}/s  "
+                  f"build {result['build_s']:>6}s  {result['size_mb']:>7}MB")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark FAISS index types for the RAG corpus")
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--single-queries", type=int, default=200, help="queries timed one at a time")
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this path")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
@@ -0,0 +1,21 @@
+# escape-ai/scripts/build_rag_index.py
+#
+# Brings the persisted FAISS index up to date with a themes file or directory
+# (.json, .jsonl, .txt, .md); only new or changed chunks are embedded.
+
+import sys
+import os
+
+# Add the parent directory of 'app' to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+from app.services.rag_service import RAGService, THEMES_FILE
+
+if __name__ == "__main__":
+    load_dotenv()
+    file_path = sys.argv[1] if len(sys.argv) > 1 else THEMES_FILE
+    index_path = RAGService().build_index(file_path)
+    if index_path is None:
+        sys.exit(f"No index was built from {file_path}")
+    print(f"Index written to {index_path}")
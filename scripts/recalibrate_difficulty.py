@@ -0,0 +1,138 @@
+# escape-ai/scripts/recalibrate_difficulty.py
+#
+# Rebuilds the adaptive difficulty statistics on every game and user from the full puzzle
+# history in one vectorized pass, e.g. after changing DIFFICULTY_* settings or migrating.
+
+import sys
+import os
+
+# Add the parent directory of 'app' to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import numpy as np
+from dotenv import load_dotenv
+from sqlalchemy import select, update
+from app.models.models import Game, Puzzle, User
+from app.services.difficulty import EWMA_ALPHA, MAX_ATTEMPTS, MAX_TIME, SLOPE
+from app.utils.database import SessionLocal
+
+FETCH_SIZE = 100000
+WRITE_SIZE = 10000
+
+
+def load_history(db):
+    # Solved puzzles ordered by game and creation, fetched in chunks into column arrays
+    statement = (
+        select(
+            Puzzle.game_id,
+            Game.user_id,
+            Puzzle.difficulty,
+            Puzzle.solved_on_attempt,
+            Puzzle.attempts,
+            Puzzle.time_spent,
+        )
+        .join(Game, Game.id == Puzzle.game_id)
+        .where(Puzzle.solved.is_(True))
+        .order_by(Puzzle.game_id, Puzzle.id)
+        .execution_options(yield_per=FETCH_SIZE)
+    )
+    chunks = []
+    for partition in db.execute(statement).partitions():
+        chunks.append(np.array(
+            [(g, u if u is not None else -1, d, s if s is not None else a, t) for g, u, d, s, a, t in partition],
+            dtype=np.float64,
+        ))
+    if not chunks:
+        return None
+    history = np.concatenate(chunks)
+    return {
+        "game_id": history[:, 0].astype(np.int64),
+        "user_id": history[:, 1].astype(np.int64),
+        "difficulty": np.nan_to_num(history[:, 2], nan=1.0),
+        "attempts": np.nan_to_num(history[:, 3], nan=1.0),
+        "time_spent": np.nan_to_num(history[:, 4], nan=0.0),
+    }
+
+
+def performance_scores(attempts, time_spent):
+    attempt_factor = (np.clip(attempts, 1, MAX_ATTEMPTS) - 1) / (MAX_ATTEMPTS - 1)
+    time_factor = np.clip(time_spent, 0, MAX_TIME) / MAX_TIME
+    return 1.0 - (attempt_factor + time_factor) / 2
+
+
+def skill_estimates(difficulty, scores):
+    # Inverts logistic(SLOPE * (skill - difficulty)) = score for each solve
+    clipped = np.clip(scores, 0.05, 0.95)
+    return difficulty + np.log(clipped / (1 - clipped)) / SLOPE
+
+
+def ewma_weights(group_ids):
+    # group_ids must be sorted. Weights reproduce an exponentially weighted mean seeded with the
+    # first value of each group: the last row gets ALPHA, the one before ALPHA * (1 - ALPHA), ...
+    _, starts, counts = np.unique(group_ids, return_index=True, return_counts=True)
+    group_index = np.repeat(np.arange(len(starts)), counts)
+    rank = np.arange(len(group_ids)) - starts[group_index]
+    age = counts[group_index] - 1 - rank
+    weights = EWMA_ALPHA * (1 - EWMA_ALPHA) ** age
+    weights[rank == 0] = (1 - EWMA_ALPHA) ** age[rank == 0]
+    return weights
+
+
+def grouped(ids, values, weights=None):
+    unique_ids, inverse, counts = np.unique(ids, return_inverse=True, return_counts=True)
+    if weights is None:
+        sums = np.bincount(inverse, weights=values)
+        return unique_ids, sums / counts, counts
+    sums = np.bincount(inverse, weights=values * weights)
+    totals = np.bincount(inverse, weights=weights)
+    return unique_ids, sums / totals, counts
+
+
+def recalibrate(db, dry_run: bool = False):
+    history = load_history(db)
+    if history is None:
+        print("No solved puzzles; nothing to recalibrate")
+        return
+
+    scores = performance_scores(history["attempts"], history["time_spent"])
+    skills = skill_estimates(history["difficulty"], scores)
+    weights = ewma_weights(history["game_id"])
+
+    game_ids, game_skill, game_counts = grouped(history["game_id"], skills, weights)
+    _, game_attempts, _ = grouped(history["game_id"], history["attempts"], weights)
+    _, game_time, _ = grouped(history["game_id"], history["time_spent"], weights)
+    known_users = history["user_id"] >= 0
+    user_ids, user_skill, user_counts = grouped(history["user_id"][known_users], skills[known_users])
+
+    print(f"{len(scores)} solved puzzles, {len(game_ids)} games, {len(user_ids)} users")
+    print(f"Game skill: mean {game_skill.mean():.3f}, p10 {np.percentile(game_skill, 10):.3f}, p90 {np.percentile(game_skill, 90):.3f}")
+    if dry_run:
+        return
+
+    game_rows = [
+        {"id": int(i), "skill_rating": float(s), "ewma_attempts": float(a), "ewma_time_spent": float(t), "rated_puzzles": int(n)}
+        for i, s, a, t, n in zip(game_ids, game_skill, game_attempts, game_time, game_counts)
+    ]
+    user_rows = [
+        {"id": int(i), "skill_rating": float(s), "rated_puzzles": int(n)}
+        for i, s, n in zip(user_ids, user_skill, user_counts)
+    ]
+    for model, rows in ((Game, game_rows), (User, user_rows)):
+        for start in range(0, len(rows), WRITE_SIZE):
+            db.execute(update(model), rows[start:start + WRITE_SIZE])
+    db.commit()
+    print(f"Updated {len(game_rows)} games and {len(user_rows)} users")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Recompute skill ratings from the puzzle history")
+    parser.add_argument("--dry-run", action="store_true", help="compute and summarize without writing")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        recalibrate(db, dry_run=args.dry_run)
+    finally:
+        db.close()
@@ -0,0 +1,32 @@
+from app.services.answer_matching import accepted_forms, match_answer, normalize_answer
+
+
+def test_unit_words_stay_separate_numbers():
+    assert normalize_answer("one two three") == "1 2 3"
+    assert normalize_answer("seven eleven") == "7 11"
+    assert normalize_answer("nineteen eighty four") == "19 84"
+
+
+def test_sequence_of_unit_words_does_not_match_their_sum():
+    assert not match_answer("six", accepted_forms("one two three")).is_correct
+    assert match_answer("1 2 3", accepted_forms("one two three")).is_correct
+
+
+def test_and_only_connects_after_a_scale_word():
+    assert normalize_answer("one and two") == "1 and 2"
+    assert normalize_answer("one hundred and five") == "105"
+    assert normalize_answer("two thousand and twenty") == "2020"
+
+
+def test_compound_numbers():
+    assert normalize_answer("twenty one") == "21"
+    assert normalize_answer("one thousand two hundred thirty four") == "1234"
+    assert normalize_answer("twenty twenty") == "20 20"
+
+
+def test_thousands_separators_collapse():
+    assert normalize_answer("2,000") == "2000"
+    assert normalize_answer("2 000") == "2000"
+    assert normalize_answer("12,345,678") == "12345678"
+    assert match_answer("two thousand", accepted_forms("2,000")).is_correct
+    assert normalize_answer("1 2 3") == "1 2 3"
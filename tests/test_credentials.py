@@ -0,0 +1,6 @@
+from app.services import credentials
+
+
+def test_dummy_hash_uses_the_configured_cost():
+    assert not credentials.needs_rehash(credentials._DUMMY_HASH.decode("utf-8"))
+    assert int(credentials._DUMMY_HASH.split(b"$")[2]) == credentials.BCRYPT_ROUNDS
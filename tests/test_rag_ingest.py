@@ -0,0 +1,64 @@
+import os
+
+from app.services import vector_index
+from app.services.rag_ingestion import EmbeddingCache
+from app.services.rag_service import RAGService
+
+TOPICS = [
+    "volcano lava eruption magma", "ocean whale coral reef", "desert camel sand dune",
+    "forest owl pine moss", "space rocket orbit comet", "castle knight dragon tower",
+    "jungle parrot vine monkey", "arctic penguin glacier ice", "pirate ship treasure map",
+    "library book scroll ink", "museum statue painting relic", "laboratory beaker chemical spark",
+]
+
+
+def test_removing_chunks_from_an_ivf_index_keeps_the_others_searchable(tmp_path, monkeypatch):
+    monkeypatch.setenv("EMBEDDING_PROVIDER", "hashing")
+    monkeypatch.setattr(vector_index, "INDEX_FACTORY", "IVF2,Flat")
+    source = tmp_path / "corpus"
+    source.mkdir()
+    for number, topic in enumerate(TOPICS):
+        (source / f"{number:02d}.txt").write_text(topic)
+
+    service = RAGService(index_dir=str(tmp_path / "index"),
+                         embedding_cache=EmbeddingCache(str(tmp_path / "cache.sqlite3")))
+    service.ingest(str(source))
+    assert service.index_description == "IVF2,Flat"
+
+    for number in range(0, len(TOPICS), 2):
+        os.remove(source / f"{number:02d}.txt")
+    added, removed, _ = service.ingest(str(source))
+    assert (added, removed) == (0, len(TOPICS) // 2)
+
+    remaining = TOPICS[1::2]
+    for topic in remaining:
+        results = service.query(topic, k=len(remaining))
+        assert results[0] == topic
+        assert set(results) == set(remaining)
+
+
+def test_emptying_the_corpus_removes_the_persisted_index(tmp_path, monkeypatch):
+    monkeypatch.setenv("EMBEDDING_PROVIDER", "hashing")
+    source = tmp_path / "corpus"
+    source.mkdir()
+    for number, topic in enumerate(TOPICS[:3]):
+        (source / f"{number:02d}.txt").write_text(topic)
+
+    def open_service():
+        return RAGService(index_dir=str(tmp_path / "index"),
+                          embedding_cache=EmbeddingCache(str(tmp_path / "cache.sqlite3")))
+
+    target_dir = open_service().build_index(str(source))
+    assert os.path.isdir(target_dir)
+
+    for path in source.iterdir():
+        os.remove(path)
+    service = open_service()
+    service.load_index(str(source))
+    assert service.vector_store is None
+    assert not os.path.exists(target_dir)
+
+    restarted = open_service()
+    restarted.load_index(str(source))
+    assert restarted.vector_store is None
+    assert restarted.query(TOPICS[0]) == []